@@ -1,113 +1,84 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+import itertools
+import json
+import numpy as np
+import os
 import sqlite3
 import re
-import bcrypt
+import time
+import cache
+import crew
+import db
+import distances
+import events
+import fleet
+import hashing
+import metrics
+import migrations
+import qualifications
+import rostering
+import routing
+import sessions
+import utilization
+from db import get_db
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
+db.init_app(app)
+metrics.init_app(app)
+
+response_cache = cache.ResponseCache(
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_BYTES', 32 * 1024 * 1024)),
+    ttl=int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+)
+
+route_index = routing.RouteIndex()
+
+# Minimum time between landing one flight and departing the next for the same crew member
+CREW_MIN_REST = int(os.environ.get('CREW_MIN_REST_MINUTES', 30)) * 60
+crew_index = crew.CrewIndex()
+
+# Minimum time on the ground between two flights of the same airframe
+AIRCRAFT_MIN_TURNAROUND = int(os.environ.get('AIRCRAFT_MIN_TURNAROUND_MINUTES', 30)) * 60
+fleet_index = fleet.FleetIndex()
+
+# Pilots by type rating, for finding who may fly an airframe
+qualification_index = qualifications.QualificationIndex()
+
+# City coordinates and cached distances per flight path
+distance_index = distances.DistanceIndex()
+
+# The fleet and crew schedules as NumPy columns, for utilization reports
+airframe_columns = utilization.RosterColumns(fleet_index)
+crew_columns = utilization.RosterColumns(crew_index)
+
+def crew_conflict_message(staff_id, flight_num, conflicts):
+    return f"Crew member {staff_id} is on flight {', '.join(map(str, conflicts))} within {CREW_MIN_REST // 60} minutes of flight {flight_num}"
+
+WRITE_LOCK_ATTEMPTS = 3
+
+def write_lock_with(cur, indexes):
+    # BEGIN IMMEDIATE with the indexes already matching the database. A rebuild can take seconds on
+    # a large table, so it happens before the write lock is taken, and if another writer got in
+    # between, the lock is let go and the indexes caught up again. Only when that keeps happening
+    # is the last rebuild done holding the lock
+    conn = cur.connection
+    for attempt in range(WRITE_LOCK_ATTEMPTS):
+        for index in indexes:
+            with index.reading(conn):
+                pass
+        cur.execute('BEGIN IMMEDIATE')
+        if attempt == WRITE_LOCK_ATTEMPTS - 1 or all(index.is_current(conn) for index in indexes):
+            return
+        conn.rollback()
 
 def init_db():
+    conn = None
     try:
-        conn = sqlite3.connect('airplane.db')
-        cur = conn.cursor()
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Airplane (
-                numSer INTEGER PRIMARY KEY,
-                manufacturer VARCHAR(100),
-                modelNum VARCHAR(100),
-                typeRating VARCHAR(100)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS interCity (
-                cityID INTEGER PRIMARY KEY,
-                cityName VARCHAR(100),
-                cityCountry VARCHAR(100)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Staff (
-                id VARCHAR(100) PRIMARY KEY,
-                firstName VARCHAR(100),
-                surname VARCHAR(100),
-                salary FLOAT
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Contact (
-                id INTEGER PRIMARY KEY,
-                staffID VARCHAR(100),
-                homeAddress VARCHAR(100),
-                workAddress VARCHAR(100),
-                homePhoneNum VARCHAR(100),
-                workPhoneNum VARCHAR(100),
-                FOREIGN KEY(staffID) REFERENCES Staff(id)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Pilot (
-                id VARCHAR(100) PRIMARY KEY,
-                typeRating VARCHAR(100),
-                FOREIGN KEY(id) REFERENCES Staff(id)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Flight (
-                flightNum INTEGER PRIMARY KEY,
-                numSer INTEGER,
-                origin VARCHAR(100),
-                destination VARCHAR(100),
-                arrTime TIME,
-                departureTime TIME,
-                FOREIGN KEY (numSer) REFERENCES Airplane(numSer)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS flightCrew (
-                staffID VARCHAR(100),
-                flightNum INTEGER,
-                PRIMARY KEY (staffID, flightNum),
-                FOREIGN KEY (staffID) REFERENCES Staff(id),
-                FOREIGN KEY (flightNum) REFERENCES Flight(flightNum)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS flightPath (
-                flightNum INTEGER,
-                cityID INTEGER,
-                PRIMARY KEY (flightNum, cityID),
-                FOREIGN KEY (flightNum) REFERENCES Flight(flightNum),
-                FOREIGN KEY (cityID) REFERENCES interCity(cityID)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Passenger (
-                passengerID VARCHAR(100) PRIMARY KEY,
-                firstName VARCHAR(100),
-                surname VARCHAR(100),
-                password BLOB
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS PassengerContact (
-                passengerID VARCHAR(100) PRIMARY KEY,
-                homeAddress VARCHAR(100),
-                workAddress VARCHAR(100),
-                homePhoneNumber VARCHAR(100),
-                workPhoneNumber VARCHAR(100),
-                FOREIGN KEY (passengerID) REFERENCES Passenger(passengerID)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Booking (
-                passengerID VARCHAR(100),
-                flightNum Integer,
-                PRIMARY KEY (passengerID, flightNum),
-                FOREIGN KEY (passengerID) REFERENCES Passenger(passengerID),
-                FOREIGN KEY (flightNum) REFERENCES Flight(flightNum)
-            )
-        ''')
+        conn = sqlite3.connect(db.DATABASE)
+        migrations.migrate(conn)
+        sessions.sweep_revoked(conn)
         conn.commit()
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
@@ -117,29 +88,46 @@ def init_db():
 
 init_db()
 
+def session_secret():
+    # SECRET_KEY, or else a key kept in the database so tokens stay valid across workers and restarts
+    if os.environ.get('SECRET_KEY'):
+        return os.environ['SECRET_KEY']
+    conn = sqlite3.connect(db.DATABASE)
+    try:
+        return sessions.stored_secret(conn)
+    finally:
+        conn.close()
+
+app.config['SECRET_KEY'] = session_secret()
+session_manager = sessions.SessionManager(app.config['SECRET_KEY'], max_age=int(os.environ.get('SESSION_MAX_AGE', 12 * 60 * 60)))
+
 @app.route('/api/intercity', methods=['POST'])
 def add_city():
     data = request.get_json()
     cityID = data.get('cityID')
     cityName = data.get('cityName')
     cityCountry = data.get('cityCountry')
+    # Optional coordinates in degrees, needed for route distances
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
 
     if not cityName or not cityCountry:
         return jsonify({'message': 'All fields are required', 'status': 'error'}), 400
+    for name, value, bound in (('latitude', latitude, 90), ('longitude', longitude, 180)):
+        if value is not None and (type(value) not in (int, float) or not -bound <= value <= bound):
+            return jsonify({'message': f'{name} must be a number between -{bound} and {bound}', 'status': 'error'}), 400
 
-    conn = sqlite3.connect('airplane.db')
+    conn = get_db()
     cur = conn.cursor()
     try:
         cur.execute(
-            'INSERT INTO interCity (cityID, cityName, cityCountry) VALUES (?, ?, ?)',
-            (cityID, cityName, cityCountry)
+            'INSERT INTO interCity (cityID, cityName, cityCountry, latitude, longitude) VALUES (?, ?, ?, ?, ?)',
+            (cityID, cityName, cityCountry, latitude, longitude)
         )
         conn.commit()
         city_id = cur.lastrowid
     except sqlite3.Error as e:
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
 
     return jsonify({'message': 'City added successfully', 'status': 'success', 'id': city_id}), 200
 
@@ -150,28 +138,48 @@ def add_airplane():
     manufacturer = data.get('manufacturer')
     modelNum = data.get('modelNumber')
     typeRating = data.get('typeRating')
+    # Optional seat count; without one the airplane's flights take any number of bookings
+    capacity = data.get('capacity')
 
     if not serialNum or not manufacturer or not modelNum or not typeRating:
         return jsonify({'message': 'All fields are required', 'status': 'error'}), 400
+    if capacity is not None and (type(capacity) is not int or capacity < 0):
+        return jsonify({'message': 'capacity must be a non-negative integer', 'status': 'error'}), 400
 
-    conn = sqlite3.connect('airplane.db')
+    conn = get_db()
     cur = conn.cursor()
     try:
         cur.execute(
-            'INSERT INTO Airplane (numSer, manufacturer, modelNum, typeRating) VALUES (?, ?, ?, ?)',
-            (serialNum, manufacturer, modelNum, typeRating)
+            'INSERT INTO Airplane (numSer, manufacturer, modelNum, typeRating, capacity) VALUES (?, ?, ?, ?, ?)',
+            (serialNum, manufacturer, modelNum, typeRating, capacity)
         )
         conn.commit()
     except sqlite3.IntegrityError:
         return jsonify({'message': 'Airplane with this serial number already exists', 'status': 'error'}), 409
     except sqlite3.Error as e:
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
 
     return jsonify({'message': 'Airplane added successfully', 'status': 'success', 'id': serialNum}), 200
 
 
+def allocate_staff_id(cur, base_id):
+    # IDs run base, base1, base2, ... and staffIdCounter remembers the last suffix per base.
+    # The first time a base is seen the counter is seeded from one range scan of the Staff primary key
+    cur.execute('UPDATE staffIdCounter SET lastSuffix = lastSuffix + 1 WHERE baseID = ? RETURNING lastSuffix', (base_id,))
+    row = cur.fetchone()
+    if row:
+        suffix = row[0]
+    else:
+        cur.execute('SELECT id FROM Staff WHERE id = ? OR (id >= ? AND id < ?)', (base_id, base_id + '0', base_id + ':'))
+        taken = [staff_id[len(base_id):] for (staff_id,) in cur.fetchall()]
+        suffixes = [int(tail) for tail in taken if tail.isdigit()]
+        if suffixes:
+            suffix = max(suffixes) + 1
+        else:
+            suffix = 1 if '' in taken else 0
+        cur.execute('INSERT INTO staffIdCounter (baseID, lastSuffix) VALUES (?, ?)', (base_id, suffix))
+    return f'{base_id}{suffix}' if suffix else base_id
+
 @app.route('/api/staff', methods=['POST'])
 def add_staff():
     data = request.get_json()
@@ -186,35 +194,34 @@ def add_staff():
     if not firstName or not surname or not salary or not homeAddress or not workAddress or not homePhoneNum or not workPhoneNum:
         return jsonify({'message': 'All fields are required', 'status': 'error'}), 400
 
-    conn = sqlite3.connect('airplane.db')
+    conn = get_db()
     cur = conn.cursor()
 
     # Generate initial ID
     base_id = (firstName[0] + surname).lower()
-    staff_id = base_id
-    id_suffix = 1
-
-    # Check for uniqueness and adjust ID if necessary
-    cur.execute('SELECT id FROM Staff WHERE id = ?', (staff_id,))
-    while cur.fetchone() is not None:
-        staff_id = f"{base_id}{id_suffix}"
-        id_suffix += 1
-        cur.execute('SELECT id FROM Staff WHERE id = ?', (staff_id,))
 
     try:
-        cur.execute(
-            'INSERT INTO Staff (id, firstName, surname, salary) VALUES (?, ?, ?, ?)',
-            (staff_id, firstName, surname, salary)
-        )
+        # Take the write lock first so concurrent requests cannot be handed the same ID
+        cur.execute('BEGIN IMMEDIATE')
+        staff_id = allocate_staff_id(cur, base_id)
+        while True:
+            try:
+                cur.execute(
+                    'INSERT INTO Staff (id, firstName, surname, salary) VALUES (?, ?, ?, ?)',
+                    (staff_id, firstName, surname, salary)
+                )
+                break
+            except sqlite3.IntegrityError:
+                # Taken by a row written outside the allocator, move the counter past it
+                staff_id = allocate_staff_id(cur, base_id)
         cur.execute(
             'INSERT INTO Contact (staffID, homeAddress, workAddress, homePhoneNum, workPhoneNum) VALUES (?, ?, ?, ?, ?)',
             (staff_id, homeAddress, workAddress, homePhoneNum, workPhoneNum)
         )
         conn.commit()
     except sqlite3.Error as e:
+        conn.rollback()
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
 
     return jsonify({'message': 'Staff and contact added successfully', 'status': 'success', 'id': staff_id}), 200
 
@@ -227,7 +234,7 @@ def add_pilot():
     if not staff_id or not type_rating:
         return jsonify({'message': 'All fields are required', 'status': 'error'}), 400
 
-    conn = sqlite3.connect('airplane.db')
+    conn = get_db()
     cur = conn.cursor()
     try:
         # Check if the staff member exists in the Staff table
@@ -241,12 +248,12 @@ def add_pilot():
             'INSERT INTO Pilot (id, typeRating) VALUES (?, ?)',
             (staff_id, type_rating)
         )
+        change = qualification_index.pending(conn, [1])
         conn.commit()
     except sqlite3.Error as e:
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
 
+    qualification_index.apply(change, lambda: qualification_index.add([(staff_id, type_rating)]))
     return jsonify({'message': 'Pilot added successfully', 'status': 'success', 'id': staff_id}), 200
 
 
@@ -264,9 +271,12 @@ def add_flight():
     if not flight_num or not num_ser or not origin or not destination or not arr_time or not departure_time or not pilot_id:
         return jsonify({'message': 'All fields are required', 'status': 'error'}), 400
 
-    conn = sqlite3.connect('airplane.db')
+    conn = get_db()
     cur = conn.cursor()
     try:
+        # Taken first so the pilot's roster cannot change between the conflict check and the insert
+        write_lock_with(cur, [fleet_index, crew_index])
+
         # Check if the pilotID exists in the Pilot table
         cur.execute('SELECT typeRating FROM Pilot WHERE id = ?', (pilot_id,))
         pilot_rating = cur.fetchone()
@@ -279,10 +289,27 @@ def add_flight():
         if not plane_rating:
             return jsonify({'message': f'Airplane serial number {num_ser} does not exist', 'status': 'error'}), 400
 
-        # Compare ratings (assuming A is the highest and F is the lowest)
-        if pilot_rating[0] > plane_rating[0]:
+        # A is the highest rating and F the lowest
+        if not qualifications.qualified(pilot_rating[0], plane_rating[0]):
             return jsonify({'message': f'Pilot rating {pilot_rating[0]} is not sufficient for Airplane rating {plane_rating[0]}', 'status': 'error'}), 400
 
+        # The airframe must be free and in the right place, and the pilot free
+        window = crew.duty_window(departure_time, arr_time)
+        aircraft_conflicts = []
+        conflicts = []
+        if window:
+            with fleet_index.reading(conn):
+                aircraft_conflicts = fleet_index.check(fleet_index.rotation(as_int(num_ser)), window, origin, destination, AIRCRAFT_MIN_TURNAROUND)
+            with crew_index.reading(conn):
+                conflicts = crew_index.conflicts(pilot_id, *window, CREW_MIN_REST)
+        if (aircraft_conflicts or conflicts) and not data.get('allowConflict'):
+            result = {'message': aircraft_conflicts[0]['message'] if aircraft_conflicts else crew_conflict_message(pilot_id, flight_num, conflicts), 'status': 'error'}
+            if aircraft_conflicts:
+                result['aircraftConflicts'] = aircraft_conflicts
+            if conflicts:
+                result['conflicts'] = conflicts
+            return jsonify(result), 409
+
         # Insert into Flight table
         cur.execute(
             'INSERT INTO Flight (flightNum, numSer, origin, destination, arrTime, departureTime) VALUES (?, ?, ?, ?, ?, ?)',
@@ -294,14 +321,26 @@ def add_flight():
             'INSERT INTO flightCrew (staffID, flightNum) VALUES (?, ?)',
             (pilot_id, flight_num)
         )
-        
+        change = route_index.pending(conn, [1])
+        crew_change = crew_index.pending(conn, [1, 1])
+        fleet_change = fleet_index.pending(conn, [1])
+        added = select_in(cur, FLIGHT_COLUMNS + ' FROM Flight WHERE flightNum', [flight_num])
+
         conn.commit()
     except sqlite3.Error as e:
+        conn.rollback()
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
 
-    return jsonify({'message': 'Flight and pilot added successfully', 'status': 'success', 'flightNum': flight_num, 'pilotID': pilot_id}), 200
+    route_index.apply(change, lambda: route_index.add_flights([(int(flight_num), origin, destination, arr_time, departure_time)]))
+    crew_index.apply(crew_change, lambda: crew_index.add([(pilot_id, *window, int(flight_num))] if window else []))
+    fleet_index.apply(fleet_change, lambda: fleet_index.add([(as_int(num_ser), *window, int(flight_num), origin, destination)] if window else []))
+    publish_flights(added)
+    result = {'message': 'Flight and pilot added successfully', 'status': 'success', 'flightNum': flight_num, 'pilotID': pilot_id}
+    if aircraft_conflicts:
+        result['aircraftConflicts'] = aircraft_conflicts
+    if conflicts:
+        result['conflicts'] = conflicts
+    return jsonify(result), 200
 
 @app.route('/api/flightcrew', methods=['POST'])
 def add_flight_crew():
@@ -312,9 +351,12 @@ def add_flight_crew():
     if not staff_id or not flight_num:
         return jsonify({'message': 'Both staffID and flightNum are required', 'status': 'error'}), 400
 
-    conn = sqlite3.connect('airplane.db')
+    conn = get_db()
     cur = conn.cursor()
     try:
+        # Taken first so the roster cannot change between the conflict check and the insert
+        write_lock_with(cur, [crew_index])
+
         # Check if staffID exists in the Staff table
         cur.execute('SELECT id FROM Staff WHERE id = ?', (staff_id,))
         staff = cur.fetchone()
@@ -322,41 +364,60 @@ def add_flight_crew():
             return jsonify({'message': f'Staff ID {staff_id} does not exist', 'status': 'error'}), 400
 
         # Check if flightNum exists in the Flight table
-        cur.execute('SELECT flightNum FROM Flight WHERE flightNum = ?', (flight_num,))
+        cur.execute('SELECT flightNum, departureTime, arrTime FROM Flight WHERE flightNum = ?', (flight_num,))
         flight = cur.fetchone()
         if not flight:
             return jsonify({'message': f'Flight number {flight_num} does not exist', 'status': 'error'}), 400
 
+        # Reject double bookings unless the caller explicitly accepts them
+        window = crew.duty_window(flight[1], flight[2])
+        conflicts = []
+        if window:
+            with crew_index.reading(conn):
+                conflicts = [other for other in crew_index.conflicts(staff_id, *window, CREW_MIN_REST) if other != flight[0]]
+        if conflicts and not data.get('allowConflict'):
+            return jsonify({'message': crew_conflict_message(staff_id, flight_num, conflicts), 'status': 'error', 'conflicts': conflicts}), 409
+
         # If both exist, insert into flightCrew
         cur.execute(
             'INSERT INTO flightCrew (staffID, flightNum) VALUES (?, ?)',
             (staff_id, flight_num)
         )
+        change = crew_index.pending(conn, [1, 0])
         conn.commit()
     except sqlite3.IntegrityError as e:
+        conn.rollback()
         # Check for unique constraint violation
         if 'UNIQUE constraint failed' in str(e):
             return jsonify({'message': f'Crew member {staff_id} is already assigned to flight {flight_num}', 'status': 'error'}), 400
         return jsonify({'message': str(e), 'status': 'error'}), 500
     except sqlite3.Error as e:
+        conn.rollback()
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
 
-    return jsonify({'message': 'Crew member added to flight successfully', 'status': 'success', 'staffID': staff_id, 'flightNum': flight_num}), 200
+    crew_index.apply(change, lambda: crew_index.add([(staff_id, *window, flight[0])] if window else []))
+    result = {'message': 'Crew member added to flight successfully', 'status': 'success', 'staffID': staff_id, 'flightNum': flight_num}
+    if conflicts:
+        result['conflicts'] = conflicts
+    return jsonify(result), 200
 
 @app.route('/api/flightpath', methods=['POST'])
 def add_flight_path():
     data = request.get_json()
     flight_num = data.get('flightNum')
     city_id = data.get('cityID')
+    # Where on the path the city goes, counting from 0; by default after the last one
+    position = data.get('position')
 
     if not flight_num or not city_id:
         return jsonify({'message': 'Both flightNum and cityID are required', 'status': 'error'}), 400
+    if position is not None and (type(position) is not int or position < 0):
+        return jsonify({'message': 'position must be a non-negative integer', 'status': 'error'}), 400
 
-    conn = sqlite3.connect('airplane.db')
+    conn = get_db()
     cur = conn.cursor()
     try:
+        cur.execute('BEGIN IMMEDIATE')
         # Check if flightNum exists in the Flight table
         cur.execute('SELECT flightNum FROM Flight WHERE flightNum = ?', (flight_num,))
         flight = cur.fetchone()
@@ -370,18 +431,442 @@ def add_flight_path():
             return jsonify({'message': f'City ID {city_id} does not exist', 'status': 'error'}), 400
 
         # If both exist, insert into flightPath
-        cur.execute(
-            'INSERT INTO flightPath (flightNum, cityID) VALUES (?, ?)',
-            (flight_num, city_id)
-        )
+        if position is None:
+            cur.execute(
+                'INSERT INTO flightPath (flightNum, cityID) VALUES (?, ?)',
+                (flight_num, city_id)
+            )
+        else:
+            # Make room: move the later entries to negative positions one further on, then back,
+            # so no two entries share a position at any point
+            cur.execute('UPDATE flightPath SET seq = -seq - 2 WHERE flightNum = ? AND seq >= ?', (flight_num, position))
+            cur.execute('UPDATE flightPath SET seq = -seq - 1 WHERE flightNum = ? AND seq < 0', (flight_num,))
+            cur.execute(
+                'INSERT INTO flightPath (flightNum, cityID, seq) '
+                'SELECT ?, ?, MIN(?, COALESCE(MAX(seq) + 1, 0)) FROM flightPath WHERE flightNum = ? AND seq < ?',
+                (flight_num, city_id, position, flight_num, position)
+            )
         conn.commit()
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        if 'UNIQUE constraint failed' in str(e):
+            return jsonify({'message': f'City {city_id} is already on the path of flight {flight_num}', 'status': 'error'}), 400
+        return jsonify({'message': str(e), 'status': 'error'}), 500
     except sqlite3.Error as e:
+        conn.rollback()
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
 
     return jsonify({'message': 'Flight path added successfully', 'status': 'success', 'flightNum': flight_num, 'cityID': city_id}), 200
 
+BULK_CHUNK_SIZE = 500
+
+def bulk_rows():
+    # Bulk endpoints take a JSON array or newline-delimited JSON objects
+    if request.mimetype == 'application/x-ndjson':
+        rows = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+    else:
+        rows = request.get_json()
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError('Expected a JSON array or NDJSON stream of objects')
+    # Every field is a single value; a list or object would not even hash into the lookup sets
+    for index, row in enumerate(rows):
+        for field, value in row.items():
+            if isinstance(value, (list, dict)):
+                raise ValueError(f'Row {index}: {field} must be a single value')
+    return rows
+
+def as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def select_in(cur, query, keys):
+    # Runs "<query> IN (...)" over the keys in chunks so large batches stay under SQLite's variable limit
+    keys = list(keys)
+    rows = []
+    for i in range(0, len(keys), BULK_CHUNK_SIZE):
+        chunk = keys[i:i + BULK_CHUNK_SIZE]
+        cur.execute(f"{query} IN ({', '.join('?' * len(chunk))})", chunk)
+        rows.extend(cur.fetchall())
+    return rows
+
+def bulk_response(inserted, errors, noun):
+    if not errors:
+        status = 'success'
+    elif inserted:
+        status = 'partial'
+    else:
+        status = 'error'
+    return jsonify({
+        'message': f'{inserted} {noun} added, {len(errors)} rejected',
+        'status': status,
+        'inserted': inserted,
+        'errors': errors
+    }), 400 if status == 'error' else 200
+
+@app.route('/api/flight/bulk', methods=['POST'])
+def add_flights_bulk():
+    try:
+        rows = bulk_rows()
+    except ValueError as e:
+        return jsonify({'message': str(e), 'status': 'error'}), 400
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        write_lock_with(cur, [fleet_index, crew_index])
+        pilots = dict(select_in(cur, 'SELECT id, typeRating FROM Pilot WHERE id', {row.get('pilotID') for row in rows}))
+        planes = dict(select_in(cur, 'SELECT numSer, typeRating FROM Airplane WHERE numSer', {as_int(row.get('numSer')) for row in rows}))
+        taken = {row[0] for row in select_in(cur, 'SELECT flightNum FROM Flight WHERE flightNum', {as_int(row.get('flightNum')) for row in rows})}
+
+        errors = []
+        flights = []
+        crew_rows = []
+        # Pilot duties and airframe rotations including the rows accepted so far in this batch
+        duties = {}
+        rotations = {}
+        with fleet_index.reading(conn), crew_index.reading(conn):
+            for index, row in enumerate(rows):
+                flight_num = as_int(row.get('flightNum'))
+                num_ser = as_int(row.get('numSer'))
+                pilot_id = row.get('pilotID')
+                fields = (row.get('origin'), row.get('destination'), row.get('arrTime'), row.get('departureTime'))
+                window = crew.duty_window(fields[3], fields[2])
+                aircraft_conflicts = []
+                conflicts = []
+                if window:
+                    if num_ser not in rotations:
+                        rotations[num_ser] = fleet_index.draft(num_ser)
+                    aircraft_conflicts = fleet_index.check(rotations[num_ser], window, fields[0], fields[1], AIRCRAFT_MIN_TURNAROUND)
+                    conflicts = crew_index.conflicts(pilot_id, *window, CREW_MIN_REST) + crew.overlapping(duties.get(pilot_id, []), *window, CREW_MIN_REST)
+
+                if not flight_num or not num_ser or not pilot_id or not all(fields):
+                    message = 'All fields are required'
+                elif pilot_id not in pilots:
+                    message = f'Pilot ID {pilot_id} does not exist'
+                elif num_ser not in planes:
+                    message = f'Airplane serial number {num_ser} does not exist'
+                elif not qualifications.qualified(pilots[pilot_id], planes[num_ser]):
+                    message = f'Pilot rating {pilots[pilot_id]} is not sufficient for Airplane rating {planes[num_ser]}'
+                elif flight_num in taken:
+                    message = f'Flight number {flight_num} already exists'
+                elif aircraft_conflicts and not row.get('allowConflict'):
+                    message = aircraft_conflicts[0]['message']
+                elif conflicts and not row.get('allowConflict'):
+                    message = crew_conflict_message(pilot_id, flight_num, conflicts)
+                else:
+                    taken.add(flight_num)
+                    flights.append((flight_num, num_ser) + fields)
+                    crew_rows.append((pilot_id, flight_num))
+                    if window:
+                        duties.setdefault(pilot_id, []).append((*window, flight_num))
+                        fleet_index.add([(num_ser, *window, flight_num, fields[0], fields[1])], rotations[num_ser])
+                    continue
+                errors.append({'index': index, 'message': message})
+
+        cur.executemany(
+            'INSERT INTO Flight (flightNum, numSer, origin, destination, arrTime, departureTime) VALUES (?, ?, ?, ?, ?, ?)',
+            flights
+        )
+        cur.executemany('INSERT INTO flightCrew (staffID, flightNum) VALUES (?, ?)', crew_rows)
+        change = route_index.pending(conn, [len(flights)])
+        crew_change = crew_index.pending(conn, [len(crew_rows), len(flights)])
+        fleet_change = fleet_index.pending(conn, [len(flights)])
+        added = select_in(cur, FLIGHT_COLUMNS + ' FROM Flight WHERE flightNum', [flight[0] for flight in flights])
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+
+    route_index.apply(change, lambda: route_index.add_flights([(flight[0],) + flight[2:] for flight in flights]))
+    crew_index.apply(crew_change, lambda: crew_index.add([
+        (pilot_id, *window, flight_num) for pilot_id, pilot_duties in duties.items() for *window, flight_num in pilot_duties
+    ]))
+    fleet_index.apply(fleet_change, lambda: fleet_index.add([
+        (flight[1], *window, flight[0], flight[2], flight[3])
+        for flight in flights for window in [crew.duty_window(flight[5], flight[4])] if window
+    ]))
+    publish_flights(added)
+    return bulk_response(len(flights), errors, 'flights')
+
+@app.route('/api/flightcrew/bulk', methods=['POST'])
+def add_flight_crew_bulk():
+    try:
+        rows = bulk_rows()
+    except ValueError as e:
+        return jsonify({'message': str(e), 'status': 'error'}), 400
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        write_lock_with(cur, [crew_index])
+        staff = {row[0] for row in select_in(cur, 'SELECT id FROM Staff WHERE id', {row.get('staffID') for row in rows})}
+        windows = {row[0]: crew.duty_window(row[1], row[2]) for row in select_in(
+            cur, 'SELECT flightNum, departureTime, arrTime FROM Flight WHERE flightNum', {as_int(row.get('flightNum')) for row in rows}
+        )}
+        assigned = set(select_in(cur, 'SELECT staffID, flightNum FROM flightCrew WHERE flightNum', windows))
+
+        errors = []
+        assignments = []
+        # Duties accepted so far in this batch, which the index has not seen yet
+        duties = {}
+        with crew_index.reading(conn):
+            for index, row in enumerate(rows):
+                staff_id = row.get('staffID')
+                flight_num = as_int(row.get('flightNum'))
+                window = windows.get(flight_num)
+                conflicts = []
+                if window:
+                    conflicts = crew_index.conflicts(staff_id, *window, CREW_MIN_REST) + crew.overlapping(duties.get(staff_id, []), *window, CREW_MIN_REST)
+
+                if not staff_id or not flight_num:
+                    message = 'Both staffID and flightNum are required'
+                elif staff_id not in staff:
+                    message = f'Staff ID {staff_id} does not exist'
+                elif flight_num not in windows:
+                    message = f'Flight number {flight_num} does not exist'
+                elif (staff_id, flight_num) in assigned:
+                    message = f'Crew member {staff_id} is already assigned to flight {flight_num}'
+                elif conflicts and not row.get('allowConflict'):
+                    message = crew_conflict_message(staff_id, flight_num, conflicts)
+                else:
+                    assigned.add((staff_id, flight_num))
+                    assignments.append((staff_id, flight_num))
+                    if window:
+                        duties.setdefault(staff_id, []).append((*window, flight_num))
+                    continue
+                errors.append({'index': index, 'message': message})
+
+        cur.executemany('INSERT INTO flightCrew (staffID, flightNum) VALUES (?, ?)', assignments)
+        change = crew_index.pending(conn, [len(assignments), 0])
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+
+    crew_index.apply(change, lambda: crew_index.add([
+        (staff_id, *window, flight_num) for staff_id, staff_duties in duties.items() for *window, flight_num in staff_duties
+    ]))
+    return bulk_response(len(assignments), errors, 'crew assignments')
+
+MAX_SOLVE_FLIGHTS = 10000
+MAX_CREW_PER_FLIGHT = 20
+
+@app.route('/api/flightcrew/solve', methods=['POST'])
+def solve_flight_crew():
+    # Crews up to MAX_SOLVE_FLIGHTS flights automatically: {"flightNums": [...], "pilots": 1,
+    # "cabinCrew": 0, "staffIDs": [...], "dryRun": false}. pilots and cabinCrew are how many each
+    # flight should have, counting anyone already assigned; staffIDs limits who may be picked.
+    # Pilots are only given airframes their rating allows and nobody gets a flight within the
+    # minimum rest of another. Everything assigned is committed in one transaction
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'message': 'Request body must be a JSON object', 'status': 'error'}), 400
+    flight_nums = data.get('flightNums')
+    if not isinstance(flight_nums, list) or not flight_nums:
+        return jsonify({'message': 'flightNums must be a non-empty list', 'status': 'error'}), 400
+    if len(flight_nums) > MAX_SOLVE_FLIGHTS:
+        return jsonify({'message': f'At most {MAX_SOLVE_FLIGHTS} flights per request', 'status': 'error'}), 400
+    flight_nums = [as_int(flight_num) for flight_num in flight_nums]
+    if None in flight_nums:
+        return jsonify({'message': 'flightNums must be integers', 'status': 'error'}), 400
+    flight_nums = list(dict.fromkeys(flight_nums))
+    needed = {}
+    for name, default in (('pilots', 1), ('cabinCrew', 0)):
+        needed[name] = as_int(data.get(name, default))
+        if needed[name] is None or not 0 <= needed[name] <= MAX_CREW_PER_FLIGHT:
+            return jsonify({'message': f'{name} must be an integer between 0 and {MAX_CREW_PER_FLIGHT}', 'status': 'error'}), 400
+    staff_ids = data.get('staffIDs')
+    if staff_ids is not None and (not isinstance(staff_ids, list) or not all(isinstance(staff_id, str) for staff_id in staff_ids)):
+        return jsonify({'message': 'staffIDs must be a list of staff IDs', 'status': 'error'}), 400
+    dry_run = bool(data.get('dryRun'))
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        # Held from here so the rosters cannot change between solving and inserting
+        write_lock_with(cur, [qualification_index, crew_index])
+        found = select_in(cur, """
+            SELECT f.flightNum, f.departureTime, f.arrTime, a.typeRating
+            FROM Flight f LEFT JOIN Airplane a ON a.numSer = f.numSer WHERE f.flightNum""", flight_nums)
+        windows = {flight_num: crew.duty_window(departure_time, arr_time) for flight_num, departure_time, arr_time, _ in found}
+        crewed = select_in(cur, 'SELECT flightNum, staffID FROM flightCrew WHERE flightNum', [flight_num for flight_num in windows if windows[flight_num]])
+        if staff_ids is None:
+            cur.execute('SELECT id FROM Staff WHERE id NOT IN (SELECT id FROM Pilot)')
+            cabin_crew = [row[0] for row in cur.fetchall()]
+        else:
+            cabin_crew = [row[0] for row in select_in(cur, 'SELECT id FROM Staff WHERE id NOT IN (SELECT id FROM Pilot) AND id', set(staff_ids))]
+
+        with qualification_index.reading(conn), crew_index.reading(conn):
+            allowed = set(staff_ids) if staff_ids is not None else None
+            pilots = {
+                rating: rostering.Pool([staff_id for staff_id in qualification_index.rated(rating) if allowed is None or staff_id in allowed])
+                for rating in qualification_index.ratings()
+            }
+            # Those already on a flight count towards what it needs
+            have = {flight_num: [0, 0] for flight_num in windows}
+            for flight_num, staff_id in crewed:
+                have[flight_num][qualification_index.rating(staff_id) is None] += 1
+            assignments, unfilled = rostering.solve(
+                [
+                    (*windows[flight_num], flight_num, plane_rating,
+                     max(needed['pilots'] - have[flight_num][0], 0), max(needed['cabinCrew'] - have[flight_num][1], 0))
+                    for flight_num, _, _, plane_rating in found if windows[flight_num]
+                ],
+                pilots, rostering.Pool(cabin_crew),
+                lambda staff_id, departure, arrival: crew_index.busy_until(staff_id, departure, arrival, CREW_MIN_REST),
+                CREW_MIN_REST
+            )
+
+        cur.executemany('INSERT INTO flightCrew (staffID, flightNum) VALUES (?, ?)', [(staff_id, flight_num) for flight_num, staff_id, _ in assignments])
+        change = crew_index.pending(conn, [len(assignments), 0])
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+
+    if not dry_run:
+        crew_index.apply(change, lambda: crew_index.add([(staff_id, *windows[flight_num], flight_num) for flight_num, staff_id, _ in assignments]))
+    return jsonify({
+        'message': f"{len(assignments)} crew assignments {'found' if dry_run else 'added'}, {len(unfilled)} flights not fully crewed",
+        'status': 'partial' if unfilled else 'success',
+        'committed': not dry_run,
+        'assignments': [{'flightNum': flight_num, 'staffID': staff_id, 'role': role} for flight_num, staff_id, role in assignments],
+        'unfilled': [{'flightNum': flight_num, 'pilots': pilots_short, 'cabinCrew': crew_short} for flight_num, (pilots_short, crew_short) in unfilled.items()],
+        # Flights without dated departure and arrival times cannot be checked against rest rules
+        'unscheduled': [flight_num for flight_num in flight_nums if flight_num in windows and not windows[flight_num]],
+        'missing': [flight_num for flight_num in flight_nums if flight_num not in windows]
+    }), 200
+
+@app.route('/api/flightpath/bulk', methods=['POST'])
+def add_flight_path_bulk():
+    try:
+        rows = bulk_rows()
+    except ValueError as e:
+        return jsonify({'message': str(e), 'status': 'error'}), 400
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        # Taken first so the checks below still hold at insert time and seq is handed out in order
+        cur.execute('BEGIN IMMEDIATE')
+        flights = {row[0] for row in select_in(cur, 'SELECT flightNum FROM Flight WHERE flightNum', {as_int(row.get('flightNum')) for row in rows})}
+        cities = {row[0] for row in select_in(cur, 'SELECT cityID FROM interCity WHERE cityID', {as_int(row.get('cityID')) for row in rows})}
+        assigned = set(select_in(cur, 'SELECT flightNum, cityID FROM flightPath WHERE flightNum', flights))
+
+        errors = []
+        paths = []
+        for index, row in enumerate(rows):
+            flight_num = as_int(row.get('flightNum'))
+            city_id = as_int(row.get('cityID'))
+
+            if not flight_num or not city_id:
+                message = 'Both flightNum and cityID are required'
+            elif flight_num not in flights:
+                message = f'Flight number {flight_num} does not exist'
+            elif city_id not in cities:
+                message = f'City ID {city_id} does not exist'
+            elif (flight_num, city_id) in assigned:
+                message = f'City {city_id} is already on the path of flight {flight_num}'
+            else:
+                assigned.add((flight_num, city_id))
+                paths.append((flight_num, city_id))
+                continue
+            errors.append({'index': index, 'message': message})
+
+        cur.executemany('INSERT INTO flightPath (flightNum, cityID) VALUES (?, ?)', paths)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+
+    return bulk_response(len(paths), errors, 'flight path entries')
+
+def flight_routes(cur, flight_nums):
+    # Each flight's route as city IDs: origin, the flightPath waypoints in order, destination.
+    # Origin and destination are matched to interCity by name (None when there is no such city).
+    # Call inside distance_index.reading()
+    waypoints = {}
+    for flight_num, _, city_id in sorted(select_in(cur, 'SELECT flightNum, seq, cityID FROM flightPath WHERE flightNum', flight_nums)):
+        waypoints.setdefault(flight_num, []).append(city_id)
+    return {
+        flight_num: (distance_index.city_id(origin), *waypoints.get(flight_num, ()), distance_index.city_id(destination))
+        for flight_num, origin, destination in select_in(cur, 'SELECT flightNum, origin, destination FROM Flight WHERE flightNum', flight_nums)
+    }
+
+def km(value):
+    return None if value is None else round(value, 1)
+
+@app.route('/api/flightpath/<int:flight_num>', methods=['GET'])
+def get_flight_path(flight_num):
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT origin, destination FROM Flight WHERE flightNum = ?', (flight_num,))
+        flight = cur.fetchone()
+        if not flight:
+            return jsonify({'message': f'Flight number {flight_num} does not exist', 'status': 'error'}), 404
+        with distance_index.reading(conn):
+            route = flight_routes(cur, [flight_num])[flight_num]
+            legs, total = distance_index.distances([route])[0]
+            cities = [distance_index.city(city_id) for city_id in route]
+    except sqlite3.Error as e:
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+
+    # Origin and destination keep their names even when interCity does not list them
+    names = [flight[0]] + [None] * (len(route) - 2) + [flight[1]]
+    return jsonify({
+        'flightNum': flight_num,
+        'route': [
+            {'cityID': city_id, 'cityName': city[0] if city else name,
+             'latitude': city[1] if city else None, 'longitude': city[2] if city else None}
+            for city_id, city, name in zip(route, cities, names)
+        ],
+        'legsKm': [km(leg) for leg in legs],
+        'totalKm': km(total),
+        'status': 'success'
+    }), 200
+
+MAX_DISTANCE_FLIGHTS = 10000
+
+@app.route('/api/flights/distances', methods=['POST'])
+def get_flight_distances():
+    # Great-circle leg and total distances for up to MAX_DISTANCE_FLIGHTS flights in one call:
+    # {"flightNums": [...]}. Routes not seen before are computed together in one vectorized pass
+    data = request.get_json(silent=True)
+    flight_nums = data.get('flightNums') if isinstance(data, dict) else None
+    if not isinstance(flight_nums, list) or not flight_nums:
+        return jsonify({'message': 'flightNums must be a non-empty list', 'status': 'error'}), 400
+    if len(flight_nums) > MAX_DISTANCE_FLIGHTS:
+        return jsonify({'message': f'At most {MAX_DISTANCE_FLIGHTS} flights per request', 'status': 'error'}), 400
+    flight_nums = [as_int(flight_num) for flight_num in flight_nums]
+    if None in flight_nums:
+        return jsonify({'message': 'flightNums must be integers', 'status': 'error'}), 400
+    flight_nums = list(dict.fromkeys(flight_nums))
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        with distance_index.reading(conn):
+            routes = flight_routes(cur, flight_nums)
+            found = [flight_num for flight_num in flight_nums if flight_num in routes]
+            results = distance_index.distances([routes[flight_num] for flight_num in found])
+    except sqlite3.Error as e:
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+
+    return jsonify({
+        'distances': [
+            {'flightNum': flight_num, 'legsKm': [km(leg) for leg in legs], 'totalKm': km(total)}
+            for flight_num, (legs, total) in zip(found, results)
+        ],
+        'missing': [flight_num for flight_num in flight_nums if flight_num not in routes],
+        'status': 'success'
+    }), 200
+
 @app.route('/api/passenger', methods=['POST'])
 def add_passenger():
     data = request.get_json()
@@ -397,9 +882,13 @@ def add_passenger():
     if not passenger_id or not firstName or not surname or not password or not homeAddress or not workAddress or not homePhoneNumber or not workPhoneNumber:
         return jsonify({'message': 'All fields are required', 'status': 'error'}), 400
 
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    try:
+        with metrics.bcrypt_timer():
+            hashed_password = hashing.service.hash_password(password).result(timeout=hashing.service.timeout)
+    except (hashing.HashingQueueFull, TimeoutError) as e:
+        return jsonify({'message': str(e) or 'Password hashing timed out', 'status': 'error'}), 503
 
-    conn = sqlite3.connect('airplane.db')
+    conn = get_db()
     cur = conn.cursor()
     try:
         # Insert into Passenger table
@@ -417,12 +906,11 @@ def add_passenger():
     except sqlite3.Error as e:
         conn.rollback()
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
 
     return jsonify({'message': 'Passenger and contact added successfully', 'status': 'success', 'id': passenger_id}), 200
 
 @app.route('/api/booking', methods=['POST'])
+@sessions.authenticate(session_manager, required=True)
 def add_booking():
     data = request.get_json()
     passenger_id = data.get('passengerID')
@@ -431,9 +919,14 @@ def add_booking():
     if not passenger_id or not flight_num:
         return jsonify({'message': 'Both passengerID and flightNum are required', 'status': 'error'}), 400
 
-    conn = sqlite3.connect('airplane.db')
+    if g.passenger_id != passenger_id:
+        return jsonify({'message': 'Cannot book for another passenger', 'status': 'error'}), 403
+
+    conn = get_db()
     cur = conn.cursor()
     try:
+        # The seat check and the counter update run in the insert's own statement, under the write lock
+        cur.execute('BEGIN IMMEDIATE')
         # Check if passengerID exists in the Passenger table
         cur.execute('SELECT passengerID FROM Passenger WHERE passengerID = ?', (passenger_id,))
         passenger = cur.fetchone()
@@ -451,8 +944,12 @@ def add_booking():
             'INSERT INTO Booking (passengerID, flightNum) VALUES (?, ?)',
             (passenger_id, flight_num)
         )
+        seats = select_in(cur, SEATS_CHANGED, [flight_num])
         conn.commit()
     except sqlite3.IntegrityError as e:
+        conn.rollback()
+        if 'Flight is full' in str(e):
+            return jsonify({'message': f'Flight {flight_num} is full', 'status': 'error'}), 409
         # Check for unique constraint violation
         if 'UNIQUE constraint failed' in str(e):
             return jsonify({'message': f'Booking for passenger ID {passenger_id} on flight {flight_num} already exists', 'status': 'error'}), 400
@@ -462,14 +959,107 @@ def add_booking():
         return jsonify({'message': str(e), 'status': 'error'}), 500
     except sqlite3.Error as e:
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
 
+    publish_seats(seats)
     return jsonify({'message': 'Booking added successfully', 'status': 'success', 'passengerID': passenger_id, 'flightNum': flight_num}), 200
 
+@app.route('/api/booking/bulk', methods=['POST'])
+@sessions.authenticate(session_manager, required=True)
+def add_bookings_bulk():
+    # Several bookings of the signed-in passenger at once: every (passengerID, flightNum)
+    # pair is booked, or none is.
+    # Passengers, flights with their free seats, and existing bookings are each read
+    # with one set-based query, and all rows go in with one insert and one commit
+    try:
+        rows = bulk_rows()
+    except ValueError as e:
+        return jsonify({'message': str(e), 'status': 'error'}), 400
+    if not rows:
+        return jsonify({'message': 'At least one booking is required', 'status': 'error'}), 400
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute('BEGIN IMMEDIATE')
+        passengers = {row[0] for row in select_in(cur, 'SELECT passengerID FROM Passenger WHERE passengerID', {row.get('passengerID') for row in rows})}
+        # Free seats per flight, None when the airplane has no capacity set
+        seats = dict(select_in(
+            cur,
+            'SELECT f.flightNum, a.capacity - s.booked FROM Flight f '
+            'LEFT JOIN Airplane a ON a.numSer = f.numSer LEFT JOIN flightSeats s ON s.flightNum = f.flightNum '
+            'WHERE f.flightNum',
+            {as_int(row.get('flightNum')) for row in rows}
+        ))
+        booked = set(select_in(cur, 'SELECT passengerID, flightNum FROM Booking WHERE passengerID', passengers))
+
+        results = []
+        bookings = []
+        full = False
+        for index, row in enumerate(rows):
+            passenger_id = row.get('passengerID')
+            flight_num = as_int(row.get('flightNum'))
+            result = {'index': index, 'passengerID': passenger_id, 'flightNum': flight_num}
+
+            if not passenger_id or not flight_num:
+                message = 'Both passengerID and flightNum are required'
+            elif g.passenger_id != passenger_id:
+                message = 'Cannot book for another passenger'
+            elif passenger_id not in passengers:
+                message = f'Passenger ID {passenger_id} does not exist'
+            elif flight_num not in seats:
+                message = f'Flight number {flight_num} does not exist'
+            elif (passenger_id, flight_num) in booked:
+                message = f'Booking for passenger ID {passenger_id} on flight {flight_num} already exists'
+            elif seats[flight_num] is not None and seats[flight_num] <= 0:
+                message = f'Flight {flight_num} is full'
+                full = True
+            else:
+                booked.add((passenger_id, flight_num))
+                if seats[flight_num] is not None:
+                    seats[flight_num] -= 1
+                bookings.append((passenger_id, flight_num))
+                results.append(result)
+                continue
+            results.append({**result, 'message': message})
+
+        rejected = len(rows) - len(bookings)
+        if rejected:
+            conn.rollback()
+            for result in results:
+                result['status'] = 'error' if 'message' in result else 'notBooked'
+            return jsonify({
+                'message': f'{rejected} of {len(rows)} bookings rejected, nothing was booked',
+                'status': 'error',
+                'results': results
+            }), 409 if full else 400
+
+        # The seat triggers check capacity again row by row, so nothing is oversold either way
+        cur.executemany('INSERT INTO Booking (passengerID, flightNum) VALUES (?, ?)', bookings)
+        seats = select_in(cur, SEATS_CHANGED, {flight_num for _, flight_num in bookings})
+        conn.commit()
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        if 'Flight is full' in str(e):
+            return jsonify({'message': 'A flight in this booking is full, nothing was booked', 'status': 'error'}), 409
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+    except sqlite3.Error as e:
+        conn.rollback()
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+
+    publish_seats(seats)
+    for result in results:
+        result['status'] = 'booked'
+    return jsonify({'message': f'{len(bookings)} bookings added', 'status': 'success', 'results': results}), 200
+
 @app.route('/api/bookings/<string:passenger_id>', methods=['GET'])
+@sessions.authenticate(session_manager, required=True)
+@cache.conditional('passenger', 'passenger_id')
+@cache.cached(response_cache, ['Booking', 'Flight'])
 def get_bookings(passenger_id):
-    conn = sqlite3.connect('airplane.db')
+    if g.passenger_id != passenger_id:
+        return jsonify({'message': 'Cannot view bookings of another passenger', 'status': 'error'}), 403
+
+    conn = get_db()
     cur = conn.cursor()
     try:
         cur.execute('''
@@ -481,8 +1071,6 @@ def get_bookings(passenger_id):
         bookings = cur.fetchall()
     except sqlite3.Error as e:
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
 
     if not bookings:
         return jsonify({'message': f'No bookings found for passenger ID {passenger_id}', 'status': 'error'}), 404
@@ -499,12 +1087,135 @@ def get_bookings(passenger_id):
 
     return jsonify({'bookings': result, 'status': 'success'}), 200
 
+MAX_PAGE_SIZE = 1000
+
+# Seats left on a flight from its booked counter: two primary key lookups, null when the airplane has no capacity set
+SEATS_AVAILABLE = '''(
+    SELECT a.capacity - s.booked FROM flightSeats s, Airplane a
+    WHERE s.flightNum = Flight.flightNum AND a.numSer = Flight.numSer
+) AS seatsAvailable'''
+
+FLIGHT_COLUMNS = 'SELECT flightNum, origin, destination, arrTime, departureTime, ' + SEATS_AVAILABLE
+SEATS_CHANGED = 'SELECT flightNum, origin, ' + SEATS_AVAILABLE + ' FROM Flight WHERE flightNum'
+
+def publish_flights(flights):
+    # Departure board updates go out after the commit, to subscribers of the origin city
+    for flight in flights:
+        events.broker.publish(flight[1], {'type': 'flightAdded', 'flight': flight_to_dict(flight)})
+
+def publish_seats(rows):
+    for flight_num, origin, seats_available in rows:
+        events.broker.publish(origin, {'type': 'seatsChanged', 'flightNumber': flight_num, 'seatsAvailable': seats_available})
+
+def flight_to_dict(flight):
+    return {
+        'flightNumber': flight[0],
+        'origin': flight[1],
+        'destination': flight[2],
+        'arrivalTime': flight[3],
+        'departureTime': flight[4],
+        'seatsAvailable': flight[5]
+    }
+
+def stream_flights(cur, first, limit, cursor_of):
+    # Writes the same document as the buffered response, one flight at a time
+    yield '{"flights": ['
+    count = 0
+    last = next_cursor = None
+    try:
+        for flight in itertools.chain([first], cur):
+            if limit and count == limit:
+                next_cursor = cursor_of(last)
+                break
+            yield (', ' if count else '') + json.dumps(flight_to_dict(flight))
+            last = flight
+            count += 1
+    finally:
+        # Release the read snapshot before the connection goes back to the pool
+        cur.close()
+    if limit:
+        yield f'], "next": {json.dumps(next_cursor)}, "status": "success"}}'
+    else:
+        yield '], "status": "success"}'
+
+def departure_cursor(flight):
+    # "<departure epoch>:<flightNum>", parsed like the departureEpoch column is filled
+    return f'{routing.parse_time(flight[4])}:{flight[0]}'
+
+def list_flights(query, params, not_found_message):
+    # Keyset pagination: ?limit=<n>&after=<next from the previous page>. In flight number order
+    # (the default) the cursor is the last flightNum; with ?order=departure it is departure epoch
+    # and flightNum, and flights stored without a date are left out since they have no departure
+    # to sort on. Without limit every match is returned: buffered, unless ?stream=1 writes it out
+    # a row at a time, which is what keeps memory flat for large listings
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+    order = request.args.get('order', 'flightNum')
+    stream = cache.streaming()
+    if order not in ('flightNum', 'departure'):
+        return jsonify({'message': 'order must be flightNum or departure', 'status': 'error'}), 400
+    try:
+        limit = int(limit) if limit else None
+        if not after:
+            after = None
+        elif order == 'departure':
+            after = tuple(int(part) for part in after.split(':', 1))
+            if len(after) != 2:
+                raise ValueError(after)
+        else:
+            after = int(after)
+    except ValueError:
+        return jsonify({'message': 'limit must be an integer, and after the next value of the previous page', 'status': 'error'}), 400
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({'message': f'limit must be between 1 and {MAX_PAGE_SIZE}', 'status': 'error'}), 400
+
+    if order == 'departure':
+        # A range scan on the epoch index, which holds flightNum (the rowid) as its tie-breaker
+        query += ' AND departureEpoch IS NOT NULL'
+        if after is not None:
+            query += ' AND (departureEpoch, flightNum) > (?, ?)'
+            params.extend(after)
+        query += ' ORDER BY departureEpoch, flightNum'
+        cursor_of = departure_cursor
+    else:
+        if after is not None:
+            query += ' AND flightNum > ?'
+            params.append(after)
+        query += ' ORDER BY flightNum'
+        cursor_of = lambda flight: flight[0]
+    if limit:
+        # One extra row tells us whether there is a next page
+        query += ' LIMIT ?'
+        params.append(limit + 1)
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute(query, params)
+        first = cur.fetchone()
+    except sqlite3.Error as e:
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+
+    if not first:
+        return jsonify({'message': not_found_message, 'status': 'error'}), 404
+
+    if stream:
+        return Response(stream_with_context(stream_flights(cur, first, limit, cursor_of)), mimetype='application/json'), 200
+
+    flights = [first] + cur.fetchall()
+    result = {'flights': [flight_to_dict(flight) for flight in flights[:limit]], 'status': 'success'}
+    if limit:
+        result['next'] = cursor_of(flights[limit - 1]) if len(flights) > limit else None
+
+    return jsonify(result), 200
+
 @app.route('/api/flights', methods=['GET'])
+@cache.cached(response_cache, ['Flight', 'Booking', 'Airplane'])
 def get_flights():
     origin = request.args.get('origin')
     destination = request.args.get('destination')
 
-    query = 'SELECT flightNum, origin, destination, arrTime, departureTime FROM Flight WHERE 1=1'
+    query = FLIGHT_COLUMNS + ' FROM Flight WHERE 1=1'
     params = []
 
     if origin:
@@ -514,34 +1225,24 @@ def get_flights():
         query += ' AND destination = ?'
         params.append(destination)
 
-    conn = sqlite3.connect('airplane.db')
-    cur = conn.cursor()
-    try:
-        cur.execute(query, params)
-        flights = cur.fetchall()
-    except sqlite3.Error as e:
-        return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
+    # Departure window, [departAfter, departBefore), as a range scan on the epoch column.
+    # Flights stored without a date have no epoch and never fall inside a window
+    for name, condition in (('departAfter', 'departureEpoch >= ?'), ('departBefore', 'departureEpoch < ?')):
+        value = request.args.get(name)
+        if value:
+            moment = routing.parse_time(value)
+            if moment is None:
+                return jsonify({'message': f'{name} must be a date and time, e.g. 2024-06-01 09:00', 'status': 'error'}), 400
+            query += f' AND {condition}'
+            params.append(moment)
 
-    if not flights:
-        return jsonify({'message': 'No flights found matching the criteria', 'status': 'error'}), 404
-
-    result = []
-    for flight in flights:
-        result.append({
-            'flightNumber': flight[0],
-            'origin': flight[1],
-            'destination': flight[2],
-            'arrivalTime': flight[3],
-            'departureTime': flight[4]
-        })
-
-    return jsonify({'flights': result, 'status': 'success'}), 200
+    return list_flights(query, params, 'No flights found matching the criteria')
 
 @app.route('/api/flightcrew/<string:empNum>', methods=['GET'])
+@cache.conditional('staff', 'empNum')
+@cache.cached(response_cache, ['flightCrew', 'Flight'])
 def get_flight_by_emp_num(empNum):
-    conn = sqlite3.connect('airplane.db')
+    conn = get_db()
     cur = conn.cursor()
     try:
         cur.execute('''
@@ -553,8 +1254,6 @@ def get_flight_by_emp_num(empNum):
         flights = cur.fetchall()
     except sqlite3.Error as e:
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
 
     if not flights:
         return jsonify({'message': f'No flights found for employee number {empNum}', 'status': 'error'}), 404
@@ -571,57 +1270,295 @@ def get_flight_by_emp_num(empNum):
 
     return jsonify({'flights': result, 'status': 'success'}), 200
 
+@app.route('/api/crew/conflicts', methods=['GET'])
+def audit_crew_conflicts():
+    # Every double booking across all rosters (or one with ?staffID=), in one pass over the crew index.
+    # gapMinutes is the time from the earlier landing to the later departure, negative when they overlap
+    try:
+        min_rest = int(request.args.get('minRest', CREW_MIN_REST // 60)) * 60
+    except ValueError:
+        return jsonify({'message': 'minRest must be an integer', 'status': 'error'}), 400
+
+    conn = get_db()
+    try:
+        with crew_index.reading(conn):
+            found = crew_index.audit(min_rest, request.args.get('staffID'))
+    except sqlite3.Error as e:
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+
+    conflicts = [
+        {'staffID': staff_id, 'flightNum': flight_num, 'conflictsWith': other, 'gapMinutes': gap // 60}
+        for staff_id, flight_num, other, gap in found
+    ]
+    return jsonify({'conflicts': conflicts, 'count': len(conflicts), 'status': 'success'}), 200
+
 @app.route('/api/flights/search/', defaults={'flight_num': ''}, methods=['GET'])
 @app.route('/api/flights/search/<string:flight_num>', methods=['GET'])
+@cache.cached(response_cache, ['Flight', 'Booking', 'Airplane'])
 def search_flights(flight_num):
-    conn = sqlite3.connect('airplane.db')
+    query = FLIGHT_COLUMNS + ' FROM Flight WHERE 1=1'
+    params = []
+
+    # Select all flights if no flight number is provided
+    if re.fullmatch(r'[0-9]+', flight_num):
+        # Substring match through the suffix index: every flight with a suffix starting with the digits.
+        # ':' sorts straight after '9', so the range covers exactly the suffixes with this prefix
+        query += ' AND flightNum IN (SELECT flightNum FROM flightNumSuffix WHERE suffix >= ? AND suffix < ?)'
+        params.extend([flight_num, flight_num + ':'])
+    elif flight_num:
+        # Use a LIKE query to search for matching flight numbers
+        query += ' AND flightNum LIKE ?'
+        params.append(f"%{flight_num}%")
+
+    return list_flights(query, params, f'No flights found matching flight number pattern {flight_num}')
+
+@app.route('/api/airplanes/<int:num_ser>/rotation', methods=['GET'])
+def get_rotation(num_ser):
+    # The airframe's flights departing in [from, to), by default the next 7 days, with the
+    # turnaround before each one and whether it starts where the previous flight landed
+    start = routing.parse_time(request.args['from']) if request.args.get('from') else int(time.time())
+    end = routing.parse_time(request.args['to']) if request.args.get('to') else (start or 0) + 7 * 24 * 60 * 60
+    if start is None or end is None:
+        return jsonify({'message': 'from and to must be dates or date-times, e.g. 2024-06-01', 'status': 'error'}), 400
+
+    conn = get_db()
     cur = conn.cursor()
     try:
-        if flight_num:
-            # Use a LIKE query to search for matching flight numbers
-            like_query = f"%{flight_num}%"
-            cur.execute('''
-                SELECT flightNum, origin, destination, arrTime, departureTime
-                FROM Flight
-                WHERE flightNum LIKE ?
-            ''', (like_query,))
-        else:
-            # Select all flights if no flight number is provided
-            cur.execute('''
-                SELECT flightNum, origin, destination, arrTime, departureTime
-                FROM Flight
-            ''')
-        flights = cur.fetchall()
+        cur.execute('SELECT numSer FROM Airplane WHERE numSer = ?', (num_ser,))
+        if not cur.fetchone():
+            return jsonify({'message': f'Airplane serial number {num_ser} does not exist', 'status': 'error'}), 404
+        with fleet_index.reading(conn):
+            flight_nums = fleet_index.schedule(num_ser, start, end)
+        flights = {row[0]: row for row in select_in(
+            cur, FLIGHT_COLUMNS + ' FROM Flight WHERE flightNum', flight_nums
+        )}
     except sqlite3.Error as e:
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
 
-    if not flights:
-        return jsonify({'message': f'No flights found matching flight number pattern {flight_num}', 'status': 'error'}), 404
+    rotation = []
+    previous = None
+    for flight_num in flight_nums:
+        flight = flights.get(flight_num)
+        if flight is None:
+            continue
+        entry = flight_to_dict(flight)
+        if previous is not None:
+            entry['turnaroundMinutes'] = (routing.parse_time(flight[4]) - routing.parse_time(previous[3])) // 60
+            entry['positioned'] = previous[2] == flight[1]
+        rotation.append(entry)
+        previous = flight
+
+    return jsonify({'numSer': num_ser, 'flights': rotation, 'status': 'success'}), 200
+
+@app.route('/api/utilization', methods=['GET'])
+def get_utilization():
+    # Block hours, flights per day and idle time between flights per airframe and per crew member,
+    # over flights departing in [from, to). ?by=airframe or ?by=crew for just one of the two
+    start = routing.parse_time(request.args.get('from'))
+    end = routing.parse_time(request.args.get('to'))
+    if start is None or end is None or end <= start:
+        return jsonify({'message': 'from and to must be dates or date-times with from before to, e.g. 2024-06-01', 'status': 'error'}), 400
+    by = request.args.get('by')
+    if by not in (None, 'airframe', 'crew'):
+        return jsonify({'message': 'by must be airframe or crew', 'status': 'error'}), 400
+
+    conn = get_db()
+    result = {}
+    try:
+        if by != 'crew':
+            with fleet_index.reading(conn):
+                result['airframes'] = utilization_json('numSer', utilization.report(airframe_columns(), start, end), end - start)
+        if by != 'airframe':
+            with crew_index.reading(conn):
+                result['crew'] = utilization_json('staffID', utilization.report(crew_columns(), start, end), end - start)
+    except sqlite3.Error as e:
+        return jsonify({'message': str(e), 'status': 'error'}), 500
 
-    result = []
-    for flight in flights:
-        result.append({
-            'flightNumber': flight[0],
-            'origin': flight[1],
-            'destination': flight[2],
-            'arrivalTime': flight[3],
-            'departureTime': flight[4]
-        })
+    result['days'] = round((end - start) / utilization.SECONDS_PER_DAY, 2)
+    result['status'] = 'success'
+    return jsonify(result), 200
+
+def utilization_json(key_name, report, seconds):
+    # Column by column (one list per measure, entry i for the same key) rather than an object per
+    # key, since a report covers every airframe or crew member and is built straight from arrays
+    keys, flights, block, idle, longest = report
+    days = seconds / utilization.SECONDS_PER_DAY
+    hours = utilization.SECONDS_PER_HOUR
+    return {
+        key_name: keys,
+        'flights': flights.tolist(),
+        'flightsPerDay': np.round(flights / days, 2).tolist(),
+        'blockHours': np.round(block / hours, 2).tolist(),
+        'blockHoursPerDay': np.round(block / hours / days, 2).tolist(),
+        'idleHours': np.round(idle / hours, 2).tolist(),
+        'longestIdleHours': np.round(longest / hours, 2).tolist()
+    }
+
+MAX_ELIGIBLE_PILOTS = 500
+
+@app.route('/api/airplanes/<int:num_ser>/pilots', methods=['GET'])
+def get_eligible_pilots(num_ser):
+    # Pilots rated for the airframe with no flight within the minimum rest of [from, to)
+    # (?limit=50), the closest rating first. qualified counts every rated pilot, busy or not
+    start = routing.parse_time(request.args.get('from'))
+    end = routing.parse_time(request.args.get('to'))
+    if start is None or end is None or end < start:
+        return jsonify({'message': 'from and to must be date-times with from before to, e.g. 2024-06-01 09:00', 'status': 'error'}), 400
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'message': 'limit must be an integer', 'status': 'error'}), 400
+    if not 1 <= limit <= MAX_ELIGIBLE_PILOTS:
+        return jsonify({'message': f'limit must be between 1 and {MAX_ELIGIBLE_PILOTS}', 'status': 'error'}), 400
 
-    return jsonify({'flights': result, 'status': 'success'}), 200
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT typeRating FROM Airplane WHERE numSer = ?', (num_ser,))
+        plane = cur.fetchone()
+        if not plane:
+            return jsonify({'message': f'Airplane serial number {num_ser} does not exist', 'status': 'error'}), 404
+        with qualification_index.reading(conn), crew_index.reading(conn):
+            # One extra tells whether there are more
+            available = list(itertools.islice((
+                (staff_id, rating) for staff_id, rating in qualification_index.eligible(plane[0])
+                if not crew_index.conflicts(staff_id, start, end, CREW_MIN_REST)
+            ), limit + 1))
+            qualified = qualification_index.count(plane[0])
+    except sqlite3.Error as e:
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+
+    return jsonify({
+        'numSer': num_ser,
+        'typeRating': plane[0],
+        'pilots': [{'staffID': staff_id, 'typeRating': rating} for staff_id, rating in available[:limit]],
+        'more': len(available) > limit,
+        'qualified': qualified,
+        'status': 'success'
+    }), 200
+
+MAX_LEGS = 4
+MAX_ITINERARIES = 20
+
+@app.route('/api/routes', methods=['GET'])
+def search_routes():
+    # Connecting itineraries, earliest arrival first:
+    # ?origin=&destination=[&departAfter=<datetime>][&maxLegs=3][&minConnection=<minutes>][&limit=5]
+    origin = request.args.get('origin')
+    destination = request.args.get('destination')
+    if not origin or not destination:
+        return jsonify({'message': 'origin and destination are required', 'status': 'error'}), 400
+
+    try:
+        max_legs = int(request.args.get('maxLegs', 3))
+        min_connection = int(request.args.get('minConnection', 45))
+        limit = int(request.args.get('limit', 5))
+    except ValueError:
+        return jsonify({'message': 'maxLegs, minConnection and limit must be integers', 'status': 'error'}), 400
+    if not 1 <= max_legs <= MAX_LEGS:
+        return jsonify({'message': f'maxLegs must be between 1 and {MAX_LEGS}', 'status': 'error'}), 400
+    if not 1 <= limit <= MAX_ITINERARIES:
+        return jsonify({'message': f'limit must be between 1 and {MAX_ITINERARIES}', 'status': 'error'}), 400
+    if min_connection < 0:
+        return jsonify({'message': 'minConnection cannot be negative', 'status': 'error'}), 400
+
+    depart_after = request.args.get('departAfter')
+    start = routing.parse_time(depart_after) if depart_after else int(time.time())
+    if start is None:
+        return jsonify({'message': 'departAfter must be a date and time, e.g. 2024-06-01 09:00', 'status': 'error'}), 400
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        with route_index.reading(conn):
+            found = route_index.search(origin, destination, start, min_connection * 60, max_legs, limit)
+        flights = {row[0]: row for row in select_in(
+            cur, FLIGHT_COLUMNS + ' FROM Flight WHERE flightNum',
+            {flight_num for _, _, path in found for flight_num in path}
+        )}
+    except sqlite3.Error as e:
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+
+    itineraries = []
+    for departure, arrival, path in found:
+        # A flight deleted since the search ran drops its itinerary
+        if all(flight_num in flights for flight_num in path):
+            itineraries.append({
+                'departureTime': flights[path[0]][4],
+                'arrivalTime': flights[path[-1]][3],
+                'durationMinutes': (arrival - departure) // 60,
+                'connections': len(path) - 1,
+                'flights': [flight_to_dict(flights[flight_num]) for flight_num in path]
+            })
+
+    if not itineraries:
+        return jsonify({'message': f'No routes found from {origin} to {destination}', 'status': 'error'}), 404
+
+    return jsonify({'itineraries': itineraries, 'status': 'success'}), 200
+
+MAX_DEPARTURES = 50
+
+@app.route('/api/departures/<string:city>', methods=['GET'])
+def get_departures(city):
+    # The next departures from a city (?after=<datetime>, default now; ?limit=10), read from the route index.
+    # eventId is where /api/departures/<city>/events should pick up so no change is missed
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'message': 'limit must be an integer', 'status': 'error'}), 400
+    if not 1 <= limit <= MAX_DEPARTURES:
+        return jsonify({'message': f'limit must be between 1 and {MAX_DEPARTURES}', 'status': 'error'}), 400
+    after = request.args.get('after')
+    start = routing.parse_time(after) if after else int(time.time())
+    if start is None:
+        return jsonify({'message': 'after must be a date and time, e.g. 2024-06-01 09:00', 'status': 'error'}), 400
+
+    event_id = events.broker.latest
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        with route_index.reading(conn):
+            flight_nums = [flight_num for _, flight_num in route_index.departures(city, start, limit)]
+        flights = {row[0]: row for row in select_in(cur, FLIGHT_COLUMNS + ' FROM Flight WHERE flightNum', flight_nums)}
+    except sqlite3.Error as e:
+        return jsonify({'message': str(e), 'status': 'error'}), 500
+
+    return jsonify({
+        'city': city,
+        'departures': [flight_to_dict(flights[flight_num]) for flight_num in flight_nums if flight_num in flights],
+        'eventId': event_id,
+        'status': 'success'
+    }), 200
+
+@app.route('/api/departures/<string:city>/events', methods=['GET'])
+def stream_departures(city):
+    # Server-sent events for a city's board: flightAdded, flightDeleted and seatsChanged as they
+    # commit, or reset when the client has missed too much and should reload the board.
+    # This holds a thread per subscriber; asgi.py serves the same stream from its event loop instead
+    seq = events.last_event_id(request.headers.get('Last-Event-ID'), request.args.get('since'))
+    return Response(
+        events.stream(city, events.broker.latest if seq is None else seq),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/api/flight/<int:flight_num>', methods=['DELETE'])
 def delete_flight(flight_num):
-    conn = sqlite3.connect('airplane.db')
+    conn = get_db()
     cur = conn.cursor()
     try:
-        # Start a transaction
-        conn.execute('BEGIN TRANSACTION')
+        # Taken first: a deferred transaction that reads before writing fails at once (not after the busy
+        # timeout) when another connection commits in between
+        cur.execute('BEGIN IMMEDIATE')
+
+        cur.execute('SELECT flightNum, origin, destination, arrTime, departureTime, numSer FROM Flight WHERE flightNum = ?', (flight_num,))
+        deleted = cur.fetchall()
+        cur.execute('SELECT staffID FROM flightCrew WHERE flightNum = ?', (flight_num,))
+        crew_members = [row[0] for row in cur.fetchall()]
 
         # Delete from flightCrew table
         cur.execute('DELETE FROM flightCrew WHERE flightNum = ?', (flight_num,))
+        crew_deleted = cur.rowcount
 
         # Delete from flightPath table
         cur.execute('DELETE FROM flightPath WHERE flightNum = ?', (flight_num,))
@@ -631,14 +1568,26 @@ def delete_flight(flight_num):
 
         # Delete from Flight table
         cur.execute('DELETE FROM Flight WHERE flightNum = ?', (flight_num,))
+        change = route_index.pending(conn, [cur.rowcount])
+        crew_change = crew_index.pending(conn, [crew_deleted, cur.rowcount])
+        fleet_change = fleet_index.pending(conn, [cur.rowcount])
 
         # Commit the transaction
         conn.commit()
     except sqlite3.Error as e:
         conn.rollback()
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
+
+    route_index.apply(change, lambda: route_index.remove_flights([row[:5] for row in deleted]))
+    windows = [(crew.duty_window(departure_time, arr_time), flight, num_ser) for flight, _, _, arr_time, departure_time, num_ser in deleted]
+    crew_index.apply(crew_change, lambda: crew_index.remove([
+        (staff_id, *window, flight) for window, flight, _ in windows if window for staff_id in crew_members
+    ]))
+    fleet_index.apply(fleet_change, lambda: fleet_index.remove([
+        (num_ser, *window, flight) for window, flight, num_ser in windows if window
+    ]))
+    for flight, origin, *_ in deleted:
+        events.broker.publish(origin, {'type': 'flightDeleted', 'flightNumber': flight})
 
     return jsonify({'message': f'Flight number {flight_num} and its dependencies deleted successfully', 'status': 'success'}), 200
 
@@ -651,19 +1600,50 @@ def login():
     if not username or not password:
         return jsonify({'message': 'Username and password are required', 'status': 'error'}), 400
 
-    conn = sqlite3.connect('airplane.db')
+    conn = get_db()
     cur = conn.cursor()
     try:
         cur.execute('SELECT password FROM Passenger WHERE passengerID = ?', (username,))
         user = cur.fetchone()
-        if user and bcrypt.checkpw(password.encode('utf-8'), user[0]):
-            return jsonify({'message': 'Login successful', 'status': 'success', 'username': username}), 200
+        with metrics.bcrypt_timer():
+            password_ok = user is not None and hashing.service.check_password(password, user[0]).result(timeout=hashing.service.timeout)
+        if password_ok:
+            # Later requests present the token instead of the password, so bcrypt runs once per session
+            token = session_manager.issue(username)
+            return jsonify({'message': 'Login successful', 'status': 'success', 'username': username, 'token': token, 'expiresIn': session_manager.max_age}), 200
         else:
             return jsonify({'message': 'Username or password incorrect', 'status': 'error'}), 401
+    except (hashing.HashingQueueFull, TimeoutError) as e:
+        return jsonify({'message': str(e) or 'Password check timed out', 'status': 'error'}), 503
     except sqlite3.Error as e:
         return jsonify({'message': str(e), 'status': 'error'}), 500
-    finally:
-        conn.close()
-        
+
+@app.route('/api/session', methods=['GET'])
+@sessions.authenticate(session_manager, required=True)
+def get_session():
+    return jsonify({'status': 'success', 'username': g.passenger_id}), 200
+
+@app.route('/api/logout', methods=['POST'])
+@sessions.authenticate(session_manager, required=True)
+def logout():
+    session_manager.revoke(sessions.bearer_token())
+    return jsonify({'message': 'Logged out', 'status': 'success'}), 200
+
+@app.route('/api/db/stats', methods=['GET'])
+def get_db_stats():
+    return jsonify({'pool': db.pool.stats(), 'status': 'success'}), 200
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify({'cache': response_cache.stats(), 'status': 'success'}), 200
+
+@app.route('/api/hashing/stats', methods=['GET'])
+def get_hashing_stats():
+    return jsonify({'hashing': hashing.service.stats(), 'status': 'success'}), 200
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=True)
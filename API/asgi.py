@@ -0,0 +1,303 @@
+import asyncio
+import io
+import json
+import os
+import re
+import sys
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import events
+import hashing
+from app import app as flask_app
+
+# Asyncio serving mode for the flight API: the event loop holds idle and slow
+# connections, and the Flask routes (blocking SQLite and bcrypt work) run on a
+# bounded thread pool with a concurrency limit per endpoint class.
+#
+#   uvicorn asgi:app --workers 4      (or any other ASGI server)
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class Limiter:
+    """Concurrency limit with a bounded number of waiters; beyond that requests are shed."""
+
+    def __init__(self, concurrency, max_waiting):
+        self.concurrency = concurrency
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self):
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    async def __aexit__(self, *exc_info):
+        self.active -= 1
+        self.completed += 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'maxWaiting': self.max_waiting,
+            'active': self.active,
+            'waiting': self.waiting,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+
+def endpoint_class(method, path):
+    # bcrypt-bound routes get their own budget so a login burst cannot starve reads
+    if path in ('/api/login', '/api/passenger'):
+        return 'auth'
+    if method in ('GET', 'HEAD', 'OPTIONS'):
+        return 'read'
+    return 'write'
+
+
+DEPARTURE_EVENTS = re.compile(r'/api/departures/([^/]+)/events')
+
+DEFAULT_LIMITS = {
+    'read': (int(os.environ.get('ASGI_READ_CONCURRENCY', 32)), int(os.environ.get('ASGI_READ_QUEUE', 256))),
+    'write': (int(os.environ.get('ASGI_WRITE_CONCURRENCY', 4)), int(os.environ.get('ASGI_WRITE_QUEUE', 64))),
+    'auth': (int(os.environ.get('ASGI_AUTH_CONCURRENCY', 8)), int(os.environ.get('ASGI_AUTH_QUEUE', 64))),
+}
+
+
+class AsyncFlightAPI:
+    """ASGI front for a WSGI app with per-endpoint-class concurrency limits."""
+
+    def __init__(self, wsgi_app, limits=None, pool=None):
+        self.wsgi_app = wsgi_app
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.limiters = None
+        self.heartbeat = events.HEARTBEAT_SECONDS
+        threads = sum(concurrency for concurrency, _ in self.limits.values())
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+        # Every request the limiters let through must get a connection straight away; a smaller
+        # pool would make the excess wait in acquire() and fail as a 500 instead of being shed as a 503
+        self.pool = pool or db.pool
+        self.pool.grow(threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        # Limiters are created on first use so they belong to the server's event loop
+        if self.limiters is None:
+            self.limiters = {name: Limiter(*limit) for name, limit in self.limits.items()}
+
+        if scope['path'] == '/api/asgi/stats':
+            return await self.send_json(send, 200, {
+                'limits': {name: limiter.stats() for name, limiter in self.limiters.items()},
+                'status': 'success'
+            })
+
+        stream = DEPARTURE_EVENTS.fullmatch(scope['path'])
+        if stream and scope['method'] == 'GET':
+            return await self.stream_events(scope, receive, send, stream.group(1))
+
+        limiter = self.limiters[endpoint_class(scope['method'], scope['path'])]
+        try:
+            async with limiter:
+                body = await self.read_body(receive)
+                await self.run_wsgi(scope, body, receive, send)
+        except Overloaded:
+            await self.send_json(send, 503, {'message': 'Server busy, try again shortly', 'status': 'error'}, [(b'retry-after', b'1')])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                hashing.service.shutdown()
+                self.pool.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def stream_events(self, scope, receive, send, topic):
+        # Served on the event loop instead of the thread pool: an open departure board is
+        # one suspended coroutine, and does not count against any concurrency limit
+        headers = dict(scope.get('headers', []))
+        query = urllib.parse.parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        seq = events.last_event_id(headers.get(b'last-event-id', b'').decode('latin-1'), query.get('since', [None])[0])
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'access-control-allow-origin', b'*')]
+        })
+
+        async def wait_for_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        disconnect = asyncio.ensure_future(wait_for_disconnect())
+        stream = events.stream_async(topic, events.broker.latest if seq is None else seq, heartbeat=self.heartbeat)
+        try:
+            while True:
+                chunk = asyncio.ensure_future(stream.__anext__())
+                await asyncio.wait([chunk, disconnect], return_when=asyncio.FIRST_COMPLETED)
+                if not chunk.done():
+                    chunk.cancel()
+                    try:
+                        await chunk
+                    except asyncio.CancelledError:
+                        pass
+                    break
+                await send({'type': 'http.response.body', 'body': chunk.result().encode('utf-8'), 'more_body': True})
+        finally:
+            disconnect.cancel()
+            await stream.aclose()
+
+    async def read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def send_json(self, send, status, payload, headers=()):
+        body = json.dumps(payload).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + list(headers)
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    def build_environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'CONTENT_LENGTH': str(len(body)),
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f'HTTP_{name}'
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    async def run_wsgi(self, scope, body, receive, send):
+        loop = asyncio.get_running_loop()
+        environ = self.build_environ(scope, body)
+        # A small buffer, so a slow client pauses the worker thread instead of queueing the whole body
+        chunks = asyncio.Queue(maxsize=8)
+        cancelled = threading.Event()
+
+        def put(item):
+            if cancelled.is_set():
+                raise ClientDisconnected()
+            asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            put(('start', int(status.split(' ', 1)[0]), [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]))
+
+        def pump():
+            # The whole response is produced on one thread: Flask pushes and pops the
+            # request context (and hands back the pooled connection) on the same thread
+            try:
+                result = self.wsgi_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        if chunk:
+                            put(('body', chunk))
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+            except ClientDisconnected:
+                pass
+            finally:
+                try:
+                    put(('end',))
+                except ClientDisconnected:
+                    pass
+
+        async def wait_for_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        worker = loop.run_in_executor(self.executor, pump)
+        disconnect = asyncio.ensure_future(wait_for_disconnect())
+        started = False
+        try:
+            while True:
+                item = asyncio.ensure_future(chunks.get())
+                await asyncio.wait([item, disconnect], return_when=asyncio.FIRST_COMPLETED)
+                if not item.done():
+                    item.cancel()
+                    break
+                kind, *payload = item.result()
+                if kind == 'start':
+                    started = True
+                    await send({'type': 'http.response.start', 'status': payload[0], 'headers': payload[1]})
+                elif kind == 'body':
+                    await send({'type': 'http.response.body', 'body': payload[0], 'more_body': True})
+                else:
+                    break
+            if started and not disconnect.done():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnect.cancel()
+            # Unblock the worker if it is waiting on a full buffer, then let it finish and clean up
+            cancelled.set()
+            while not worker.done():
+                while not chunks.empty():
+                    chunks.get_nowait()
+                await asyncio.sleep(0.01)
+            await worker
+
+
+app = AsyncFlightAPI(flask_app)
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('The async serving mode needs an ASGI server: pip install uvicorn')
+    uvicorn.run('asgi:app', host='127.0.0.1', port=5000, workers=int(os.environ.get('WEB_CONCURRENCY', 1)))
@@ -0,0 +1,355 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Load test for every /api route, either in-process through the Flask test client
+# or over real HTTP against a running server:
+#
+#   python bench_load.py --requests 5000 --concurrency 8
+#   python bench_load.py --http http://127.0.0.1:5000 --mix search=80,booking=15,admin=5
+#
+# Results (p50/p95/p99 latency, throughput, errors and, in-process, SQL statements
+# per request) are printed per route and written as JSON for comparing runs.
+# Event streams never end, so for them only the first event is read.
+
+CATEGORIES = ('search', 'booking', 'admin')
+CITIES = ['London', 'Manchester', 'Liverpool', 'Birmingham', 'Leeds', 'Glasgow', 'Edinburgh', 'Bristol', 'Cardiff', 'Belfast']
+
+
+class FlaskClient:
+
+    def __init__(self, flask_app):
+        self._local = threading.local()
+        self._app = flask_app
+
+    def request(self, method, path, payload=None, headers=None):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self._app.test_client()
+        response = self._local.client.open(path, method=method, json=payload, headers=headers or {}, buffered=False)
+        try:
+            if response.mimetype == 'text/event-stream':
+                return response.status_code, next(response.iter_encoded(), b'')
+            return response.status_code, response.get_data()
+        finally:
+            response.close()
+
+
+class HttpClient:
+
+    def __init__(self, base_url):
+        self._base_url = base_url.rstrip('/')
+
+    def request(self, method, path, payload=None, headers=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(self._base_url + path, data=data, method=method, headers=dict(headers or {}))
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                if response.headers.get_content_type() == 'text/event-stream':
+                    return response.status, b''.join(itertools.takewhile(lambda line: line != b'\n', response))
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class SqlCounter:
+    # Counts statements on the pool's connections, per thread, for the in-process mode
+    def __init__(self):
+        self._local = threading.local()
+
+    def install(self, pool):
+        connect = pool._connect
+
+        def traced_connect():
+            conn = connect()
+            conn.set_trace_callback(self._statement)
+            return conn
+        pool._connect = traced_connect
+
+    def _statement(self, sql):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    def read(self):
+        return getattr(self._local, 'count', 0)
+
+
+class Workload:
+    """Seeds a dataset through the API and generates requests against it."""
+
+    def __init__(self, client, seed, flights):
+        self.client = client
+        self.random = random.Random(seed)
+        self.flights = flights
+        self.run_id = f'{seed}{int(time.time())}'
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.flight_nums = []
+        self.passengers = []
+        self.staff = []
+        self.tokens = {}
+
+    def next_id(self):
+        return next(self.ids)
+
+    def choice(self, items):
+        with self.lock:
+            return self.random.choice(items)
+
+    def seed(self):
+        base = int(time.time()) % 1000000 * 1000
+        self.next_flight = itertools.count(base + 1)
+        self.num_ser = base + 1
+        self.client.request('POST', '/api/airplanes', {'serialNumber': self.num_ser, 'manufacturer': 'Boeing', 'modelNumber': '737', 'typeRating': 'A'})
+        for i in range(10):
+            status, body = self.client.request('POST', '/api/staff', self.staff_payload())
+            self.staff.append(json.loads(body)['id'])
+        for staff_id in self.staff:
+            self.client.request('POST', '/api/pilot', {'staffID': staff_id, 'typeRating': 'A'})
+        for i in range(5):
+            passenger_id = f'bench{self.run_id}p{i}'
+            self.client.request('POST', '/api/passenger', self.passenger_payload(passenger_id))
+            self.passengers.append(passenger_id)
+            status, body = self.client.request('POST', '/api/login', {'username': passenger_id, 'password': 'password'})
+            self.tokens[passenger_id] = json.loads(body).get('token')
+        self.client.request('POST', '/api/flight/bulk', [self.flight_payload() for _ in range(self.flights)])
+
+    def staff_payload(self):
+        return {
+            'firstName': 'Bench', 'surname': f'Worker{self.next_id()}', 'salary': 50000,
+            'homeAddress': '1 Home St', 'workAddress': '2 Work St', 'homePhoneNum': '555-0000', 'workPhoneNum': '555-0001'
+        }
+
+    def passenger_payload(self, passenger_id):
+        return {
+            'username': passenger_id, 'firstName': 'Bench', 'surname': 'Passenger', 'password': 'password',
+            'homeAddress': '1 Home St', 'workAddress': '2 Work St', 'homePhoneNumber': '555-0000', 'workPhoneNumber': '555-0001'
+        }
+
+    def flight_payload(self):
+        flight_num = next(self.next_flight)
+        with self.lock:
+            self.flight_nums.append(flight_num)
+            origin, destination = self.random.sample(CITIES, 2)
+            departure = datetime(2024, 6, 1) + timedelta(minutes=15 * self.random.randrange(20000))
+            pilot = self.random.choice(self.staff)
+        return {
+            'flightNum': flight_num, 'numSer': self.num_ser, 'origin': origin, 'destination': destination,
+            'departureTime': departure.strftime('%Y-%m-%d %H:%M:%S'),
+            'arrTime': (departure + timedelta(hours=2)).strftime('%Y-%m-%d %H:%M:%S'),
+            'pilotID': pilot
+        }
+
+    def auth(self, passenger_id):
+        token = self.tokens.get(passenger_id)
+        return {'Authorization': f'Bearer {token}'} if token else {}
+
+    def window(self, days):
+        # ?from=&to= for a stretch of the seeded schedule
+        with self.lock:
+            start = datetime(2024, 6, 1) + timedelta(days=self.random.randrange(200))
+        return urllib.parse.urlencode({'from': start.isoformat(), 'to': (start + timedelta(days=days)).isoformat()})
+
+    # Each scenario returns (route, method, path, payload, headers)
+
+    def search_scenarios(self):
+        origin, destination = self.random.sample(CITIES, 2)
+        return [
+            ('/api/flights', 'GET', f'/api/flights?origin={origin}&destination={destination}', None, None),
+            ('/api/flights', 'GET', '/api/flights?limit=50', None, None),
+            ('/api/flights/search/<flight_num>', 'GET', f'/api/flights/search/{str(self.choice(self.flight_nums))[-3:]}?limit=50', None, None),
+            ('/api/flights/search/', 'GET', '/api/flights/search/?limit=50', None, None),
+            ('/api/flightcrew/<empNum>', 'GET', f'/api/flightcrew/{self.choice(self.staff)}', None, None),
+            ('/api/routes', 'GET', f'/api/routes?origin={origin}&destination={destination}&departAfter=2024-06-01T00:00:00', None, None),
+            ('/api/departures/<city>', 'GET', f'/api/departures/{origin}?after=2024-06-01T00:00:00', None, None),
+            # An unknown position, so the stream starts at once with a reset event
+            ('/api/departures/<city>/events', 'GET', f'/api/departures/{origin}/events?since=-1', None, None),
+            ('/api/flightpath/<flight_num>', 'GET', f'/api/flightpath/{self.choice(self.flight_nums)}', None, None),
+            ('/api/flights/distances', 'POST', '/api/flights/distances', {'flightNums': [self.choice(self.flight_nums) for _ in range(20)]}, None),
+            ('/api/airplanes/<num_ser>/pilots', 'GET', f'/api/airplanes/{self.num_ser}/pilots?{self.window(1)}', None, None),
+            ('/api/airplanes/<num_ser>/rotation', 'GET', f'/api/airplanes/{self.num_ser}/rotation?{self.window(7)}', None, None),
+            ('/api/utilization', 'GET', f'/api/utilization?{self.window(30)}', None, None),
+            ('/api/crew/conflicts', 'GET', f'/api/crew/conflicts?staffID={self.choice(self.staff)}', None, None),
+        ]
+
+    def booking_scenarios(self):
+        passenger_id = self.choice(self.passengers)
+        return [
+            ('/api/booking', 'POST', '/api/booking', {'passengerID': passenger_id, 'flightNum': self.choice(self.flight_nums)}, self.auth(passenger_id)),
+            ('/api/booking/bulk', 'POST', '/api/booking/bulk', [{'passengerID': passenger_id, 'flightNum': self.choice(self.flight_nums)} for _ in range(5)], self.auth(passenger_id)),
+            ('/api/bookings/<passenger_id>', 'GET', f'/api/bookings/{passenger_id}', None, self.auth(passenger_id)),
+            ('/api/session', 'GET', '/api/session', None, self.auth(passenger_id)),
+            ('/api/login', 'POST', '/api/login', {'username': passenger_id, 'password': 'password'}, None),
+        ]
+
+    def admin_scenarios(self):
+        flight_num = self.choice(self.flight_nums)
+        new_id = self.next_id()
+        return [
+            ('/api/intercity', 'POST', '/api/intercity', {'cityName': f'Town{new_id}', 'cityCountry': 'UK'}, None),
+            ('/api/airplanes', 'POST', '/api/airplanes', {'serialNumber': self.num_ser + new_id, 'manufacturer': 'Airbus', 'modelNumber': 'A320', 'typeRating': 'B'}, None),
+            ('/api/staff', 'POST', '/api/staff', self.staff_payload(), None),
+            ('/api/pilot', 'POST', '/api/pilot', {'staffID': self.choice(self.staff), 'typeRating': 'A'}, None),
+            ('/api/flight', 'POST', '/api/flight', self.flight_payload(), None),
+            ('/api/flightcrew', 'POST', '/api/flightcrew', {'staffID': self.choice(self.staff), 'flightNum': flight_num}, None),
+            ('/api/flightpath', 'POST', '/api/flightpath', {'flightNum': flight_num, 'cityID': 1}, None),
+            ('/api/flight/bulk', 'POST', '/api/flight/bulk', [self.flight_payload() for _ in range(20)], None),
+            ('/api/flightcrew/bulk', 'POST', '/api/flightcrew/bulk', [{'staffID': self.choice(self.staff), 'flightNum': self.choice(self.flight_nums)} for _ in range(20)], None),
+            ('/api/flightpath/bulk', 'POST', '/api/flightpath/bulk', [{'flightNum': self.choice(self.flight_nums), 'cityID': 1} for _ in range(20)], None),
+            ('/api/flightcrew/solve', 'POST', '/api/flightcrew/solve', {'flightNums': [self.choice(self.flight_nums) for _ in range(10)], 'pilots': 2}, None),
+            ('/api/passenger', 'POST', '/api/passenger', self.passenger_payload(f'bench{self.run_id}n{new_id}'), None),
+            ('/api/flight/<flight_num>', 'DELETE', f'/api/flight/{self.flight_payload()["flightNum"]}', None, None),
+            ('/api/logout', 'POST', '/api/logout', None, {'Authorization': 'Bearer invalid'}),
+            ('/api/db/stats', 'GET', '/api/db/stats', None, None),
+            ('/api/cache/stats', 'GET', '/api/cache/stats', None, None),
+            ('/api/hashing/stats', 'GET', '/api/hashing/stats', None, None),
+            ('/api/metrics', 'GET', '/api/metrics', None, None),
+        ]
+
+    def next_request(self, mix):
+        with self.lock:
+            category = self.random.choices(list(mix), weights=list(mix.values()))[0]
+        scenarios = getattr(self, f'{category}_scenarios')()
+        return self.choice(scenarios)
+
+
+def unbenchmarked(flask_app, workload):
+    """The app's /api routes, as 'METHOD /path', that no scenario of the workload requests."""
+    covered = {f'{method} {route}' for category in CATEGORIES for route, method, *_ in getattr(workload, f'{category}_scenarios')()}
+    routes = set()
+    for rule in flask_app.url_map.iter_rules():
+        if rule.rule.startswith('/api'):
+            # Scenarios name parameters without their converters: <int:num_ser> is <num_ser>
+            path = re.sub(r'<(?:[^<>:]+:)?([^<>]+)>', r'<\1>', rule.rule)
+            routes.update(f'{method} {path}' for method in rule.methods - {'HEAD', 'OPTIONS'})
+    return sorted(routes - covered)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(sample['latency'] for sample in samples)
+    statements = [sample['statements'] for sample in samples if sample['statements'] is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if sample['status'] >= 500),
+        'statusCodes': {str(code): sum(1 for sample in samples if sample['status'] == code) for code in sorted({sample['status'] for sample in samples})},
+        'throughput': len(samples) / elapsed if elapsed else None,
+        'meanMs': sum(latencies) / len(latencies) * 1000 if latencies else None,
+        'p50Ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'p95Ms': percentile(latencies, 0.95) * 1000 if latencies else None,
+        'p99Ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'sqlStatementsPerRequest': sum(statements) / len(statements) if statements else None,
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, weight = part.split('=')
+        if name not in CATEGORIES:
+            raise argparse.ArgumentTypeError(f'Unknown request class {name}')
+        mix[name] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency and throughput benchmark for the flight API')
+    parser.add_argument('--http', metavar='URL', help='Drive a running server instead of the in-process test client')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('search=80,booking=15,admin=5'))
+    parser.add_argument('--flights', type=int, default=1000, help='Flights seeded before the run')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=f"bench_load_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    args = parser.parse_args()
+
+    counter = None
+    if args.http:
+        client = HttpClient(args.http)
+    else:
+        # In-process runs get a scratch database unless one is given
+        if 'DATABASE' not in os.environ:
+            os.environ['DATABASE'] = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        os.environ.setdefault('BCRYPT_ROUNDS', '4')
+        import db
+        from app import app as flask_app
+        counter = SqlCounter()
+        counter.install(db.pool)
+        client = FlaskClient(flask_app)
+
+    workload = Workload(client, args.seed, args.flights)
+    workload.seed()
+    if not args.http:
+        missing = unbenchmarked(flask_app, workload)
+        if missing:
+            sys.exit(f"No scenario for {', '.join(missing)}")
+
+    samples = []
+    samples_lock = threading.Lock()
+
+    def run_one(_):
+        route, method, path, payload, headers = workload.next_request(args.mix)
+        if counter:
+            counter.reset()
+        start = time.perf_counter()
+        status, _ = client.request(method, path, payload, headers)
+        latency = time.perf_counter() - start
+        with samples_lock:
+            samples.append({'route': f'{method} {route}', 'status': status, 'latency': latency, 'statements': counter.read() if counter else None})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(run_one, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    routes = {}
+    for sample in samples:
+        routes.setdefault(sample['route'], []).append(sample)
+    result = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'target': args.http or 'flask-test-client',
+        'python': sys.version.split()[0],
+        'sqlite': sqlite3.sqlite_version,
+        'concurrency': args.concurrency,
+        'mix': args.mix,
+        'seededFlights': args.flights,
+        'elapsed': elapsed,
+        'overall': summarize(samples, elapsed),
+        'routes': {route: summarize(route_samples, elapsed) for route, route_samples in sorted(routes.items())},
+    }
+
+    print(f"{'route':<44} {'n':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql/req':>8}")
+    for route, stats in list(result['routes'].items()) + [('overall', result['overall'])]:
+        sql = f"{stats['sqlStatementsPerRequest']:.1f}" if stats['sqlStatementsPerRequest'] is not None else '-'
+        print(f"{route:<44} {stats['requests']:>6} {stats['errors']:>4} {stats['p50Ms']:>8.2f} {stats['p95Ms']:>8.2f} {stats['p99Ms']:>8.2f} {sql:>8}")
+    print(f"throughput {result['overall']['throughput']:.0f} req/s over {elapsed:.1f}s")
+
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
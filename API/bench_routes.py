@@ -0,0 +1,67 @@
+import argparse
+import random
+import sqlite3
+import time
+
+from db import DATABASE
+from routing import RouteIndex, parse_time
+
+# Builds the connecting-flight index over an existing database and times
+# random searches and in-place updates against it. Generate a large database first:
+#
+#   python dummyData.py --scale 10000 --database big.db --bcrypt-rounds 4
+#   python bench_routes.py --database big.db
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the connecting-flight search')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--max-legs', type=int, default=3)
+    parser.add_argument('--min-connection', type=int, default=45, help='Minutes')
+    parser.add_argument('--limit', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect(args.database)
+    flights = conn.execute('SELECT COUNT(*) FROM Flight').fetchone()[0]
+    cities = [row[0] for row in conn.execute('SELECT DISTINCT origin FROM Flight')]
+    first, last = (parse_time(value) for value in conn.execute('SELECT MIN(departureTime), MAX(departureTime) FROM Flight').fetchone())
+
+    index = RouteIndex()
+    start = time.perf_counter()
+    with index.reading(conn):
+        pass
+    build = time.perf_counter() - start
+
+    timings = []
+    found = 0
+    for _ in range(args.queries):
+        origin, destination = rng.sample(cities, 2)
+        depart_after = rng.randrange(first, last)
+        start = time.perf_counter()
+        with index.reading(conn):
+            found += len(index.search(origin, destination, depart_after, args.min_connection * 60, args.max_legs, args.limit))
+        timings.append(time.perf_counter() - start)
+
+    sample = conn.execute('SELECT flightNum, origin, destination, arrTime, departureTime FROM Flight ORDER BY random() LIMIT 1000').fetchall()
+    start = time.perf_counter()
+    index.remove_flights(sample)
+    index.add_flights(sample)
+    update = (time.perf_counter() - start) / (2 * len(sample))
+
+    print(f'{flights} flights, {len(cities)} cities, index built in {build:.2f}s')
+    print(f'{args.queries} searches ({found / args.queries:.1f} itineraries each): '
+          f'p50 {percentile(timings, 0.5) * 1000:.2f}ms  p95 {percentile(timings, 0.95) * 1000:.2f}ms  '
+          f'p99 {percentile(timings, 0.99) * 1000:.2f}ms  max {max(timings) * 1000:.2f}ms')
+    print(f'in-place add/remove: {update * 1e6:.1f}us per flight')
+
+
+if __name__ == '__main__':
+    main()
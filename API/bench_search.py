@@ -0,0 +1,78 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from random import randint, seed
+
+from db import PRAGMAS
+from migrations import migrate
+
+# Compares the flight-number search through the flightNumSuffix index with the
+# old LIKE '%<n>%' scan over Flight.
+#
+#   python bench_search.py --flights 1000000
+
+LIKE_QUERY = '''
+    SELECT flightNum, origin, destination, arrTime, departureTime
+    FROM Flight
+    WHERE flightNum LIKE ?
+'''
+
+INDEX_QUERY = '''
+    SELECT flightNum, origin, destination, arrTime, departureTime
+    FROM Flight
+    WHERE flightNum IN (SELECT flightNum FROM flightNumSuffix WHERE suffix >= ? AND suffix < ?)
+'''
+
+
+def build_database(path, flights):
+    conn = sqlite3.connect(path)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    migrate(conn)
+    conn.execute('INSERT INTO Airplane (numSer, manufacturer, modelNum, typeRating) VALUES (1, ?, ?, ?)', ('Boeing', '737', 'A'))
+    start = time.perf_counter()
+    conn.executemany(
+        'INSERT INTO Flight (flightNum, numSer, origin, destination, arrTime, departureTime) VALUES (?, 1, ?, ?, ?, ?)',
+        ((num, 'London', 'Leeds', '2024-05-18 12:00:00', '2024-05-18 10:00:00') for num in range(1, flights + 1))
+    )
+    conn.commit()
+    print(f'Loaded {flights} flights (with suffix index) in {time.perf_counter() - start:.1f}s')
+    return conn
+
+
+def time_query(conn, query, params, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = conn.execute(query, params).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark flight number search')
+    parser.add_argument('--flights', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    seed(args.seed)
+    digits = len(str(args.flights))
+    terms = [str(randint(1, args.flights))[:length] for length in range(2, digits + 1)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        conn = build_database(os.path.join(tmpdir, 'bench.db'), args.flights)
+        print(f"{'term':>10} {'matches':>9} {'LIKE ms':>10} {'index ms':>10} {'speedup':>8}")
+        for term in terms:
+            like_time, like_rows = time_query(conn, LIKE_QUERY, (f'%{term}%',), args.repeat)
+            index_time, index_rows = time_query(conn, INDEX_QUERY, (term, term + ':'), args.repeat)
+            assert like_rows == index_rows, f'{term}: {like_rows} != {index_rows}'
+            print(f'{term:>10} {index_rows:>9} {like_time * 1000:>10.2f} {index_time * 1000:>10.2f} {like_time / index_time:>7.1f}x')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+# Adds N staff who all share the generated ID base "jsmith", once with the old
+# probe-one-suffix-at-a-time loop and once with the counter-backed allocator.
+#
+#   python bench_staff_id.py --staff 10000
+
+tmpdir = tempfile.TemporaryDirectory()
+os.environ['DATABASE'] = os.path.join(tmpdir.name, 'allocator.db')
+
+from app import allocate_staff_id
+from db import PRAGMAS
+from migrations import migrate
+
+
+def open_database(path):
+    conn = sqlite3.connect(path)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    migrate(conn)
+    return conn
+
+
+def legacy_allocate(cur, base_id):
+    staff_id = base_id
+    id_suffix = 1
+    cur.execute('SELECT id FROM Staff WHERE id = ?', (staff_id,))
+    while cur.fetchone() is not None:
+        staff_id = f"{base_id}{id_suffix}"
+        id_suffix += 1
+        cur.execute('SELECT id FROM Staff WHERE id = ?', (staff_id,))
+    return staff_id
+
+
+def run(conn, allocate, staff):
+    cur = conn.cursor()
+    start = time.perf_counter()
+    for _ in range(staff):
+        cur.execute('BEGIN IMMEDIATE')
+        staff_id = allocate(cur, 'jsmith')
+        cur.execute('INSERT INTO Staff (id, firstName, surname, salary) VALUES (?, ?, ?, ?)', (staff_id, 'J', 'Smith', 50000.0))
+        conn.commit()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark staff ID allocation for a shared surname')
+    parser.add_argument('--staff', type=int, default=10000)
+    args = parser.parse_args()
+
+    legacy = run(open_database(os.path.join(tmpdir.name, 'legacy.db')), legacy_allocate, args.staff)
+    counter = run(open_database(os.environ['DATABASE']), allocate_staff_id, args.staff)
+
+    print(f"{'allocator':>10} {'total s':>9} {'per insert ms':>14}")
+    print(f"{'legacy':>10} {legacy:>9.2f} {legacy / args.staff * 1000:>14.3f}")
+    print(f"{'counter':>10} {counter:>9.2f} {counter / args.staff * 1000:>14.3f}")
+    print(f'speedup {legacy / counter:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, g, make_response, request
+
+from db import get_db, table_versions
+
+# Rough per-entry bookkeeping cost on top of the body, so many tiny entries still count
+ENTRY_OVERHEAD = 256
+
+
+class ResponseCache:
+    """LRU cache of serialized responses, bounded by total size and entry age.
+
+    Every entry remembers the generation of the tables it was built from and is
+    only served while those tables are still at the same generation.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._expirations = 0
+        self._evictions = 0
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[4]
+
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            entry_versions, expires, body, status, _ = entry
+            if entry_versions != versions:
+                self._invalidations += 1
+            elif expires < time.monotonic():
+                self._expirations += 1
+            else:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return body, status
+            self._drop(key)
+            self._misses += 1
+            return None
+
+    def put(self, key, versions, body, status):
+        size = len(body) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (versions, time.monotonic() + self.ttl, body, status, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'maxBytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hitRate': self._hits / lookups if lookups else 0.0,
+                'invalidations': self._invalidations,
+                'expirations': self._expirations,
+                'evictions': self._evictions,
+            }
+
+
+def streaming():
+    # ?stream=1 (or true): the response is written out as it is produced, and so never cached
+    return request.args.get('stream', '').lower() in ('1', 'true')
+
+
+def cached(response_cache, tables):
+    # Caches a JSON view per path, query string and session user for as long as the given tables are unchanged
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if streaming():
+                return view(*args, **kwargs)
+
+            # Versions are read before the view runs, so a write racing with it can only make the entry look stale
+            versions = table_versions(get_db(), tables)
+            key = (request.path, tuple(sorted(request.args.items(multi=True))), g.get('passenger_id'))
+            hit = response_cache.get(key, versions)
+            if hit is not None:
+                body, status = hit
+                return Response(body, status=status, mimetype='application/json')
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code in (200, 404) and not response.is_streamed:
+                response_cache.put(key, versions, response.get_data(), response.status_code)
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional(scope, key_arg):
+    # ETag from the changeStamp version of the resource's owner; a matching
+    # If-None-Match is answered with 304 before the view (or the cache) runs
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            row = get_db().execute(
+                'SELECT version FROM changeStamp WHERE scope = ? AND key = ?',
+                (scope, kwargs[key_arg])
+            ).fetchone()
+            etag = f'{scope}-{row[0] if row else 0}'
+
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,165 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+from indexes import VersionedIndex
+from routing import parse_time
+
+# Crew assignments per staff member as duty intervals, for catching double
+# bookings: two flights conflict when they overlap or leave less than the
+# minimum rest between one landing and the next departure.
+
+
+def duty_window(departure_time, arr_time):
+    # (departure, arrival) in seconds since the epoch, or None when the times cannot be compared
+    departure, arrival = parse_time(departure_time), parse_time(arr_time)
+    if departure is None or arrival is None or arrival < departure:
+        return None
+    return departure, arrival
+
+
+class Roster:
+    """One staff member's flights in departure order.
+
+    latest[i] is the latest arrival among the first i + 1 flights, so whether
+    anything departing before a given time is still in the air (or resting)
+    after another is a single lookup. longest is the longest duty, which
+    bounds how far back a flight can have departed and still overlap.
+    """
+
+    __slots__ = ('times', 'arrivals', 'flights', 'latest', 'longest')
+
+    def __init__(self, duties=()):
+        duties = sorted(duties)
+        self.times = array('q', [duty[0] for duty in duties])
+        self.arrivals = array('q', [duty[1] for duty in duties])
+        self.flights = array('q', [duty[2] for duty in duties])
+        self.latest = array('q', self.arrivals)
+        for i in range(1, len(duties)):
+            self.latest[i] = max(self.latest[i], self.latest[i - 1])
+        self.longest = max((duty[1] - duty[0] for duty in duties), default=0)
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, departure, arrival, flight_num):
+        # Returns the position the flight was inserted at
+        i = bisect_right(self.times, departure)
+        self.times.insert(i, departure)
+        self.arrivals.insert(i, arrival)
+        self.flights.insert(i, flight_num)
+        self.latest.insert(i, max(arrival, self.latest[i - 1]) if i else arrival)
+        self.longest = max(self.longest, arrival - departure)
+        for j in range(i + 1, len(self.latest)):
+            if self.latest[j] >= arrival:
+                break
+            self.latest[j] = arrival
+        return i
+
+    def remove(self, departure, flight_num):
+        # Position the flight was removed from, or None if it was not there
+        i = bisect_left(self.times, departure)
+        while i < len(self.times) and self.times[i] == departure:
+            if self.flights[i] == flight_num:
+                break
+            i += 1
+        else:
+            return None
+        duration = self.arrivals[i] - self.times[i]
+        for column in (self.times, self.arrivals, self.flights, self.latest):
+            column.pop(i)
+        if duration == self.longest:
+            self.longest = max((arrival - departure for departure, arrival in zip(self.times, self.arrivals)), default=0)
+        for j in range(i, len(self.latest)):
+            latest = max(self.arrivals[j], self.latest[j - 1]) if j else self.arrivals[j]
+            if latest == self.latest[j]:
+                break
+            self.latest[j] = latest
+        return i
+
+    def conflicts(self, departure, arrival, min_rest):
+        # Flights that depart before this one lands (plus rest) and land after it departs (minus rest).
+        # Nothing departing more than the longest duty before that can still be in the air, so the walk
+        # back stops there even when one long duty early on keeps latest high for the rest of the roster
+        i = bisect_left(self.times, arrival + min_rest)
+        stop = bisect_right(self.times, departure - min_rest - self.longest)
+        found = []
+        while i > stop and self.latest[i - 1] > departure - min_rest:
+            i -= 1
+            if self.arrivals[i] > departure - min_rest:
+                found.append(self.flights[i])
+        return found
+
+    def busy_until(self, departure, arrival, min_rest):
+        # The latest landing among the flights that conflict with this one, None when nothing does
+        i = bisect_left(self.times, arrival + min_rest)
+        return self.latest[i - 1] if i and self.latest[i - 1] > departure - min_rest else None
+
+    def audit(self, min_rest):
+        # One pass in departure order against the latest landing so far
+        latest, latest_flight = None, None
+        for departure, arrival, flight_num in zip(self.times, self.arrivals, self.flights):
+            if latest is not None and departure < latest + min_rest:
+                yield flight_num, latest_flight, departure - latest
+            if latest is None or arrival > latest:
+                latest, latest_flight = arrival, flight_num
+
+
+def overlapping(duties, departure, arrival, min_rest):
+    # The same test over a short list of (departure, arrival, flightNum), for assignments not yet committed
+    return [flight_num for other_departure, other_arrival, flight_num in duties
+            if other_departure < arrival + min_rest and other_arrival > departure - min_rest]
+
+
+class CrewIndex(VersionedIndex):
+    tables = ('flightCrew', 'Flight')
+
+    def __init__(self):
+        super().__init__()
+        self._rosters = {}
+
+    def load(self, conn):
+        rows = conn.execute('''
+            SELECT fc.staffID, f.departureEpoch, f.arrivalEpoch, f.flightNum
+            FROM flightCrew fc JOIN Flight f ON f.flightNum = fc.flightNum
+            WHERE f.departureEpoch IS NOT NULL AND f.arrivalEpoch >= f.departureEpoch
+        ''')
+        duties = {}
+        for staff_id, departure, arrival, flight_num in rows:
+            duties.setdefault(staff_id, []).append((departure, arrival, flight_num))
+        self._rosters = {staff_id: Roster(staff_duties) for staff_id, staff_duties in duties.items()}
+
+    def rosters(self):
+        return self._rosters
+
+    def conflicts(self, staff_id, departure, arrival, min_rest):
+        roster = self._rosters.get(staff_id)
+        return roster.conflicts(departure, arrival, min_rest) if roster is not None else []
+
+    def busy_until(self, staff_id, departure, arrival, min_rest):
+        roster = self._rosters.get(staff_id)
+        return roster.busy_until(departure, arrival, min_rest) if roster is not None else None
+
+    def add(self, assignments):
+        # Rows of (staffID, departure, arrival, flightNum)
+        for staff_id, departure, arrival, flight_num in assignments:
+            self._rosters.setdefault(staff_id, Roster()).add(departure, arrival, flight_num)
+
+    def remove(self, assignments):
+        for staff_id, departure, arrival, flight_num in assignments:
+            roster = self._rosters.get(staff_id)
+            if roster is not None:
+                roster.remove(departure, flight_num)
+                if not roster:
+                    del self._rosters[staff_id]
+
+    def audit(self, min_rest, staff_id=None):
+        # Every conflicting pair, as (staffID, flightNum, conflictsWith, gap in seconds)
+        if staff_id is not None:
+            rosters = [(staff_id, self._rosters[staff_id])] if staff_id in self._rosters else []
+        else:
+            rosters = sorted(self._rosters.items())
+        return [
+            (roster_staff_id, flight_num, other, gap)
+            for roster_staff_id, roster in rosters
+            for flight_num, other, gap in roster.audit(min_rest)
+        ]
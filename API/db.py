@@ -0,0 +1,165 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import g
+
+from metrics import InstrumentedConnection
+
+DATABASE = os.environ.get('DATABASE', 'airplane.db')
+
+# Applied once to every connection the pool opens
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+)
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by the threads of one worker process."""
+
+    def __init__(self, database=DATABASE, max_size=8, timeout=10.0):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._hits = 0
+        self._misses = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False, factory=InstrumentedConnection)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        # Connections must never cross a fork, so a new worker starts with an empty pool
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+        if conn is not None:
+            with self._lock:
+                self._hits += 1
+            return conn
+
+        with self._lock:
+            create = self._created < self.max_size
+            if create:
+                self._created += 1
+                self._misses += 1
+        if create:
+            try:
+                return self._connect()
+            except sqlite3.Error:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # Pool is exhausted, wait for another request to hand a connection back
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError('Timed out waiting for a database connection')
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._waits += 1
+            self._wait_time += waited
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A broken connection is dropped so its slot can be refilled
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    def grow(self, max_size):
+        # Raises the limit, never lowers it: e.g. to one connection for every thread that may ask for one
+        with self._lock:
+            self.max_size = max(self.max_size, max_size)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._reset()
+
+    def stats(self):
+        with self._lock:
+            requests = self._hits + self._misses + self._waits
+            return {
+                'size': self._created,
+                'maxSize': self.max_size,
+                'idle': self._idle.qsize(),
+                'hits': self._hits,
+                'misses': self._misses,
+                'waits': self._waits,
+                'hitRate': self._hits / requests if requests else 0.0,
+                'totalWaitTime': self._wait_time,
+                'avgWaitTime': self._wait_time / self._waits if self._waits else 0.0,
+                'maxWaitTime': self._max_wait,
+            }
+
+
+# The async serving mode grows this to one connection per worker thread (asgi.py)
+pool = ConnectionPool(
+    max_size=int(os.environ.get('DB_POOL_SIZE', 8)),
+    timeout=float(os.environ.get('DB_POOL_TIMEOUT', 10.0))
+)
+
+
+def get_db():
+    # One pooled connection per app context, handed back in close_db
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+
+def close_db(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool.release(conn)
+
+
+def table_versions(conn, tables):
+    # Current generation of each table, in the order asked for
+    rows = dict(conn.execute(
+        f"SELECT tableName, version FROM tableVersion WHERE tableName IN ({', '.join('?' * len(tables))})",
+        tables
+    ).fetchall())
+    return tuple(rows.get(table, 0) for table in tables)
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
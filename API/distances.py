@@ -0,0 +1,112 @@
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+
+from indexes import VersionedIndex
+
+# Great-circle distances along flight paths. A path is identified by its
+# signature, the city IDs it visits in order (origin, waypoints, destination),
+# so flights flying the same route share one cached result, and a flight whose
+# path is changed simply looks up a different signature. Everything not yet
+# cached is computed together: one array of all the legs, one vectorized
+# haversine over it.
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    # Kilometres between points given in degrees, element-wise over arrays
+    lat1, lon1, lat2, lon2 = (np.radians(values) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class DistanceIndex(VersionedIndex):
+    """City coordinates as arrays, plus an LRU of distances per path signature.
+
+    Rebuilding (when interCity changes) also empties the cache, since a city
+    may have been given coordinates or moved.
+    """
+
+    tables = ('interCity',)
+
+    def __init__(self, max_paths=100000):
+        super().__init__()
+        self.max_paths = max_paths
+        self._cities = {}
+        self._by_name = {}
+        self._ids = np.empty(0, dtype=np.int64)
+        # One extra NaN row at the end stands in for unknown cities
+        self._lat = np.full(1, np.nan)
+        self._lon = np.full(1, np.nan)
+        self._paths = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, conn):
+        rows = conn.execute('SELECT cityID, cityName, latitude, longitude FROM interCity ORDER BY cityID').fetchall()
+        self._cities = {city_id: (name, lat, lon) for city_id, name, lat, lon in rows}
+        self._by_name = {}
+        for city_id, name, _, _ in rows:
+            self._by_name.setdefault(name, city_id)
+        self._ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self._lat = np.array([row[2] for row in rows] + [None], dtype=float)
+        self._lon = np.array([row[3] for row in rows] + [None], dtype=float)
+        self._paths.clear()
+
+    def city_id(self, name):
+        return self._by_name.get(name)
+
+    def city(self, city_id):
+        # (cityName, latitude, longitude) or None
+        return self._cities.get(city_id)
+
+    def _positions(self, city_ids):
+        # Rows in the coordinate arrays, the NaN row for IDs that are not known
+        positions = np.searchsorted(self._ids, city_ids)
+        positions[positions >= len(self._ids)] = len(self._ids)
+        found = positions < len(self._ids)
+        found[found] = self._ids[positions[found]] == city_ids[found]
+        positions[~found] = len(self._ids)
+        return positions
+
+    def distances(self, signatures):
+        """(leg distances, total) in km for each signature of two or more cities.
+
+        Legs touching a city without coordinates, and the totals of their
+        paths, are None.
+        """
+        missing = [signature for signature in dict.fromkeys(signatures) if signature not in self._paths]
+        self.hits += len(signatures) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            lengths = np.fromiter((len(signature) for signature in missing), dtype=np.int64, count=len(missing))
+            city_ids = np.fromiter(
+                (-1 if city_id is None else city_id for city_id in itertools.chain.from_iterable(missing)),
+                dtype=np.int64, count=int(lengths.sum())
+            )
+            positions = self._positions(city_ids)
+            # A leg joins each city to the next one, except across the end of a path
+            joins = np.ones(len(positions) - 1, dtype=bool)
+            joins[np.cumsum(lengths)[:-1] - 1] = False
+            starts = np.flatnonzero(joins)
+            legs = haversine(
+                self._lat[positions[starts]], self._lon[positions[starts]],
+                self._lat[positions[starts + 1]], self._lon[positions[starts + 1]]
+            )
+            leg_counts = lengths - 1
+            offsets = np.concatenate(([0], np.cumsum(leg_counts)[:-1]))
+            totals = np.add.reduceat(legs, offsets) if len(legs) else np.zeros(len(missing))
+            for signature, offset, count, total in zip(missing, offsets.tolist(), leg_counts.tolist(), totals.tolist()):
+                # NaN (a city without coordinates) is the one value not equal to itself
+                path_legs = [None if leg != leg else leg for leg in legs[offset:offset + count].tolist()]
+                self._paths[signature] = (path_legs, None if total != total else total)
+
+        results = []
+        for signature in signatures:
+            self._paths.move_to_end(signature)
+            results.append(self._paths[signature])
+        while len(self._paths) > self.max_paths:
+            self._paths.popitem(last=False)
+        return results
@@ -1,128 +1,79 @@
+import argparse
+import itertools
+import random
 import sqlite3
+import time
 import bcrypt
 from datetime import datetime, timedelta
-from random import choice, randint, sample
-from app import init_db
+from db import DATABASE
+from migrations import migrate
+
+# Synthetic dataset generator. Scale 1 is the original demo dataset (5 airplanes,
+# 5 passengers, 100 flights) with the 50 staff needed to crew it; every table grows
+# linearly with the scale, and the same seed and start date always produce the
+# same rows.
+#
+# Each airplane has its own crew teams of pilots rated for it and cabin crew, and
+# the teams take turns by day. An airplane's legs never overlap, so neither do the
+# duties of its crew. A reserve pilot and cabin crew member per airplane are left
+# off every roster, for the solver to use.
+#
+#   python dummyData.py                                  # demo data in airplane.db
+#   python dummyData.py --scale 10000 --seed 7 --database big.db   # 1M flights
 
 # List of UK places
 uk_places = [
-    'London', 'Manchester', 'Liverpool', 'Birmingham', 'Leeds', 'Glasgow', 
-    'Edinburgh', 'Bristol', 'Cardiff', 'Belfast', 'Newcastle', 'Sheffield', 
+    'London', 'Manchester', 'Liverpool', 'Birmingham', 'Leeds', 'Glasgow',
+    'Edinburgh', 'Bristol', 'Cardiff', 'Belfast', 'Newcastle', 'Sheffield',
     'Nottingham', 'Leicester', 'Brighton'
 ]
 
+# Latitude and longitude of each place
+coordinates = {
+    'London': (51.5074, -0.1278), 'Manchester': (53.4808, -2.2426), 'Liverpool': (53.4084, -2.9916),
+    'Birmingham': (52.4862, -1.8904), 'Leeds': (53.8008, -1.5491), 'Glasgow': (55.8642, -4.2518),
+    'Edinburgh': (55.9533, -3.1883), 'Bristol': (51.4545, -2.5879), 'Cardiff': (51.4816, -3.1791),
+    'Belfast': (54.5973, -5.9301), 'Newcastle': (54.9783, -1.6178), 'Sheffield': (53.3811, -1.4701),
+    'Nottingham': (52.9548, -1.1581), 'Leicester': (52.6369, -1.1398), 'Brighton': (50.8225, -0.1372)
+}
+
 # List of type ratings
 type_ratings = ['A', 'B', 'C', 'D', 'E', 'F']
 
-def init_db():
+# The first departures when no start date is given, so a seed alone fixes the schedule
+DEFAULT_START = datetime(2024, 6, 1)
+
+TEAMS_PER_AIRPLANE = 2
+TEAM_PILOTS = 2
+TEAM_CABIN_CREW = 2
+TEAM_SIZE = TEAM_PILOTS + TEAM_CABIN_CREW
+# The teams, then the reserve pilot and the reserve cabin crew member
+STAFF_PER_AIRPLANE = TEAMS_PER_AIRPLANE * TEAM_SIZE + 2
+
+airplane_models = [('Boeing', '737'), ('Airbus', 'A320'), ('Boeing', '747'), ('Airbus', 'A380'), ('Embraer', 'E190')]
+seats = {'737': 189, 'A320': 180, '747': 416, 'A380': 555, 'E190': 100}
+first_names = ['John', 'Jane', 'Jim', 'Jack', 'Jill', 'Alice', 'Bob', 'Charlie', 'Diana', 'Ethan', 'Fiona', 'George']
+surnames = ['Doe', 'Smith', 'Brown', 'White', 'Green', 'Johnson', 'Lee', 'Kim', 'Wang', 'Clark', 'Taylor', 'Evans']
+streets = ['Elm', 'Oak', 'Pine', 'Maple', 'Birch', 'Cedar', 'Spruce', 'Fir', 'Aspen', 'Redwood', 'Apple', 'Peach']
+
+# Only the base schema exists while loading: the later migrations build their
+# indexes, triggers and derived tables from the loaded rows in one pass each
+LOAD_SCHEMA_VERSION = 1
+
+def init_db(database=DATABASE):
+    conn = None
     try:
-        conn = sqlite3.connect('airplane.db')
+        conn = sqlite3.connect(database)
         cur = conn.cursor()
-        
-        # Dropping tables if they exist
-        tables = ['Airplane', 'interCity', 'Staff', 'Contact', 'Pilot', 'Flight', 'flightCrew', 'flightPath', 'Passenger', 'PassengerContact', 'Booking']
+
+        # Dropping every table (and with them their indexes) and rebuilding from the migrations
+        tables = [row[0] for row in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()]
         for table in tables:
             cur.execute(f'DROP TABLE IF EXISTS {table}')
-        
-        # Creating tables
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Airplane (
-                numSer INTEGER PRIMARY KEY,
-                manufacturer VARCHAR(100),
-                modelNum VARCHAR(100),
-                typeRating VARCHAR(100)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS interCity (
-                cityID INTEGER PRIMARY KEY,
-                cityName VARCHAR(100),
-                cityCountry VARCHAR(100)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Staff (
-                id VARCHAR(100) PRIMARY KEY,
-                firstName VARCHAR(100),
-                surname VARCHAR(100),
-                salary FLOAT
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Contact (
-                id INTEGER PRIMARY KEY,
-                staffID VARCHAR(100),
-                homeAddress VARCHAR(100),
-                workAddress VARCHAR(100),
-                homePhoneNum VARCHAR(100),
-                workPhoneNum VARCHAR(100),
-                FOREIGN KEY(staffID) REFERENCES Staff(id)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Pilot (
-                id VARCHAR(100) PRIMARY KEY,
-                typeRating VARCHAR(100),
-                FOREIGN KEY(id) REFERENCES Staff(id)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Flight (
-                flightNum INTEGER PRIMARY KEY,
-                numSer INTEGER,
-                origin VARCHAR(100),
-                destination VARCHAR(100),
-                arrTime DATETIME,
-                departureTime DATETIME,
-                FOREIGN KEY (numSer) REFERENCES Airplane(numSer)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS flightCrew (
-                staffID VARCHAR(100),
-                flightNum INTEGER,
-                PRIMARY KEY (staffID, flightNum),
-                FOREIGN KEY (staffID) REFERENCES Staff(id),
-                FOREIGN KEY (flightNum) REFERENCES Flight(flightNum)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS flightPath (
-                flightNum INTEGER,
-                cityID INTEGER,
-                PRIMARY KEY (flightNum, cityID),
-                FOREIGN KEY (flightNum) REFERENCES Flight(flightNum),
-                FOREIGN KEY (cityID) REFERENCES interCity(cityID)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Passenger (
-                passengerID VARCHAR(100) PRIMARY KEY,
-                firstName VARCHAR(100),
-                surname VARCHAR(100),
-                password BLOB
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS PassengerContact (
-                passengerID VARCHAR(100) PRIMARY KEY,
-                homeAddress VARCHAR(100),
-                workAddress VARCHAR(100),
-                homePhoneNumber VARCHAR(100),
-                workPhoneNumber VARCHAR(100),
-                FOREIGN KEY (passengerID) REFERENCES Passenger(passengerID)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS Booking (
-                passengerID VARCHAR(100),
-                flightNum Integer,
-                PRIMARY KEY (passengerID, flightNum),
-                FOREIGN KEY (passengerID) REFERENCES Passenger(passengerID),
-                FOREIGN KEY (flightNum) REFERENCES Flight(flightNum)
-            )
-        ''')
+        cur.execute('PRAGMA user_version = 0')
         conn.commit()
+
+        migrate(conn, target=LOAD_SCHEMA_VERSION)
         print("Database and tables created successfully.")
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
@@ -130,138 +81,153 @@ def init_db():
         if conn:
             conn.close()
 
-def insert_test_data():
+def insert_chunked(conn, query, rows, chunk_size):
+    # One executemany and one transaction per chunk, so memory stays flat however many rows are generated
+    total = 0
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return total
+        conn.executemany(query, chunk)
+        conn.commit()
+        total += len(chunk)
+
+def staff_id(n):
+    return f'S{n:03d}'
+
+def passenger_id(n):
+    return f'P{n:03d}'
+
+def airplane_rating(num_ser):
+    return type_ratings[(num_ser - 1) % len(type_ratings)]
+
+def is_pilot(n):
+    # Staff are numbered airplane by airplane: each team's pilots first, then its cabin crew
+    team, member = divmod((n - 1) % STAFF_PER_AIRPLANE, TEAM_SIZE)
+    return member == 0 if team == TEAMS_PER_AIRPLANE else member < TEAM_PILOTS
+
+def pilot_rating(rng, n):
+    # Rated for their own airplane, and now and then for a wider class as well
+    level = type_ratings.index(airplane_rating((n - 1) // STAFF_PER_AIRPLANE + 1))
+    if level and rng.random() < 0.25:
+        level -= 1
+    return type_ratings[level]
+
+def crew_rows(flights):
+    # The team on duty that day crews each leg of its airplane
+    for flight_num, num_ser, departure in flights:
+        team = datetime.strptime(departure[:10], '%Y-%m-%d').toordinal() % TEAMS_PER_AIRPLANE
+        first = (num_ser - 1) * STAFF_PER_AIRPLANE + team * TEAM_SIZE + 1
+        for n in range(first, first + TEAM_SIZE):
+            yield staff_id(n), flight_num
+
+def contact(rng):
+    return (
+        f'{rng.randint(1, 999)} {rng.choice(streets)} St', f'{rng.randint(1, 999)} {rng.choice(streets)} St',
+        f'555-{rng.randint(0, 9999):04d}', f'555-{rng.randint(0, 9999):04d}'
+    )
+
+def generate_flights(rng, airplanes, start):
+    # Each airplane flies a chain of legs: the next departure is from where it
+    # last landed, after a turnaround, so rotations and connections look real
+    position = {num_ser: (start + timedelta(minutes=rng.randrange(0, 24 * 60, 5)), rng.choice(uk_places)) for num_ser in airplanes}
+    for flight_num in itertools.count(1):
+        num_ser = airplanes[(flight_num - 1) % len(airplanes)]
+        ready, origin = position[num_ser]
+        destination = rng.choice([place for place in uk_places if place != origin])
+        departure = ready + timedelta(minutes=rng.randrange(45, 180, 5))
+        arrival = departure + timedelta(minutes=rng.randrange(60, 300, 5))
+        position[num_ser] = (arrival, destination)
+        yield (flight_num, num_ser, origin, destination, arrival.strftime('%Y-%m-%d %H:%M:%S'), departure.strftime('%Y-%m-%d %H:%M:%S'))
+
+def insert_test_data(database=DATABASE, scale=1, seed=None, start=None, chunk_size=10000, password_pool=4, bcrypt_rounds=12):
+    rng = random.Random(seed)
+    start = start or DEFAULT_START
+    num_airplanes = 5 * scale
+    num_staff = num_airplanes * STAFF_PER_AIRPLANE
+    num_passengers = 5 * scale
+    num_flights = 100 * scale
+    conn = None
     try:
-        conn = sqlite3.connect('airplane.db')
-        cur = conn.cursor()
+        conn = sqlite3.connect(database)
+        # The file is rebuilt from scratch, so durability while loading buys nothing
+        conn.execute('PRAGMA journal_mode = MEMORY')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA cache_size = -256000')
+        conn.execute('PRAGMA temp_store = MEMORY')
+
+        airplanes = list(range(1, num_airplanes + 1))
+        count = insert_chunked(conn, 'INSERT INTO Airplane (numSer, manufacturer, modelNum, typeRating) VALUES (?, ?, ?, ?)', (
+            (num_ser, *airplane_models[(num_ser - 1) % len(airplane_models)], airplane_rating(num_ser))
+            for num_ser in airplanes
+        ), chunk_size)
+        print(f"Airplane data inserted successfully ({count} rows).")
 
-        # Inserting data into Airplane table
-        airplanes = [
-            (1, 'Boeing', '737', 'A'),
-            (2, 'Airbus', 'A320', 'B'),
-            (3, 'Boeing', '747', 'C'),
-            (4, 'Airbus', 'A380', 'D'),
-            (5, 'Embraer', 'E190', 'E')
-        ]
-        cur.executemany('INSERT INTO Airplane (numSer, manufacturer, modelNum, typeRating) VALUES (?, ?, ?, ?)', airplanes)
-        print("Airplane data inserted successfully.")
-
-        # Inserting data into interCity table
         cities = [(i + 1, place, 'UK') for i, place in enumerate(uk_places)]
-        cur.executemany('INSERT INTO interCity (cityID, cityName, cityCountry) VALUES (?, ?, ?)', cities)
-        print("interCity data inserted successfully.")
-
-        # Inserting data into Staff table
-        staff = [
-            ('S001', 'John', 'Doe', 70000),
-            ('S002', 'Jane', 'Smith', 75000),
-            ('S003', 'Jim', 'Brown', 60000),
-            ('S004', 'Jack', 'White', 80000),
-            ('S005', 'Jill', 'Green', 72000)
-        ]
-        cur.executemany('INSERT INTO Staff (id, firstName, surname, salary) VALUES (?, ?, ?, ?)', staff)
-        print("Staff data inserted successfully.")
-
-        # Inserting data into Contact table
-        contacts = [
-            (1, 'S001', '123 Elm St', '456 Oak St', '555-1234', '555-5678'),
-            (2, 'S002', '789 Pine St', '101 Maple St', '555-8765', '555-4321'),
-            (3, 'S003', '234 Birch St', '567 Cedar St', '555-3456', '555-6789'),
-            (4, 'S004', '890 Spruce St', '321 Fir St', '555-6543', '555-9876'),
-            (5, 'S005', '456 Aspen St', '678 Redwood St', '555-9876', '555-1234')
-        ]
-        cur.executemany('INSERT INTO Contact (id, staffID, homeAddress, workAddress, homePhoneNum, workPhoneNum) VALUES (?, ?, ?, ?, ?, ?)', contacts)
-        print("Contact data inserted successfully.")
-
-        # Inserting data into Pilot table
-        pilots = [
-            ('S001', 'A'),
-            ('S002', 'A'),
-            ('S003', 'A'),
-            ('S004', 'A'),
-            ('S005', 'A')
-        ]
-        cur.executemany('INSERT INTO Pilot (id, typeRating) VALUES (?, ?)', pilots)
-        print("Pilot data inserted successfully.")
-
-        # Inserting data into Flight table with random UK places
-        base_time = datetime.now()
-        flights = []
-        for i in range(1, 101):
-            origin, destination = sample(uk_places, 2)
-            arr_time = (base_time + timedelta(hours=randint(1, 5))).strftime('%Y-%m-%d %H:%M:%S')
-            dep_time = base_time.strftime('%Y-%m-%d %H:%M:%S')
-            airplane = choice(airplanes)
-            flights.append((i, airplane[0], origin, destination, arr_time, dep_time))
-            base_time += timedelta(hours=1)
-
-        cur.executemany('INSERT INTO Flight (flightNum, numSer, origin, destination, arrTime, departureTime) VALUES (?, ?, ?, ?, ?, ?)', flights)
-        print("Flight data inserted successfully.")
-
-        # Inserting data into flightCrew table
-        assigned_crews = []
-        flight_crews = []
-        for i in range(1, 101):
-            staff_id = f'S00{randint(1, 5)}'
-            assigned_crews.append((staff_id, i))
-            flight_crews.append((staff_id, i))
-
-        cur.executemany('INSERT INTO flightCrew (staffID, flightNum) VALUES (?, ?)', flight_crews)
-        print("flightCrew data inserted successfully.")
-
-        # Inserting data into flightPath table
-        flight_paths = []
-        assigned_paths = set()
-        for i in range(1, 101):
-            city_ids = sample(range(1, len(uk_places) + 1), randint(2, 4))
-            for city_id in city_ids:
-                if (i, city_id) not in assigned_paths:
-                    assigned_paths.add((i, city_id))
-                    flight_paths.append((i, city_id))
-
-        cur.executemany('INSERT INTO flightPath (flightNum, cityID) VALUES (?, ?)', flight_paths)
-        print("flightPath data inserted successfully.")
-
-        # Inserting data into Passenger table with hashed passwords
-        password = b'password'  # All passwords are set to 'password'
-        hashed_password = bcrypt.hashpw(password, bcrypt.gensalt())
-        passengers = [
-            ('P001', 'Alice', 'Johnson', hashed_password),
-            ('P002', 'Bob', 'Lee', hashed_password),
-            ('P003', 'Charlie', 'Kim', hashed_password),
-            ('P004', 'Diana', 'Wang', hashed_password),
-            ('P005', 'Ethan', 'Clark', hashed_password)
-        ]
-        cur.executemany('INSERT INTO Passenger (passengerID, firstName, surname, password) VALUES (?, ?, ?, ?)', passengers)
-        print("Passenger data inserted successfully.")
-
-        # Inserting data into PassengerContact table
-        passenger_contacts = [
-            ('P001', '789 Apple St', '123 Peach St', '555-6789', '555-1234'),
-            ('P002', '456 Banana St', '789 Grape St', '555-8765', '555-4321'),
-            ('P003', '123 Cherry St', '456 Lime St', '555-3456', '555-6789'),
-            ('P004', '789 Fig St', '123 Plum St', '555-6543', '555-9876'),
-            ('P005', '456 Kiwi St', '789 Pear St', '555-9876', '555-1234')
-        ]
-        cur.executemany('INSERT INTO PassengerContact (passengerID, homeAddress, workAddress, homePhoneNumber, workPhoneNumber) VALUES (?, ?, ?, ?, ?)', passenger_contacts)
-        print("PassengerContact data inserted successfully.")
-
-        # Inserting data into Booking table
-        assigned_bookings = set()
-        bookings = []
-        for _ in range(100):
-            while True:
-                passenger_id = f'P00{randint(1, 5)}'
-                flight_num = randint(1, 100)
-                if (passenger_id, flight_num) not in assigned_bookings:
-                    assigned_bookings.add((passenger_id, flight_num))
-                    bookings.append((passenger_id, flight_num))
-                    break
-
-        cur.executemany('INSERT INTO Booking (passengerID, flightNum) VALUES (?, ?)', bookings)
-        print("Booking data inserted successfully.")
-
+        count = insert_chunked(conn, 'INSERT INTO interCity (cityID, cityName, cityCountry) VALUES (?, ?, ?)', cities, chunk_size)
+        print(f"interCity data inserted successfully ({count} rows).")
+
+        count = insert_chunked(conn, 'INSERT INTO Staff (id, firstName, surname, salary) VALUES (?, ?, ?, ?)', (
+            (staff_id(n), rng.choice(first_names), rng.choice(surnames), rng.randrange(40000, 120000, 1000))
+            for n in range(1, num_staff + 1)
+        ), chunk_size)
+        print(f"Staff data inserted successfully ({count} rows).")
+
+        count = insert_chunked(conn, 'INSERT INTO Contact (id, staffID, homeAddress, workAddress, homePhoneNum, workPhoneNum) VALUES (?, ?, ?, ?, ?, ?)', (
+            (n, staff_id(n), *contact(rng)) for n in range(1, num_staff + 1)
+        ), chunk_size)
+        print(f"Contact data inserted successfully ({count} rows).")
+
+        count = insert_chunked(conn, 'INSERT INTO Pilot (id, typeRating) VALUES (?, ?)', (
+            (staff_id(n), pilot_rating(rng, n)) for n in range(1, num_staff + 1) if is_pilot(n)
+        ), chunk_size)
+        print(f"Pilot data inserted successfully ({count} rows).")
+
+        count = insert_chunked(conn, 'INSERT INTO Flight (flightNum, numSer, origin, destination, arrTime, departureTime) VALUES (?, ?, ?, ?, ?, ?)',
+                               itertools.islice(generate_flights(rng, airplanes, start), num_flights), chunk_size)
+        print(f"Flight data inserted successfully ({count} rows).")
+
+        flights = conn.execute('SELECT flightNum, numSer, departureTime FROM Flight ORDER BY flightNum')
+        count = insert_chunked(conn, 'INSERT INTO flightCrew (staffID, flightNum) VALUES (?, ?)', crew_rows(flights), chunk_size)
+        print(f"flightCrew data inserted successfully ({count} rows).")
+
+        count = insert_chunked(conn, 'INSERT INTO flightPath (flightNum, cityID) VALUES (?, ?)', (
+            (flight_num, city_id)
+            for flight_num in range(1, num_flights + 1)
+            for city_id in rng.sample(range(1, len(uk_places) + 1), rng.randint(2, 4))
+        ), chunk_size)
+        print(f"flightPath data inserted successfully ({count} rows).")
+
+        # bcrypt is deliberately slow, so a few hashes of 'password' are shared by every passenger
+        hashed_passwords = [bcrypt.hashpw(b'password', bcrypt.gensalt(bcrypt_rounds)) for _ in range(password_pool)]
+        count = insert_chunked(conn, 'INSERT INTO Passenger (passengerID, firstName, surname, password) VALUES (?, ?, ?, ?)', (
+            (passenger_id(n), rng.choice(first_names), rng.choice(surnames), hashed_passwords[n % password_pool])
+            for n in range(1, num_passengers + 1)
+        ), chunk_size)
+        print(f"Passenger data inserted successfully ({count} rows).")
+
+        count = insert_chunked(conn, 'INSERT INTO PassengerContact (passengerID, homeAddress, workAddress, homePhoneNumber, workPhoneNumber) VALUES (?, ?, ?, ?, ?)', (
+            (passenger_id(n), *contact(rng)) for n in range(1, num_passengers + 1)
+        ), chunk_size)
+        print(f"PassengerContact data inserted successfully ({count} rows).")
+
+        # 20 distinct flights per passenger, 100 bookings per scale unit
+        bookings_per_passenger = min(20, num_flights)
+        count = insert_chunked(conn, 'INSERT INTO Booking (passengerID, flightNum) VALUES (?, ?)', (
+            (passenger_id(n), flight_num)
+            for n in range(1, num_passengers + 1)
+            for flight_num in rng.sample(range(1, num_flights + 1), bookings_per_passenger)
+        ), chunk_size)
+        print(f"Booking data inserted successfully ({count} rows).")
+
+        # Indexes, triggers and derived tables are built once over the loaded data
+        migrate(conn)
+        conn.executemany('UPDATE Airplane SET capacity = ? WHERE modelNum = ?', [(count, model) for model, count in seats.items()])
+        conn.executemany('UPDATE interCity SET latitude = ?, longitude = ? WHERE cityName = ?', [(lat, lon, place) for place, (lat, lon) in coordinates.items()])
         conn.commit()
+        conn.execute('PRAGMA journal_mode = WAL')
+        print("Indexes built successfully.")
     except sqlite3.Error as e:
         print(f"An error occurred: {e}")
     finally:
@@ -269,5 +235,17 @@ def insert_test_data():
             conn.close()
 
 if __name__ == "__main__":
-    init_db()  # Ensure the database and tables are created
-    insert_test_data()  # Insert the test data
+    parser = argparse.ArgumentParser(description='Generate a synthetic flight database')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--scale', type=int, default=1, help='Multiplier on the demo dataset: 100 flights, 5 airplanes, 50 staff and 5 passengers per unit')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible data')
+    parser.add_argument('--start', type=lambda text: datetime.strptime(text, '%Y-%m-%d'), default=None, help='First departure date (default 2024-06-01)')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--password-pool', type=int, default=4, help='Distinct bcrypt hashes shared by all passengers')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    init_db(args.database)  # Ensure the database and tables are created
+    insert_test_data(args.database, args.scale, args.seed, args.start, args.chunk_size, args.password_pool, args.bcrypt_rounds)  # Insert the test data
+    print(f"Generated in {time.perf_counter() - started:.1f}s")
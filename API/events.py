@@ -0,0 +1,153 @@
+import asyncio
+import collections
+import json
+import threading
+
+# In-process publish/subscribe for live updates (departure boards).
+#
+# Writers append events to one shared log with increasing sequence numbers
+# after they commit. A subscriber is nothing but the last sequence number it
+# has seen, so an idle subscriber costs no memory in the broker and publishing
+# does not copy anything per subscriber. Waiting threads share a condition
+# variable; waiting coroutines share one asyncio.Event per event loop and topic,
+# so a publish wakes only the subscribers that are interested in it.
+#
+# The log keeps the most recent events only; a subscriber that falls further
+# behind than that is told to reset and reload. Each worker process has its own
+# broker, so subscribers see the writes made through their own process.
+
+HEARTBEAT_SECONDS = 15
+
+
+class Broker:
+
+    def __init__(self, capacity=1024):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._log = collections.deque(maxlen=capacity)
+        self._seq = 0
+        self._waiting = {}
+
+    @property
+    def latest(self):
+        return self._seq
+
+    def publish(self, topic, event):
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._log.append((seq, topic, event))
+            self._changed.notify_all()
+            waiting = [key for key in self._waiting if key[1] in (topic, None)]
+        for key in waiting:
+            try:
+                key[0].call_soon_threadsafe(self._wake, key)
+            except RuntimeError:
+                # The loop has been closed
+                with self._lock:
+                    self._waiting.pop(key, None)
+        return seq
+
+    def since(self, seq, topic=None):
+        """Events after seq as [(seq, topic, event)], plus the latest sequence number.
+
+        The events are None when some of them are no longer in the log, or when
+        seq comes from another process or an earlier run.
+        """
+        with self._lock:
+            oldest = self._log[0][0] if self._log else self._seq + 1
+            if seq > self._seq or seq + 1 < oldest:
+                return None, self._seq
+            events = [entry for entry in self._after(seq) if topic is None or entry[1] == topic]
+            events.reverse()
+            return events, self._seq
+
+    def _after(self, seq):
+        # Newest first, walking back only as far as seq, so a subscriber that is up to date costs nothing
+        for entry in reversed(self._log):
+            if entry[0] <= seq:
+                break
+            yield entry
+
+    def wait(self, seq, timeout):
+        # Blocks the calling thread until something after seq is published; False on timeout
+        with self._changed:
+            return self._changed.wait_for(lambda: self._seq > seq, timeout)
+
+    async def wait_async(self, seq, timeout, topic=None):
+        # Until something for topic (None for anything) is published after seq; False on timeout
+        key = (asyncio.get_running_loop(), topic)
+        with self._lock:
+            missed = self._log and self._log[0][0] > seq + 1
+            if missed or any(topic is None or entry[1] == topic for entry in self._after(seq)):
+                return True
+            signal = self._waiting.get(key)
+            if signal is None:
+                signal = self._waiting[key] = asyncio.Event()
+        try:
+            await asyncio.wait_for(signal.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _wake(self, key):
+        # Runs on the loop: every coroutine waiting there for the topic wakes up, and the next wait starts a new event
+        with self._lock:
+            signal = self._waiting.pop(key, None)
+        if signal is not None:
+            signal.set()
+
+
+def sse(seq, event):
+    # One server-sent event; the id lets a reconnecting client resume with Last-Event-ID
+    return f"id: {seq}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def reset(seq):
+    return sse(seq, {'type': 'reset'})
+
+
+KEEPALIVE = ': keepalive\n\n'
+
+
+def stream(topic, seq, source=None):
+    # SSE text for one topic from after seq, blocking a thread while idle (threaded WSGI servers)
+    source = source or broker
+    while True:
+        events, latest = source.since(seq, topic)
+        if events is None:
+            yield reset(latest)
+        else:
+            for event_seq, _, event in events:
+                yield sse(event_seq, event)
+        seq = latest
+        if not source.wait(seq, HEARTBEAT_SECONDS):
+            yield KEEPALIVE
+
+
+async def stream_async(topic, seq, source=None, heartbeat=HEARTBEAT_SECONDS):
+    # The same on an event loop, where an idle subscriber is a suspended coroutine
+    source = source or broker
+    while True:
+        events, latest = source.since(seq, topic)
+        if events is None:
+            yield reset(latest)
+        else:
+            for event_seq, _, event in events:
+                yield sse(event_seq, event)
+        seq = latest
+        if not await source.wait_async(seq, heartbeat, topic):
+            yield KEEPALIVE
+
+
+def last_event_id(header, query):
+    # Where a stream starts: the Last-Event-ID of a reconnect, else ?since=, else from now
+    for value in (header, query):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+broker = Broker()
@@ -0,0 +1,123 @@
+from array import array
+from bisect import bisect_left
+
+from crew import Roster
+from indexes import VersionedIndex
+
+# Each airframe's rotation: its flights in departure order, with where each
+# one starts and ends. A new flight must not overlap (or cut short the
+# turnaround of) another flight of the same airframe, should start where the
+# previous flight landed, and should land where the next one departs.
+
+
+class Rotation(Roster):
+    # City columns hold codes handed out by FleetIndex
+
+    __slots__ = ('origins', 'destinations')
+
+    def __init__(self, legs=()):
+        # Rows of (departure, arrival, flightNum, origin code, destination code)
+        legs = sorted(legs)
+        super().__init__([leg[:3] for leg in legs])
+        self.origins = array('l', [leg[3] for leg in legs])
+        self.destinations = array('l', [leg[4] for leg in legs])
+
+    def add(self, departure, arrival, flight_num, origin, destination):
+        i = super().add(departure, arrival, flight_num)
+        self.origins.insert(i, origin)
+        self.destinations.insert(i, destination)
+        return i
+
+    def remove(self, departure, flight_num):
+        i = super().remove(departure, flight_num)
+        if i is not None:
+            self.origins.pop(i)
+            self.destinations.pop(i)
+        return i
+
+    def copy(self):
+        return Rotation(zip(self.times, self.arrivals, self.flights, self.origins, self.destinations))
+
+    def neighbours(self, departure):
+        # Positions of the last flight departing before departure and the first one at or after it
+        i = bisect_left(self.times, departure)
+        return (i - 1 if i > 0 else None), (i if i < len(self.times) else None)
+
+    def between(self, start, end):
+        return range(bisect_left(self.times, start), bisect_left(self.times, end))
+
+
+class FleetIndex(VersionedIndex):
+    tables = ('Flight',)
+
+    def __init__(self):
+        super().__init__()
+        self._rotations = {}
+        self._codes = {}
+        self._cities = []
+
+    def _code(self, city):
+        code = self._codes.get(city)
+        if code is None:
+            code = self._codes[city] = len(self._cities)
+            self._cities.append(city)
+        return code
+
+    def load(self, conn):
+        self._codes = {}
+        self._cities = []
+        rows = conn.execute('''
+            SELECT numSer, departureEpoch, arrivalEpoch, flightNum, origin, destination FROM Flight
+            WHERE departureEpoch IS NOT NULL AND arrivalEpoch >= departureEpoch AND numSer IS NOT NULL
+        ''')
+        legs = {}
+        for num_ser, departure, arrival, flight_num, origin, destination in rows:
+            legs.setdefault(num_ser, []).append((departure, arrival, flight_num, self._code(origin), self._code(destination)))
+        self._rotations = {num_ser: Rotation(airframe_legs) for num_ser, airframe_legs in legs.items()}
+
+    def rotation(self, num_ser):
+        return self._rotations.get(num_ser) or Rotation()
+
+    def rosters(self):
+        return self._rotations
+
+    def draft(self, num_ser):
+        # A private copy to check a batch against while adding its own flights
+        return self.rotation(num_ser).copy()
+
+    def check(self, rotation, window, origin, destination, turnaround):
+        """Problems with adding a flight to a rotation, as {'flightNum', 'problem', 'message'}."""
+        departure, arrival = window
+        problems = [
+            {'flightNum': other, 'problem': 'overlap',
+             'message': f'The airplane is flying flight {other} within {turnaround // 60} minutes of this flight'}
+            for other in sorted(rotation.conflicts(departure, arrival, turnaround))
+        ]
+        before, after = rotation.neighbours(departure)
+        if before is not None and self._cities[rotation.destinations[before]] != origin:
+            problems.append({'flightNum': rotation.flights[before], 'problem': 'position',
+                             'message': f'The airplane lands in {self._cities[rotation.destinations[before]]} on flight {rotation.flights[before]}, not {origin}'})
+        if after is not None and self._cities[rotation.origins[after]] != destination:
+            problems.append({'flightNum': rotation.flights[after], 'problem': 'position',
+                             'message': f'The airplane next departs from {self._cities[rotation.origins[after]]} on flight {rotation.flights[after]}, not {destination}'})
+        return problems
+
+    def add(self, flights, rotation=None):
+        # Rows of (numSer, departure, arrival, flightNum, origin, destination); rotation
+        # is for adding to a draft instead of the index itself
+        for num_ser, departure, arrival, flight_num, origin, destination in flights:
+            target = rotation if rotation is not None else self._rotations.setdefault(num_ser, Rotation())
+            target.add(departure, arrival, flight_num, self._code(origin), self._code(destination))
+
+    def remove(self, flights):
+        for num_ser, departure, arrival, flight_num in flights:
+            rotation = self._rotations.get(num_ser)
+            if rotation is not None:
+                rotation.remove(departure, flight_num)
+                if not rotation:
+                    del self._rotations[num_ser]
+
+    def schedule(self, num_ser, start, end):
+        # Flight numbers departing in [start, end), in order
+        rotation = self.rotation(num_ser)
+        return [rotation.flights[i] for i in rotation.between(start, end)]
@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bcrypt
+
+
+class HashingQueueFull(Exception):
+    pass
+
+
+# Module level so they can be shipped to a process pool
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check_password(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+class HashingService:
+    """Runs bcrypt off the request thread on a bounded worker pool."""
+
+    def __init__(self, workers=4, max_queue=64, rounds=12, use_processes=False, timeout=30.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rounds = rounds
+        self.use_processes = use_processes
+        self.timeout = timeout
+        self._executor = None
+        # Running plus queued jobs may not exceed workers + max_queue
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._latency = 0.0
+        self._max_latency = 0.0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.use_processes:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+            return self._executor
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashingQueueFull('Too many password operations queued, try again shortly')
+        start = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+
+        def done(future):
+            elapsed = time.perf_counter() - start
+            self._slots.release()
+            with self._lock:
+                self._pending -= 1
+                self._completed += 1
+                self._latency += elapsed
+                self._max_latency = max(self._max_latency, elapsed)
+
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(done)
+        return future
+
+    def hash_password(self, password):
+        # Returns a Future: .result() from a request thread, asyncio.wrap_future() from async code
+        return self._submit(_hash_password, password.encode('utf-8'), self.rounds)
+
+    def check_password(self, password, hashed):
+        return self._submit(_check_password, password.encode('utf-8'), hashed)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'rounds': self.rounds,
+                'maxQueue': self.max_queue,
+                'pending': self._pending,
+                'queued': max(0, self._pending - self.workers),
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'avgLatency': self._latency / self._completed if self._completed else 0.0,
+                'maxLatency': self._max_latency,
+            }
+
+
+service = HashingService(
+    workers=int(os.environ.get('HASH_WORKERS', 4)),
+    max_queue=int(os.environ.get('HASH_QUEUE_DEPTH', 64)),
+    rounds=int(os.environ.get('BCRYPT_ROUNDS', 12)),
+    use_processes=os.environ.get('HASH_EXECUTOR', 'thread') == 'process',
+)
@@ -0,0 +1,59 @@
+import threading
+from contextlib import contextmanager
+
+from db import table_versions
+
+# Base for in-memory indexes derived from database tables.
+#
+# An index remembers the tableVersion generations it was built from. Readers
+# rebuild it whenever those have moved on, which covers writes from other
+# workers and raw SQL. Writers in this process can instead patch the index in
+# place: inside their write transaction they note which generations their own
+# changes lead to, and after committing they apply the change only if the index
+# was exactly one step behind. Anything else leaves it to be rebuilt.
+
+
+class VersionedIndex:
+    tables = ()
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._versions = None
+        self.rebuilds = 0
+
+    def load(self, conn):
+        raise NotImplementedError
+
+    @property
+    def versions(self):
+        # The generations the index reflects, for caching things derived from it
+        return self._versions
+
+    def is_current(self, conn):
+        return table_versions(conn, self.tables) == self._versions
+
+    @contextmanager
+    def reading(self, conn):
+        # Versions are read before the rows, so a racing write can only make the index look stale
+        versions = table_versions(conn, self.tables)
+        with self._lock:
+            if versions != self._versions:
+                self.load(conn)
+                self._versions = versions
+                self.rebuilds += 1
+            yield self
+
+    def pending(self, conn, changed_rows):
+        # Call inside the write transaction, after its statements: changed_rows is
+        # how many rows this transaction wrote to each of self.tables
+        after = table_versions(conn, self.tables)
+        before = tuple(version - rows for version, rows in zip(after, changed_rows))
+        return before, after
+
+    def apply(self, change, update):
+        # Call after a successful commit with what pending() returned
+        before, after = change
+        with self._lock:
+            if self._versions == before:
+                update()
+                self._versions = after
@@ -0,0 +1,248 @@
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import g, request
+
+# Per-route request metrics in the Prometheus text format.
+#
+# Every thread records into its own shard, so the request path never takes a
+# lock; a scrape adds the shards up. Shards of threads that have exited are
+# folded into one retired shard at scrape time, so short-lived request threads
+# do not pile up.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+HISTOGRAMS = (
+    ('flight_api_request_duration_seconds', 'Time to serve a request, including any streamed body', LATENCY_BUCKETS),
+    ('flight_api_request_sql_statements', 'SQL statements executed per request', STATEMENT_BUCKETS),
+    ('flight_api_request_sql_duration_seconds', 'Time per request spent executing SQL statements', LATENCY_BUCKETS),
+    ('flight_api_request_bcrypt_duration_seconds', 'Time per request spent waiting on bcrypt, for requests that hash or check a password', LATENCY_BUCKETS),
+)
+
+# What the current request on this thread has done so far
+current = threading.local()
+
+
+def _new_histogram(buckets):
+    # Bucket counts, then the +Inf bucket, then the sum
+    return [0] * (len(buckets) + 1) + [0.0]
+
+
+class Registry:
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def count(self, name, labels, amount=1):
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, labels, buckets, value):
+        shard = self._shard()
+        key = (name, labels)
+        histogram = shard.get(key)
+        if histogram is None:
+            histogram = shard[key] = _new_histogram(buckets)
+        histogram[bisect_left(buckets, value)] += 1
+        histogram[-1] += value
+
+    def collect(self):
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    _merge(self._retired, shard.items())
+            self._shards = live
+            totals = {}
+            _merge(totals, self._retired.items())
+            for _, shard in live:
+                # list() copies the items in one step, so the owning thread can keep writing
+                _merge(totals, list(shard.items()))
+        return totals
+
+    def render(self):
+        totals = self.collect()
+        lines = [
+            '# HELP flight_api_requests_total Requests served, by route and status code',
+            '# TYPE flight_api_requests_total counter',
+        ]
+        for (name, labels), value in sorted(totals.items()):
+            if name == 'flight_api_requests_total':
+                lines.append(f'{name}{{{_labels(labels)}}} {value}')
+
+        for histogram_name, help_text, buckets in HISTOGRAMS:
+            lines.append(f'# HELP {histogram_name} {help_text}')
+            lines.append(f'# TYPE {histogram_name} histogram')
+            for (name, labels), values in sorted(totals.items()):
+                if name != histogram_name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(buckets + ('+Inf',), values):
+                    cumulative += bucket
+                    lines.append(f'{name}_bucket{{{_labels(labels + (("le", bound),))}}} {cumulative}')
+                lines.append(f'{name}_sum{{{_labels(labels)}}} {values[-1]}')
+                lines.append(f'{name}_count{{{_labels(labels)}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _merge(target, items):
+    for key, value in items:
+        if isinstance(value, list):
+            existing = target.get(key)
+            if existing is None:
+                target[key] = list(value)
+            else:
+                for i, part in enumerate(value):
+                    existing[i] += part
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+def _labels(labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+registry = Registry()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # Counts statements and the time spent in execute; rows fetched afterwards are not timed
+
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _record_sql(time.perf_counter() - start)
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _record_sql(time.perf_counter() - start)
+
+    def executescript(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executescript(*args)
+        finally:
+            _record_sql(time.perf_counter() - start)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # Passed as sqlite3.connect(factory=...) so every cursor, including the ones
+    # behind conn.execute(), is an InstrumentedCursor
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+
+def _record_sql(seconds):
+    current.sql_statements = getattr(current, 'sql_statements', 0) + 1
+    current.sql_time = getattr(current, 'sql_time', 0.0) + seconds
+
+
+@contextmanager
+def bcrypt_timer():
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.bcrypt_time = getattr(current, 'bcrypt_time', 0.0) + time.perf_counter() - start
+
+
+def start_request():
+    current.sql_statements = 0
+    current.sql_time = 0.0
+    current.bcrypt_time = 0.0
+    g.metrics_start = time.perf_counter()
+
+
+def record_status(response):
+    g.metrics_status = response.status_code
+    start = g.get('metrics_start')
+    if response.is_streamed and start is not None:
+        # Unless the body runs in stream_with_context, teardown comes as soon as the headers are
+        # out, so a streamed response is observed when the server closes its body instead
+        g.pop('metrics_start')
+        response.response = TimedBody(response.response, request.method, route_of(request), response.status_code, start)
+    return response
+
+
+class TimedBody:
+    """A streamed response body that records the request's metrics once it has been sent."""
+
+    def __init__(self, body, method, route, status, start):
+        self._body = body
+        self._labels = (method, route, status, start)
+        self._observed = False
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            close = getattr(self._body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            if not self._observed:
+                self._observed = True
+                observe(*self._labels)
+
+
+def route_of(req):
+    return req.url_rule.rule if req.url_rule is not None else 'unmatched'
+
+
+def observe(method, route, status, start):
+    elapsed = time.perf_counter() - start
+    labels = (('method', method), ('route', route))
+    registry.count('flight_api_requests_total', labels + (('status', status),))
+    registry.observe('flight_api_request_duration_seconds', labels, LATENCY_BUCKETS, elapsed)
+    registry.observe('flight_api_request_sql_statements', labels, STATEMENT_BUCKETS, current.sql_statements)
+    registry.observe('flight_api_request_sql_duration_seconds', labels, LATENCY_BUCKETS, current.sql_time)
+    if current.bcrypt_time:
+        registry.observe('flight_api_request_bcrypt_duration_seconds', labels, LATENCY_BUCKETS, current.bcrypt_time)
+
+
+def finish_request(exception=None):
+    # Streamed responses handed their start to their body, which observes them
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return
+    observe(request.method, route_of(request), g.pop('metrics_status', 500), start)
+
+
+def init_app(app):
+    app.before_request(start_request)
+    app.after_request(record_status)
+    app.teardown_request(finish_request)
@@ -0,0 +1,503 @@
+import sqlite3
+
+# Schema changes are applied in order and tracked in PRAGMA user_version:
+# a database at version N has had the first N entries of MIGRATIONS applied.
+
+
+def create_tables(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Airplane (
+            numSer INTEGER PRIMARY KEY,
+            manufacturer VARCHAR(100),
+            modelNum VARCHAR(100),
+            typeRating VARCHAR(100)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS interCity (
+            cityID INTEGER PRIMARY KEY,
+            cityName VARCHAR(100),
+            cityCountry VARCHAR(100)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Staff (
+            id VARCHAR(100) PRIMARY KEY,
+            firstName VARCHAR(100),
+            surname VARCHAR(100),
+            salary FLOAT
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Contact (
+            id INTEGER PRIMARY KEY,
+            staffID VARCHAR(100),
+            homeAddress VARCHAR(100),
+            workAddress VARCHAR(100),
+            homePhoneNum VARCHAR(100),
+            workPhoneNum VARCHAR(100),
+            FOREIGN KEY(staffID) REFERENCES Staff(id)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Pilot (
+            id VARCHAR(100) PRIMARY KEY,
+            typeRating VARCHAR(100),
+            FOREIGN KEY(id) REFERENCES Staff(id)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Flight (
+            flightNum INTEGER PRIMARY KEY,
+            numSer INTEGER,
+            origin VARCHAR(100),
+            destination VARCHAR(100),
+            arrTime DATETIME,
+            departureTime DATETIME,
+            FOREIGN KEY (numSer) REFERENCES Airplane(numSer)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS flightCrew (
+            staffID VARCHAR(100),
+            flightNum INTEGER,
+            PRIMARY KEY (staffID, flightNum),
+            FOREIGN KEY (staffID) REFERENCES Staff(id),
+            FOREIGN KEY (flightNum) REFERENCES Flight(flightNum)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS flightPath (
+            flightNum INTEGER,
+            cityID INTEGER,
+            PRIMARY KEY (flightNum, cityID),
+            FOREIGN KEY (flightNum) REFERENCES Flight(flightNum),
+            FOREIGN KEY (cityID) REFERENCES interCity(cityID)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Passenger (
+            passengerID VARCHAR(100) PRIMARY KEY,
+            firstName VARCHAR(100),
+            surname VARCHAR(100),
+            password BLOB
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS PassengerContact (
+            passengerID VARCHAR(100) PRIMARY KEY,
+            homeAddress VARCHAR(100),
+            workAddress VARCHAR(100),
+            homePhoneNumber VARCHAR(100),
+            workPhoneNumber VARCHAR(100),
+            FOREIGN KEY (passengerID) REFERENCES Passenger(passengerID)
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS Booking (
+            passengerID VARCHAR(100),
+            flightNum Integer,
+            PRIMARY KEY (passengerID, flightNum),
+            FOREIGN KEY (passengerID) REFERENCES Passenger(passengerID),
+            FOREIGN KEY (flightNum) REFERENCES Flight(flightNum)
+        )
+    ''')
+
+
+def add_lookup_indexes(cur):
+    # Lookups by staffID on flightCrew and passengerID on Booking are already
+    # served by the leading column of their primary keys
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_flight_route ON Flight (origin, destination)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_flight_departure ON Flight (departureTime)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_booking_flight ON Booking (flightNum)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_flightcrew_flight ON flightCrew (flightNum)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_flightpath_city ON flightPath (cityID)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_contact_staff ON Contact (staffID)')
+
+
+def add_flight_number_index(cur):
+    # Every suffix of a flight number's decimal text, so a substring search turns
+    # into a range scan over the suffixes that start with the search term.
+    # digitPosition lists the character offsets the triggers expand a number into.
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS flightNumSuffix (
+            suffix TEXT,
+            flightNum INTEGER,
+            PRIMARY KEY (suffix, flightNum)
+        ) WITHOUT ROWID
+    ''')
+    cur.execute('CREATE TABLE IF NOT EXISTS digitPosition (pos INTEGER PRIMARY KEY)')
+    cur.executemany('INSERT OR IGNORE INTO digitPosition (pos) VALUES (?)', [(pos,) for pos in range(1, 21)])
+
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS flight_num_suffix_insert AFTER INSERT ON Flight
+        BEGIN
+            INSERT OR IGNORE INTO flightNumSuffix (suffix, flightNum)
+            SELECT substr(CAST(NEW.flightNum AS TEXT), pos), NEW.flightNum
+            FROM digitPosition WHERE pos <= length(CAST(NEW.flightNum AS TEXT));
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS flight_num_suffix_delete AFTER DELETE ON Flight
+        BEGIN
+            DELETE FROM flightNumSuffix
+            WHERE flightNum = OLD.flightNum AND suffix IN (
+                SELECT substr(CAST(OLD.flightNum AS TEXT), pos)
+                FROM digitPosition WHERE pos <= length(CAST(OLD.flightNum AS TEXT))
+            );
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS flight_num_suffix_update AFTER UPDATE OF flightNum ON Flight
+        BEGIN
+            DELETE FROM flightNumSuffix
+            WHERE flightNum = OLD.flightNum AND suffix IN (
+                SELECT substr(CAST(OLD.flightNum AS TEXT), pos)
+                FROM digitPosition WHERE pos <= length(CAST(OLD.flightNum AS TEXT))
+            );
+            INSERT OR IGNORE INTO flightNumSuffix (suffix, flightNum)
+            SELECT substr(CAST(NEW.flightNum AS TEXT), pos), NEW.flightNum
+            FROM digitPosition WHERE pos <= length(CAST(NEW.flightNum AS TEXT));
+        END
+    ''')
+
+    # Backfill flights that already exist
+    cur.execute('''
+        INSERT OR IGNORE INTO flightNumSuffix (suffix, flightNum)
+        SELECT substr(CAST(f.flightNum AS TEXT), d.pos), f.flightNum
+        FROM Flight f JOIN digitPosition d ON d.pos <= length(CAST(f.flightNum AS TEXT))
+    ''')
+
+
+def add_staff_id_counter(cur):
+    # Highest suffix handed out per generated staff ID base (0 means the bare base)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS staffIdCounter (
+            baseID VARCHAR(100) PRIMARY KEY,
+            lastSuffix INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+def track_table_versions(cur, tables):
+    # A generation counter per table, bumped by triggers on every row written so
+    # caches can tell whether a table changed since they last read it, whoever wrote it
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS tableVersion (
+            tableName VARCHAR(100) PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    for table in tables:
+        cur.execute('INSERT OR IGNORE INTO tableVersion (tableName, version) VALUES (?, 0)', (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cur.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE tableVersion SET version = version + 1 WHERE tableName = '{table}';
+                END
+            ''')
+
+
+def add_table_versions(cur):
+    track_table_versions(cur, ['Flight', 'Booking', 'flightCrew'])
+
+
+def add_change_stamps(cur):
+    # Version stamp per passenger (their bookings) and per staff member (their crew
+    # assignments), so conditional GETs can be answered with a single key lookup
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS changeStamp (
+            scope VARCHAR(20),
+            key VARCHAR(100),
+            version INTEGER NOT NULL,
+            PRIMARY KEY (scope, key)
+        ) WITHOUT ROWID
+    ''')
+    for scope, table, column in (('passenger', 'Booking', 'passengerID'), ('staff', 'flightCrew', 'staffID')):
+        for event, row in (('INSERT', 'NEW'), ('DELETE', 'OLD'), ('UPDATE', 'NEW'), ('UPDATE', 'OLD')):
+            cur.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_stamp_{event.lower()}_{row.lower()} AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO changeStamp (scope, key, version) VALUES ('{scope}', {row}.{column}, 1)
+                    ON CONFLICT (scope, key) DO UPDATE SET version = version + 1;
+                END
+            ''')
+        # Changing a flight's details changes every schedule it appears on
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS Flight_{scope}_stamp_update
+            AFTER UPDATE OF flightNum, origin, destination, arrTime, departureTime ON Flight
+            BEGIN
+                INSERT INTO changeStamp (scope, key, version)
+                SELECT '{scope}', {column}, 1 FROM {table} WHERE flightNum = NEW.flightNum
+                ON CONFLICT (scope, key) DO UPDATE SET version = version + 1;
+            END
+        ''')
+        cur.execute(f'''
+            INSERT OR IGNORE INTO changeStamp (scope, key, version)
+            SELECT DISTINCT '{scope}', {column}, 1 FROM {table}
+        ''')
+
+
+def add_seat_capacity(cur):
+    # Seats per airframe (NULL means no limit) and a booked counter per flight kept
+    # by triggers, so availability is a key lookup. The check runs in the same
+    # statement as the insert, under the write lock, so a flight cannot be
+    # oversold however many bookings race for the last seat, or whoever inserts them
+    cur.execute('ALTER TABLE Airplane ADD COLUMN capacity INTEGER')
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS flightSeats (
+            flightNum INTEGER PRIMARY KEY,
+            booked INTEGER NOT NULL
+        )
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS Flight_seats_insert AFTER INSERT ON Flight
+        BEGIN
+            INSERT OR REPLACE INTO flightSeats (flightNum, booked)
+            VALUES (NEW.flightNum, (SELECT COUNT(*) FROM Booking WHERE flightNum = NEW.flightNum));
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS Flight_seats_delete AFTER DELETE ON Flight
+        BEGIN
+            DELETE FROM flightSeats WHERE flightNum = OLD.flightNum;
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS Flight_seats_update AFTER UPDATE OF flightNum ON Flight
+        BEGIN
+            DELETE FROM flightSeats WHERE flightNum = OLD.flightNum;
+            INSERT OR REPLACE INTO flightSeats (flightNum, booked)
+            VALUES (NEW.flightNum, (SELECT COUNT(*) FROM Booking WHERE flightNum = NEW.flightNum));
+        END
+    ''')
+
+    full = '''(
+        SELECT s.booked >= a.capacity
+        FROM flightSeats s JOIN Flight f ON f.flightNum = s.flightNum JOIN Airplane a ON a.numSer = f.numSer
+        WHERE s.flightNum = NEW.flightNum
+    )'''
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS Booking_seats_check BEFORE INSERT ON Booking
+        WHEN {full}
+        BEGIN
+            SELECT RAISE(ABORT, 'Flight is full');
+        END
+    ''')
+    cur.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS Booking_seats_check_update BEFORE UPDATE OF flightNum ON Booking
+        WHEN NEW.flightNum <> OLD.flightNum AND {full}
+        BEGIN
+            SELECT RAISE(ABORT, 'Flight is full');
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS Booking_seats_insert AFTER INSERT ON Booking
+        BEGIN
+            UPDATE flightSeats SET booked = booked + 1 WHERE flightNum = NEW.flightNum;
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS Booking_seats_delete AFTER DELETE ON Booking
+        BEGIN
+            UPDATE flightSeats SET booked = booked - 1 WHERE flightNum = OLD.flightNum;
+        END
+    ''')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS Booking_seats_update AFTER UPDATE OF flightNum ON Booking
+        BEGIN
+            UPDATE flightSeats SET booked = booked - 1 WHERE flightNum = OLD.flightNum;
+            UPDATE flightSeats SET booked = booked + 1 WHERE flightNum = NEW.flightNum;
+        END
+    ''')
+
+    cur.execute('''
+        INSERT OR REPLACE INTO flightSeats (flightNum, booked)
+        SELECT f.flightNum, COUNT(b.flightNum) FROM Flight f LEFT JOIN Booking b ON b.flightNum = f.flightNum
+        GROUP BY f.flightNum
+    ''')
+    # Flight listings show availability, so their caches have to see capacity changes
+    track_table_versions(cur, ['Airplane'])
+
+
+def epoch(column):
+    # Seconds since the epoch for a date-time string, NULL for anything without a date
+    # ('12:00:00'). Naive values are taken as UTC and offsets are applied, like routing.parse_time
+    return f"CASE WHEN {column} GLOB '[0-9][0-9][0-9][0-9]-*' THEN CAST(strftime('%s', {column}) AS INTEGER) END"
+
+
+def add_epoch_times(cur):
+    # departureTime and arrTime hold whatever text was written, with or without a
+    # date. Integer copies kept in step by triggers give time windows an index to
+    # range scan. Rows already loaded are converted by backfill_epoch_times
+    cur.execute('ALTER TABLE Flight ADD COLUMN departureEpoch INTEGER')
+    cur.execute('ALTER TABLE Flight ADD COLUMN arrivalEpoch INTEGER')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_flight_departure_epoch ON Flight (departureEpoch)')
+    # Route lookups keep their prefix and can narrow to a window within the same index
+    cur.execute('DROP INDEX IF EXISTS idx_flight_route')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_flight_route_departure ON Flight (origin, destination, departureEpoch)')
+
+    # Writing the epochs is itself an update of Flight, which must not count as a
+    # change of its rows: the version trigger only watches the other columns
+    cur.execute('DROP TRIGGER IF EXISTS Flight_version_update')
+    cur.execute('''
+        CREATE TRIGGER Flight_version_update
+        AFTER UPDATE OF flightNum, numSer, origin, destination, arrTime, departureTime ON Flight
+        BEGIN
+            UPDATE tableVersion SET version = version + 1 WHERE tableName = 'Flight';
+        END
+    ''')
+    for name, event in (('insert', 'INSERT'), ('update', 'UPDATE OF arrTime, departureTime')):
+        cur.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS Flight_epoch_{name} AFTER {event} ON Flight
+            BEGIN
+                UPDATE Flight SET departureEpoch = {epoch('NEW.departureTime')}, arrivalEpoch = {epoch('NEW.arrTime')}
+                WHERE flightNum = NEW.flightNum;
+            END
+        ''')
+
+
+def backfill_epoch_times(conn, chunk_size=10000):
+    # Converts flights written before the epoch columns existed, a chunk of rows per
+    # transaction so writers are never locked out for long. Rows without a date, or
+    # with one that does not parse, stay NULL; the epoch index keeps those together,
+    # so a rerun only skips over them
+    last = -2 ** 63
+    converted = 0
+    while True:
+        cur = conn.cursor()
+        cur.execute('BEGIN IMMEDIATE')
+        rows = cur.execute(f'''
+            SELECT flightNum FROM Flight
+            WHERE departureEpoch IS NULL AND {epoch('departureTime')} IS NOT NULL AND flightNum > ?
+            ORDER BY flightNum LIMIT ?
+        ''', (last, chunk_size)).fetchall()
+        if rows:
+            last = rows[-1][0]
+            cur.execute(f'''
+                UPDATE Flight SET departureEpoch = {epoch('departureTime')}, arrivalEpoch = {epoch('arrTime')}
+                WHERE flightNum BETWEEN ? AND ? AND departureEpoch IS NULL
+            ''', (rows[0][0], last))
+            converted += cur.rowcount
+        conn.commit()
+        if len(rows) < chunk_size:
+            break
+    unparseable = conn.execute(
+        "SELECT COUNT(*) FROM Flight WHERE departureEpoch IS NULL AND departureTime GLOB '[0-9][0-9][0-9][0-9]-*'"
+    ).fetchone()[0]
+    if unparseable:
+        print(f"Left {unparseable} flight(s) without an epoch: their departure time is not a valid date")
+    return converted
+
+
+def add_pilot_versions(cur):
+    # For the in-memory pilot qualification index
+    track_table_versions(cur, ['Pilot'])
+
+
+def add_waypoints(cur):
+    # City coordinates, and an order for the cities on a flight's path. A path
+    # entry written without a position is appended after the flight's last one
+    cur.execute('ALTER TABLE interCity ADD COLUMN latitude REAL')
+    cur.execute('ALTER TABLE interCity ADD COLUMN longitude REAL')
+    cur.execute('ALTER TABLE flightPath ADD COLUMN seq INTEGER')
+    # Existing entries keep the order they were written in
+    cur.execute('''
+        UPDATE flightPath SET seq = ordered.n
+        FROM (SELECT rowid AS id, ROW_NUMBER() OVER (PARTITION BY flightNum ORDER BY rowid) - 1 AS n FROM flightPath) AS ordered
+        WHERE flightPath.rowid = ordered.id
+    ''')
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_flightpath_order ON flightPath (flightNum, seq)')
+    cur.execute('''
+        CREATE TRIGGER IF NOT EXISTS flightPath_append AFTER INSERT ON flightPath
+        WHEN NEW.seq IS NULL
+        BEGIN
+            UPDATE flightPath SET seq = (SELECT COALESCE(MAX(seq) + 1, 0) FROM flightPath WHERE flightNum = NEW.flightNum)
+            WHERE rowid = NEW.rowid;
+        END
+    ''')
+    # Distances are worked out from in-memory coordinates, which have to notice new cities
+    track_table_versions(cur, ['interCity'])
+
+
+def add_session_revocations(cur):
+    # Logged-out session tokens, shared by every worker process. A row is only needed until
+    # the token would have expired anyway
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS revokedSession (
+            jti TEXT PRIMARY KEY,
+            expires INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_revoked_session_expires ON revokedSession (expires)')
+
+
+def add_session_secret(cur):
+    # The key session tokens are signed with when SECRET_KEY is not set, generated once so
+    # every worker and every restart uses the same one
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS sessionSecret (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            secret TEXT NOT NULL
+        )
+    ''')
+
+
+MIGRATIONS = [
+    create_tables,
+    add_lookup_indexes,
+    add_flight_number_index,
+    add_staff_id_counter,
+    add_table_versions,
+    add_change_stamps,
+    add_seat_capacity,
+    add_epoch_times,
+    add_pilot_versions,
+    add_waypoints,
+    add_session_revocations,
+    add_session_secret,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=LATEST_VERSION):
+    # Each migration runs in its own transaction together with the version bump. The version is
+    # read again under the write lock before every step, so workers starting at the same time
+    # apply each step once between them and the others just see it done
+    applied = []
+    while True:
+        cur = conn.cursor()
+        try:
+            cur.execute('BEGIN IMMEDIATE')
+            version = schema_version(conn)
+            if version > LATEST_VERSION:
+                raise sqlite3.DatabaseError(f'Database schema version {version} is newer than this code ({LATEST_VERSION})')
+            if version >= target:
+                conn.rollback()
+                break
+            MIGRATIONS[version](cur)
+            cur.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+            applied.append(MIGRATIONS[version])
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+    # Flights written before the epoch columns existed, converted when that step has just been
+    # applied or when an earlier backfill was interrupted
+    if add_epoch_times in applied or (schema_version(conn) > MIGRATIONS.index(add_epoch_times) and epochs_missing(conn)):
+        backfill_epoch_times(conn)
+    return schema_version(conn)
+
+
+def epochs_missing(conn):
+    # Only rows that would convert: one whose date does not parse would otherwise send every start into a backfill
+    return conn.execute(
+        f"SELECT 1 FROM Flight WHERE departureEpoch IS NULL AND {epoch('departureTime')} IS NOT NULL LIMIT 1"
+    ).fetchone() is not None
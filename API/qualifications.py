@@ -0,0 +1,81 @@
+from bisect import bisect_right, insort
+
+from indexes import VersionedIndex
+
+# Which pilots may fly which airframes. Type ratings run from A (the widest)
+# downwards: a pilot may fly an airplane rated at their own level or any level
+# below it, so a B pilot flies B to F airframes but not A.
+
+
+def rating_key(rating):
+    # Ratings compare case- and whitespace-insensitively; None for a missing rating
+    return rating.strip().upper() if isinstance(rating, str) and rating.strip() else None
+
+
+def qualified(pilot_rating, plane_rating):
+    pilot, plane = rating_key(pilot_rating), rating_key(plane_rating)
+    return pilot is not None and plane is not None and pilot <= plane
+
+
+class QualificationIndex(VersionedIndex):
+    """Pilots grouped by type rating, each group sorted by staff ID.
+
+    The pilots eligible for an airframe are the groups at or above its
+    rating, found with one bisect over the handful of distinct ratings.
+    """
+
+    tables = ('Pilot',)
+
+    def __init__(self):
+        super().__init__()
+        self._ratings = []
+        self._pilots = {}
+        self._rating_of = {}
+
+    def load(self, conn):
+        self._ratings = []
+        self._pilots = {}
+        self._rating_of = {}
+        self.add(conn.execute('SELECT id, typeRating FROM Pilot'))
+
+    def add(self, pilots):
+        # Rows of (staffID, typeRating); a pilot seen again moves to the new rating
+        for staff_id, rating in pilots:
+            rating = rating_key(rating)
+            previous = self._rating_of.pop(staff_id, None)
+            if previous is not None:
+                self._pilots[previous].remove(staff_id)
+            if rating is None:
+                continue
+            if rating not in self._pilots:
+                insort(self._ratings, rating)
+                self._pilots[rating] = []
+            insort(self._pilots[rating], staff_id)
+            self._rating_of[staff_id] = rating
+
+    def rating(self, staff_id):
+        return self._rating_of.get(staff_id)
+
+    def ratings(self):
+        # Every rating held by some pilot, A first
+        return list(self._ratings)
+
+    def rated(self, rating):
+        # Staff IDs of the pilots holding exactly this rating
+        return list(self._pilots.get(rating_key(rating), ()))
+
+    def eligible(self, plane_rating):
+        # (staffID, rating) of every pilot who may fly the airframe, the closest rating first
+        # so schedulers use up the least over-qualified pilots before the others
+        plane = rating_key(plane_rating)
+        if plane is None:
+            return
+        for rating in reversed(self._ratings[:bisect_right(self._ratings, plane)]):
+            for staff_id in self._pilots[rating]:
+                yield staff_id, rating
+
+    def count(self, plane_rating):
+        plane = rating_key(plane_rating)
+        if plane is None:
+            return 0
+        return sum(len(self._pilots[rating]) for rating in self._ratings[:bisect_right(self._ratings, plane)])
@@ -0,0 +1,75 @@
+import heapq
+from bisect import bisect_right
+
+from qualifications import rating_key
+
+# Automatic crew assignment. Flights are taken in departure order and each open
+# seat goes to a free member of the right pool, preferring whoever became free
+# most recently (best fit), which leaves the others free for later flights and
+# keeps the number of staff used low. A pool holds the members free now and a
+# heap of those busy until a known time, so filling a seat rarely looks at more
+# than a couple of people however large the pool.
+#
+# Flights already on someone's roster are checked through a callback: a member
+# whose existing duties clash is put back in the heap until that duty is over.
+# Pilots come from the pools of the ratings allowed on the airframe, the
+# closest rating first so the widest-rated pilots are kept for the airframes
+# only they can fly.
+
+
+class Pool:
+
+    def __init__(self, staff_ids):
+        # Popped from the end, so the lowest staff IDs are used first
+        self.free = sorted(staff_ids, reverse=True)
+        self.busy = []
+
+    def take(self, departure, arrival, busy_until, min_rest):
+        """A member with nothing clashing with the flight, now busy until after it; None when there is nobody."""
+        while self.busy and self.busy[0][0] <= departure:
+            self.free.append(heapq.heappop(self.busy)[1])
+        while self.free:
+            staff_id = self.free.pop()
+            until = busy_until(staff_id, departure, arrival)
+            if until is None:
+                heapq.heappush(self.busy, (arrival + min_rest, staff_id))
+                return staff_id
+            heapq.heappush(self.busy, (until + min_rest, staff_id))
+        return None
+
+
+def solve(flights, pilots, cabin_crew, busy_until, min_rest):
+    """Assign staff to flights.
+
+    flights are (departure, arrival, flightNum, airframe rating, pilots needed,
+    cabin crew needed); pilots maps each rating to a Pool and cabin_crew is a
+    Pool. busy_until(staffID, departure, arrival) gives the latest landing of
+    existing duties clashing with a flight, or None. Returns the assignments as
+    (flightNum, staffID, role) and the seats left open as {flightNum: (pilots,
+    cabin crew)}.
+    """
+    ratings = sorted(pilots)
+    assignments = []
+    unfilled = {}
+    for departure, arrival, flight_num, plane_rating, pilots_needed, crew_needed in sorted(flights):
+        plane = rating_key(plane_rating)
+        allowed = reversed(ratings[:bisect_right(ratings, plane)]) if plane is not None else ()
+        pools = [pilots[rating] for rating in allowed]
+        missing_pilots = pilots_needed
+        for pool in pools:
+            while missing_pilots:
+                staff_id = pool.take(departure, arrival, busy_until, min_rest)
+                if staff_id is None:
+                    break
+                assignments.append((flight_num, staff_id, 'pilot'))
+                missing_pilots -= 1
+        missing_crew = crew_needed
+        while missing_crew:
+            staff_id = cabin_crew.take(departure, arrival, busy_until, min_rest)
+            if staff_id is None:
+                break
+            assignments.append((flight_num, staff_id, 'cabinCrew'))
+            missing_crew -= 1
+        if missing_pilots or missing_crew:
+            unfilled[flight_num] = (missing_pilots, missing_crew)
+    return assignments, unfilled
@@ -0,0 +1,181 @@
+import heapq
+import itertools
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from indexes import VersionedIndex
+
+# Connecting-flight search over an in-memory timetable: for every origin, the
+# flights to each destination in departure order.
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def parse_time(value):
+    # Seconds since the epoch, or None for values without a date (which cannot be connected)
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is not None:
+        return int(moment.timestamp())
+    return int((moment - EPOCH).total_seconds())
+
+
+class Departures:
+    """Flights between one pair of cities, ordered by departure.
+
+    earliest[i] is the earliest arrival of any flight from position i onwards,
+    so a scan can stop as soon as nothing later could arrive sooner.
+    """
+
+    __slots__ = ('times', 'arrivals', 'flights', 'earliest')
+
+    def __init__(self, legs=()):
+        legs = sorted(legs)
+        self.times = array('q', [leg[0] for leg in legs])
+        self.arrivals = array('q', [leg[1] for leg in legs])
+        self.flights = array('q', [leg[2] for leg in legs])
+        self.earliest = array('q', self.arrivals)
+        for i in range(len(legs) - 2, -1, -1):
+            self.earliest[i] = min(self.earliest[i], self.earliest[i + 1])
+
+    def add(self, departure, arrival, flight_num):
+        i = bisect_right(self.times, departure)
+        self.times.insert(i, departure)
+        self.arrivals.insert(i, arrival)
+        self.flights.insert(i, flight_num)
+        self.earliest.insert(i, min(arrival, self.earliest[i]) if i < len(self.earliest) else arrival)
+        while i > 0 and self.earliest[i - 1] > arrival:
+            i -= 1
+            self.earliest[i] = arrival
+
+    def remove(self, departure, flight_num):
+        i = bisect_left(self.times, departure)
+        while i < len(self.times) and self.times[i] == departure:
+            if self.flights[i] == flight_num:
+                break
+            i += 1
+        else:
+            return False
+        for column in (self.times, self.arrivals, self.flights, self.earliest):
+            column.pop(i)
+        while i > 0:
+            i -= 1
+            earliest = min(self.arrivals[i], self.earliest[i + 1]) if i + 1 < len(self.earliest) else self.arrivals[i]
+            if earliest == self.earliest[i]:
+                break
+            self.earliest[i] = earliest
+        return True
+
+    def best(self, ready, k, bound=None):
+        # The k earliest-arriving flights that depart at or after ready and land
+        # before bound, as (departure, arrival, flightNum)
+        found = []
+        for i in range(bisect_left(self.times, ready), len(self.times)):
+            cutoff = -found[0][0] if len(found) == k else bound
+            if cutoff is not None and self.earliest[i] >= cutoff:
+                break
+            if len(found) < k:
+                heapq.heappush(found, (-self.arrivals[i], i))
+            else:
+                heapq.heapreplace(found, (-self.arrivals[i], i))
+        return [(self.times[i], self.arrivals[i], self.flights[i]) for _, i in found if bound is None or self.arrivals[i] < bound]
+
+
+class RouteIndex(VersionedIndex):
+    tables = ('Flight',)
+
+    def __init__(self):
+        super().__init__()
+        self._edges = {}
+
+    def load(self, conn):
+        # The epoch columns were parsed on write, the same way parse_time does
+        rows = conn.execute('''
+            SELECT origin, destination, departureEpoch, arrivalEpoch, flightNum FROM Flight
+            WHERE departureEpoch IS NOT NULL AND arrivalEpoch >= departureEpoch AND origin <> destination
+        ''')
+        legs = {}
+        for origin, destination, departure, arrival, flight_num in rows:
+            legs.setdefault((origin, destination), []).append((departure, arrival, flight_num))
+        edges = {}
+        for (origin, destination), flights in legs.items():
+            edges.setdefault(origin, {})[destination] = Departures(flights)
+        self._edges = edges
+
+    def _leg(self, origin, destination, arr_time, departure_time, flight_num):
+        departure = parse_time(departure_time)
+        arrival = parse_time(arr_time)
+        if departure is None or arrival is None or arrival < departure or origin == destination:
+            return None
+        return departure, arrival, flight_num
+
+    def add_flights(self, flights):
+        # Rows of (flightNum, origin, destination, arrTime, departureTime)
+        for flight_num, origin, destination, arr_time, departure_time in flights:
+            leg = self._leg(origin, destination, arr_time, departure_time, flight_num)
+            if leg:
+                self._edges.setdefault(origin, {}).setdefault(destination, Departures()).add(*leg)
+
+    def remove_flights(self, flights):
+        for flight_num, origin, destination, arr_time, departure_time in flights:
+            departures = self._edges.get(origin, {}).get(destination)
+            departure = parse_time(departure_time)
+            if departures is not None and departure is not None:
+                departures.remove(departure, flight_num)
+
+    def departures(self, origin, after, limit):
+        # The next flights out of origin to anywhere, as (departure, flightNum): one
+        # bisect per destination, then a merge of the already ordered runs
+        runs = [self._run(departures, bisect_left(departures.times, after)) for departures in self._edges.get(origin, {}).values()]
+        return list(itertools.islice(heapq.merge(*runs), limit))
+
+    @staticmethod
+    def _run(departures, start):
+        for i in range(start, len(departures.times)):
+            yield departures.times[i], departures.flights[i]
+
+    def search(self, origin, destination, depart_after, min_connection, max_legs, k):
+        """The k earliest-arriving itineraries as (departure, arrival, flight numbers).
+
+        Labels leave the heap in arrival order, so itineraries reach the
+        destination earliest first. Each city is expanded at most k times per
+        number of legs taken, and never revisited within an itinerary. Once k
+        candidate arrivals at the destination are known, nothing landing later
+        anywhere is worth following.
+        """
+        sequence = itertools.count()
+        heap = [(depart_after, 0, next(sequence), origin, None, (), (origin,))]
+        expanded = {}
+        arrivals = []  # Max-heap of the k earliest candidate arrivals at the destination
+        results = []
+        while heap and len(results) < k:
+            arrival, legs, _, city, departure, path, visited = heapq.heappop(heap)
+            if city == destination:
+                results.append((departure, arrival, path))
+                continue
+            if legs == max_legs or expanded.get((city, legs), 0) >= k:
+                continue
+            expanded[(city, legs)] = expanded.get((city, legs), 0) + 1
+
+            ready = arrival + min_connection if path else arrival
+            for next_city, departures in self._edges.get(city, {}).items():
+                if next_city in visited or (legs == max_legs - 1 and next_city != destination):
+                    continue
+                if next_city != destination and expanded.get((next_city, legs + 1), 0) >= k:
+                    continue
+                bound = -arrivals[0] if len(arrivals) == k else None
+                for next_departure, next_arrival, flight_num in departures.best(ready, k, bound):
+                    if next_city == destination:
+                        if len(arrivals) < k:
+                            heapq.heappush(arrivals, -next_arrival)
+                        elif next_arrival < -arrivals[0]:
+                            heapq.heapreplace(arrivals, -next_arrival)
+                    heapq.heappush(heap, (
+                        next_arrival, legs + 1, next(sequence), next_city,
+                        departure if path else next_departure, path + (flight_num,), visited + (next_city,)
+                    ))
+        return results
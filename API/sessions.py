@@ -0,0 +1,99 @@
+import secrets
+import time
+from functools import wraps
+
+from flask import g, jsonify, request
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+import db
+
+
+class InvalidSession(Exception):
+    pass
+
+
+class SessionManager:
+    """Signed, expiring session tokens so a login only pays for bcrypt once.
+
+    Logouts are kept in the revokedSession table rather than in memory, so a
+    token logged out through one worker process is refused by all of them.
+    """
+
+    def __init__(self, secret_key, max_age=12 * 60 * 60, connection=db.get_db):
+        self.max_age = max_age
+        self._serializer = URLSafeTimedSerializer(secret_key, salt='passenger-session')
+        # Returns the database connection to use, by default the request's pooled one
+        self._connection = connection
+
+    def issue(self, passenger_id):
+        return self._serializer.dumps({'sub': passenger_id, 'jti': secrets.token_urlsafe(12)})
+
+    def _load(self, token):
+        try:
+            payload, issued = self._serializer.loads(token, max_age=self.max_age, return_timestamp=True)
+        except SignatureExpired:
+            raise InvalidSession('Session expired')
+        except BadSignature:
+            raise InvalidSession('Invalid session token')
+        return payload, issued.timestamp() + self.max_age
+
+    def verify(self, token):
+        payload, _ = self._load(token)
+        # A primary key probe on the pooled connection: a few microseconds, well under the
+        # signature check above, and it stays that way as the table grows
+        revoked = self._connection().execute('SELECT 1 FROM revokedSession WHERE jti = ?', (payload['jti'],)).fetchone()
+        if revoked:
+            raise InvalidSession('Session has been logged out')
+        return payload['sub']
+
+    def revoke(self, token):
+        payload, expires = self._load(token)
+        conn = self._connection()
+        try:
+            sweep_revoked(conn)
+            conn.execute('INSERT OR REPLACE INTO revokedSession (jti, expires) VALUES (?, ?)', (payload['jti'], int(expires) + 1))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return payload['sub']
+
+
+def sweep_revoked(conn):
+    # Revocations are only needed until the token expires by itself. Run on every logout and
+    # at startup; the caller commits
+    conn.execute('DELETE FROM revokedSession WHERE expires < ?', (int(time.time()),))
+
+
+def stored_secret(conn):
+    # The database's signing key, created by whichever process asks first
+    conn.execute('INSERT OR IGNORE INTO sessionSecret (id, secret) VALUES (1, ?)', (secrets.token_hex(32),))
+    conn.commit()
+    return conn.execute('SELECT secret FROM sessionSecret WHERE id = 1').fetchone()[0]
+
+
+def bearer_token():
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):].strip()
+    return None
+
+
+def authenticate(manager, required=False):
+    # Puts the session's passenger in g.passenger_id; without a token the request
+    # passes through unauthenticated unless required is set
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            token = bearer_token()
+            g.passenger_id = None
+            if token:
+                try:
+                    g.passenger_id = manager.verify(token)
+                except InvalidSession as e:
+                    return jsonify({'message': str(e), 'status': 'error'}), 401
+            elif required:
+                return jsonify({'message': 'Authentication required', 'status': 'error'}), 401
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,8 +1,30 @@
 import unittest
+from unittest import mock
 import json
 import bcrypt
 import sqlite3
-from app import app, init_db
+import os
+import tempfile
+import asyncio
+import asgi
+import bench_load
+import cache
+import crew
+import threading
+import db
+import distances
+import events
+import hashing
+import time
+import metrics
+import migrations
+import qualifications
+import random
+import rostering
+import routing
+import sessions
+import utilization
+from app import app, crew_index, init_db, qualification_index, response_cache, route_index, session_manager
 
 class FlaskTestCase(unittest.TestCase):
     
@@ -84,6 +106,7 @@ class FlaskTestCase(unittest.TestCase):
         cur.execute('DELETE FROM flightCrew')
         cur.execute('DELETE FROM flightPath')
         cur.execute('DELETE FROM interCity')
+        cur.execute('DELETE FROM staffIdCounter')
         conn.commit()
         conn.close()
 
@@ -98,6 +121,67 @@ class FlaskTestCase(unittest.TestCase):
         self.assertEqual(data['status'], 'success')
         self.assertEqual(data['username'], 'testuser')
 
+    def auth(self, passenger_id='testuser'):
+        # Headers of a signed-in passenger, without paying for a login
+        return {'Authorization': f'Bearer {session_manager.issue(passenger_id)}'}
+
+    def login_token(self):
+        response = self.app.post('/api/login', data=json.dumps({
+            'username': 'testuser',
+            'password': 'password'
+        }), content_type='application/json')
+        return json.loads(response.data)['token']
+
+    def test_session_token(self):
+        headers = {'Authorization': f'Bearer {self.login_token()}'}
+        response = self.app.get('/api/session', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['username'], 'testuser')
+
+        response = self.app.get('/api/bookings/testuser', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.app.get('/api/bookings/someoneelse', headers=headers)
+        self.assertEqual(response.status_code, 403)
+
+    def test_logout_revokes_token(self):
+        headers = {'Authorization': f'Bearer {self.login_token()}'}
+        response = self.app.post('/api/logout', headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.app.get('/api/session', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(data['message'], 'Session has been logged out')
+
+    def test_logout_seen_by_other_workers(self):
+        token = self.login_token()
+        # Another worker process has its own manager sharing only the secret and the database
+        conn = sqlite3.connect('airplane.db')
+        self.addCleanup(conn.close)
+        other = sessions.SessionManager(app.config['SECRET_KEY'], connection=lambda: conn)
+        self.assertEqual(other.verify(token), 'testuser')
+        response = self.app.post('/api/logout', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        with self.assertRaises(sessions.InvalidSession):
+            other.verify(token)
+
+    def test_expired_revocations_swept_at_startup(self):
+        conn = sqlite3.connect('airplane.db')
+        self.addCleanup(conn.close)
+        conn.executemany('INSERT INTO revokedSession (jti, expires) VALUES (?, ?)', [('old', 1), ('live', int(time.time()) + 3600)])
+        conn.commit()
+        init_db()
+        self.assertEqual(conn.execute("SELECT jti FROM revokedSession WHERE jti IN ('old', 'live')").fetchall(), [('live',)])
+        conn.execute("DELETE FROM revokedSession WHERE jti = 'live'")
+        conn.commit()
+
+    def test_invalid_session_token(self):
+        response = self.app.get('/api/session', headers={'Authorization': 'Bearer not-a-token'})
+        self.assertEqual(response.status_code, 401)
+        response = self.app.get('/api/session')
+        self.assertEqual(response.status_code, 401)
+
     def test_login_failure(self):
         response = self.app.post('/api/login', data=json.dumps({
             'username': 'wronguser',
@@ -183,6 +267,37 @@ class FlaskTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(data['status'], 'success')
 
+    def add_named_staff(self, firstName, surname):
+        response = self.app.post('/api/staff', data=json.dumps({
+            'firstName': firstName,
+            'surname': surname,
+            'salary': 60000.0,
+            'homeAddress': '123 Home St',
+            'workAddress': '456 Work Ave',
+            'homePhoneNum': '555-555-5555',
+            'workPhoneNum': '555-555-5556'
+        }), content_type='application/json')
+        return json.loads(response.data)['id']
+
+    def test_add_staff_id_suffixes(self):
+        self.assertEqual([self.add_named_staff('Jane', 'Doe') for _ in range(3)], ['jdoe', 'jdoe1', 'jdoe2'])
+
+    def test_add_staff_id_skips_existing(self):
+        conn = sqlite3.connect('airplane.db')
+        conn.executemany('INSERT INTO Staff (id, firstName, surname, salary) VALUES (?, ?, ?, ?)', [
+            ('jsmith', 'J', 'Smith', 1.0),
+            ('jsmith3', 'J', 'Smith', 1.0),
+            ('jsmithson', 'J', 'Smithson', 1.0)
+        ])
+        conn.commit()
+        self.assertEqual(self.add_named_staff('Jo', 'Smith'), 'jsmith4')
+
+        # An ID written behind the allocator's back is skipped
+        conn.execute('INSERT INTO Staff (id, firstName, surname, salary) VALUES (?, ?, ?, ?)', ('jsmith5', 'J', 'Smith', 1.0))
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.add_named_staff('Jo', 'Smith'), 'jsmith6')
+
     def test_add_staff_missing_fields(self):
         response = self.app.post('/api/staff', data=json.dumps({
             'firstName': '',
@@ -330,7 +445,7 @@ class FlaskTestCase(unittest.TestCase):
         response = self.app.post('/api/booking', data=json.dumps({
             'passengerID': 'testuser',
             'flightNum': 1
-        }), content_type='application/json')
+        }), content_type='application/json', headers=self.auth())
 
         data = json.loads(response.data)
         self.assertEqual(response.status_code, 400)
@@ -340,22 +455,105 @@ class FlaskTestCase(unittest.TestCase):
         response = self.app.post('/api/booking', data=json.dumps({
             'passengerID': 'invaliduser',
             'flightNum': 1
-        }), content_type='application/json')
+        }), content_type='application/json', headers=self.auth('invaliduser'))
 
         data = json.loads(response.data)
         self.assertEqual(response.status_code, 400)
         self.assertEqual(data['status'], 'error')
         self.assertEqual(data['message'], 'Passenger ID invaliduser does not exist')
 
-    def test_get_bookings(self):
+    def test_add_booking_full_flight(self):
+        conn = sqlite3.connect('airplane.db')
+        conn.execute('UPDATE Airplane SET capacity = 2 WHERE numSer = 123')
+        conn.executemany('INSERT INTO Passenger (passengerID, firstName, surname, password) VALUES (?, ?, ?, ?)',
+                         [('second', 'Second', 'User', b'x'), ('third', 'Third', 'User', b'x')])
+        conn.commit()
+        conn.close()
+
+        response = self.app.post('/api/booking', data=json.dumps({'passengerID': 'second', 'flightNum': 1}), content_type='application/json', headers=self.auth('second'))
+        self.assertEqual(response.status_code, 200)
+        response = self.app.post('/api/booking', data=json.dumps({'passengerID': 'third', 'flightNum': 1}), content_type='application/json', headers=self.auth('third'))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.data)['message'], 'Flight 1 is full')
+        self.assertEqual(json.loads(self.app.get('/api/flights').data)['flights'][0]['seatsAvailable'], 0)
+
+        # Cancelling frees the seat again
+        conn = sqlite3.connect('airplane.db')
+        conn.execute("DELETE FROM Booking WHERE passengerID = 'second'")
+        conn.commit()
+        conn.close()
+        self.assertEqual(json.loads(self.app.get('/api/flights/search/1').data)['flights'][0]['seatsAvailable'], 1)
+        response = self.app.post('/api/booking', data=json.dumps({'passengerID': 'third', 'flightNum': 1}), content_type='application/json', headers=self.auth('third'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_booking_requires_own_session(self):
+        booking = json.dumps({'passengerID': 'testuser', 'flightNum': 1})
+        response = self.app.post('/api/booking', data=booking, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        response = self.app.post('/api/booking/bulk', data=json.dumps([{'passengerID': 'testuser', 'flightNum': 1}]), content_type='application/json')
+        self.assertEqual(response.status_code, 401)
         response = self.app.get('/api/bookings/testuser')
+        self.assertEqual(response.status_code, 401)
+
+        response = self.app.post('/api/booking', data=booking, content_type='application/json', headers=self.auth('someoneelse'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_add_bookings_bulk(self):
+        conn = sqlite3.connect('airplane.db')
+        conn.execute('UPDATE Airplane SET capacity = 1 WHERE numSer = 123')
+        conn.execute('INSERT INTO Passenger (passengerID, firstName, surname, password) VALUES (?, ?, ?, ?)', ('traveller', 'Trip', 'User', b'x'))
+        conn.commit()
+        conn.close()
+        self.add_flights([2, 3])
+        headers = self.auth('traveller')
+
+        # Flight 1 has no seat left: nothing is booked
+        trip = [{'passengerID': 'traveller', 'flightNum': flight_num} for flight_num in (2, 3, 1)]
+        response = self.app.post('/api/booking/bulk', data=json.dumps(trip), content_type='application/json', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([result['status'] for result in data['results']], ['notBooked', 'notBooked', 'error'])
+        self.assertEqual(data['results'][2]['message'], 'Flight 1 is full')
+        self.assertEqual(self.app.get('/api/bookings/traveller', headers=headers).status_code, 404)
+
+        response = self.app.post('/api/booking/bulk', data=json.dumps(trip[:2]), content_type='application/json', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in data['results']], ['booked', 'booked'])
+        self.assertEqual([flight['seatsAvailable'] for flight in json.loads(self.app.get('/api/flights').data)['flights']], [0, 0, 0])
+
+    def test_add_bookings_bulk_invalid(self):
+        response = self.app.post('/api/booking/bulk', data=json.dumps([
+            {'passengerID': 'testuser', 'flightNum': 1},
+            {'passengerID': 'nobody', 'flightNum': 1},
+            {'passengerID': 'testuser', 'flightNum': 999}
+        ]), content_type='application/json', headers=self.auth())
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result.get('message') for result in data['results']], [
+            'Booking for passenger ID testuser on flight 1 already exists',
+            'Cannot book for another passenger',
+            'Flight number 999 does not exist'
+        ])
+
+    def test_add_bookings_bulk_nested_value(self):
+        response = self.app.post('/api/booking/bulk', data=json.dumps([
+            {'passengerID': 'testuser', 'flightNum': 1},
+            {'passengerID': ['testuser'], 'flightNum': 1}
+        ]), content_type='application/json', headers=self.auth())
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['message'], 'Row 1: passengerID must be a single value')
+
+    def test_get_bookings(self):
+        response = self.app.get('/api/bookings/testuser', headers=self.auth())
         data = json.loads(response.data)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(data['status'], 'success')
         self.assertEqual(len(data['bookings']), 1)
 
     def test_get_bookings_invalid_user(self):
-        response = self.app.get('/api/bookings/invaliduser')
+        response = self.app.get('/api/bookings/invaliduser', headers=self.auth('invaliduser'))
         data = json.loads(response.data)
         self.assertEqual(response.status_code, 404)
         self.assertEqual(data['status'], 'error')
@@ -382,6 +580,164 @@ class FlaskTestCase(unittest.TestCase):
         self.assertEqual(data['status'], 'success')
         self.assertEqual(len(data['flights']), 1)
 
+    def add_network(self):
+        # Each flight on an airframe of its own, so rotations stay out of the way
+        conn = sqlite3.connect('airplane.db')
+        conn.executemany('''
+            INSERT INTO Flight (flightNum, numSer, origin, destination, arrTime, departureTime)
+            VALUES (?, 100 + ?1, ?, ?, ?, ?)
+        ''', [
+            (10, 'Cardiff', 'London', '2024-06-01 09:00:00', '2024-06-01 08:00:00'),
+            (11, 'London', 'Glasgow', '2024-06-01 10:30:00', '2024-06-01 09:30:00'),
+            (12, 'London', 'Glasgow', '2024-06-01 11:00:00', '2024-06-01 10:00:00'),
+            (13, 'Cardiff', 'Glasgow', '2024-06-01 13:00:00', '2024-06-01 07:00:00'),
+            (14, 'Glasgow', 'Cardiff', '2024-06-01 12:00:00', '2024-06-01 11:00:00'),
+        ])
+        conn.commit()
+        conn.close()
+
+    def test_search_routes(self):
+        self.add_network()
+        response = self.app.get('/api/routes?origin=Cardiff&destination=Glasgow&departAfter=2024-06-01 06:00')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        # Flight 11 leaves London only 30 minutes after flight 10 lands
+        self.assertEqual([[f['flightNumber'] for f in i['flights']] for i in data['itineraries']], [[10, 12], [13]])
+        self.assertEqual(data['itineraries'][0]['connections'], 1)
+        self.assertEqual(data['itineraries'][0]['durationMinutes'], 180)
+
+        response = self.app.get('/api/routes?origin=Cardiff&destination=Glasgow&departAfter=2024-06-01 06:00&minConnection=15&limit=1')
+        data = json.loads(response.data)
+        self.assertEqual([f['flightNumber'] for f in data['itineraries'][0]['flights']], [10, 11])
+
+        response = self.app.get('/api/routes?origin=Cardiff&destination=Glasgow&departAfter=2024-06-01 06:00&maxLegs=1')
+        data = json.loads(response.data)
+        self.assertEqual([[f['flightNumber'] for f in i['flights']] for i in data['itineraries']], [[13]])
+
+        response = self.app.get('/api/routes?origin=Cardiff&destination=Glasgow&departAfter=2024-06-01 08:01')
+        self.assertEqual(response.status_code, 404)
+        response = self.app.get('/api/routes?origin=Cardiff&destination=Glasgow&departAfter=tomorrow')
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_routes_incremental(self):
+        self.add_network()
+        url = '/api/routes?origin=Cardiff&destination=Glasgow&departAfter=2024-06-01 06:00&limit=1'
+        self.app.get(url)
+        rebuilds = route_index.rebuilds
+
+        self.app.post('/api/flight', data=json.dumps({
+            'flightNum': 15,
+            'numSer': 123,
+            'origin': 'Cardiff',
+            'destination': 'Glasgow',
+            'arrTime': '2024-06-01 10:00:00',
+            'departureTime': '2024-06-01 08:30:00',
+            'pilotID': 'pilot1'
+        }), content_type='application/json')
+        data = json.loads(self.app.get(url).data)
+        self.assertEqual(data['itineraries'][0]['flights'][0]['flightNumber'], 15)
+
+        self.app.delete('/api/flight/15')
+        data = json.loads(self.app.get(url).data)
+        self.assertEqual([f['flightNumber'] for f in data['itineraries'][0]['flights']], [10, 12])
+        # Both writes were applied to the index in place
+        self.assertEqual(route_index.rebuilds, rebuilds)
+
+    def test_add_flight_crew_conflict(self):
+        self.add_network()
+        def assign(flight_num, **extra):
+            return self.app.post('/api/flightcrew', data=json.dumps(dict({
+                'staffID': 'pilot2',
+                'flightNum': flight_num
+            }, **extra)), content_type='application/json')
+
+        self.assertEqual(assign(10).status_code, 200)
+        response = assign(13)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(data['conflicts'], [10])
+        # Flight 12 leaves an hour after flight 10 lands, more than the minimum rest
+        self.assertEqual(assign(12).status_code, 200)
+
+        response = assign(13, allowConflict=True)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(data['conflicts']), [10, 12])
+
+        response = self.app.get('/api/crew/conflicts')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['conflicts'], [
+            {'staffID': 'pilot2', 'flightNum': 10, 'conflictsWith': 13, 'gapMinutes': -300},
+            {'staffID': 'pilot2', 'flightNum': 12, 'conflictsWith': 13, 'gapMinutes': -180},
+        ])
+
+        self.app.delete('/api/flight/13')
+        data = json.loads(self.app.get('/api/crew/conflicts').data)
+        self.assertEqual(data['count'], 0)
+        data = json.loads(self.app.get('/api/crew/conflicts?minRest=90').data)
+        self.assertEqual(data['conflicts'], [{'staffID': 'pilot2', 'flightNum': 12, 'conflictsWith': 10, 'gapMinutes': 60}])
+
+    def test_add_flights_bulk_pilot_conflict(self):
+        conn = sqlite3.connect('airplane.db')
+        conn.executemany("INSERT INTO Airplane (numSer, manufacturer, modelNum, typeRating) VALUES (?, 'Boeing', '737', 'B')", [(124,), (125,)])
+        conn.commit()
+        conn.close()
+        flight = {
+            'numSer': 123, 'origin': 'Cardiff', 'destination': 'London',
+            'departureTime': '2024-06-01 08:00:00', 'arrTime': '2024-06-01 09:00:00', 'pilotID': 'pilot1'
+        }
+        response = self.app.post('/api/flight/bulk', data=json.dumps([
+            dict(flight, flightNum=20),
+            dict(flight, flightNum=21, numSer=124, departureTime='2024-06-01 09:15:00', arrTime='2024-06-01 10:00:00'),
+            dict(flight, flightNum=22, numSer=125, departureTime='2024-06-01 09:30:00', arrTime='2024-06-01 10:30:00'),
+        ]), content_type='application/json')
+        data = json.loads(response.data)
+        self.assertEqual(data['status'], 'partial')
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual([error['index'] for error in data['errors']], [1])
+
+        response = self.app.post('/api/flight', data=json.dumps(dict(flight, flightNum=23, numSer=124)), content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.data)['conflicts'], [20])
+
+    def test_add_flight_aircraft_rotation(self):
+        def add(flight_num, origin, destination, departure, arrival, **extra):
+            return self.app.post('/api/flight', data=json.dumps(dict({
+                'flightNum': flight_num, 'numSer': 123, 'origin': origin, 'destination': destination,
+                'departureTime': f'2024-06-01 {departure}', 'arrTime': f'2024-06-01 {arrival}', 'pilotID': 'pilot1'
+            }, **extra)), content_type='application/json')
+
+        self.assertEqual(add(30, 'Cardiff', 'London', '08:00', '09:00').status_code, 200)
+        self.assertEqual(add(31, 'London', 'Glasgow', '12:00', '13:00', allowConflict=False).status_code, 200)
+
+        # In the air at the same time
+        response = add(32, 'London', 'Leeds', '08:30', '09:30')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([c['problem'] for c in data['aircraftConflicts']], ['overlap', 'position'])
+
+        # The plane is in London between the flights, not in Leeds, and must be back in London by noon
+        response = add(33, 'Leeds', 'Bristol', '10:00', '11:00')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([(c['flightNum'], c['problem']) for c in data['aircraftConflicts']], [(30, 'position'), (31, 'position')])
+        self.assertEqual(data['message'], 'The airplane lands in London on flight 30, not Leeds')
+
+        self.assertEqual(add(34, 'London', 'London', '10:00', '11:00').status_code, 200)
+
+        response = self.app.get('/api/airplanes/123/rotation?from=2024-06-01&to=2024-06-02')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f['flightNumber'] for f in data['flights']], [30, 34, 31])
+        self.assertEqual(data['flights'][1]['turnaroundMinutes'], 60)
+        self.assertTrue(data['flights'][2]['positioned'])
+
+        self.app.delete('/api/flight/34')
+        data = json.loads(self.app.get('/api/airplanes/123/rotation?from=2024-06-01&to=2024-06-02').data)
+        self.assertEqual([f['flightNumber'] for f in data['flights']], [30, 31])
+        self.assertEqual(self.app.get('/api/airplanes/999/rotation').status_code, 404)
+
     def test_delete_flight(self):
         response = self.app.delete('/api/flight/1')
         data = json.loads(response.data)
@@ -389,5 +745,959 @@ class FlaskTestCase(unittest.TestCase):
         self.assertEqual(data['status'], 'success')
         self.assertEqual(data['message'], 'Flight number 1 and its dependencies deleted successfully')
 
+    def test_delete_flight_waits_for_concurrent_writer(self):
+        # Another connection holds the write lock and commits while the delete is waiting for it
+        writer = sqlite3.connect('airplane.db')
+        writer.execute('BEGIN IMMEDIATE')
+        writer.execute("INSERT INTO Staff (id, firstName, surname, salary) VALUES ('S900', 'Ann', 'Other', 1.0)")
+        responses = []
+        thread = threading.Thread(target=lambda: responses.append(self.app.delete('/api/flight/1')))
+        thread.start()
+        time.sleep(0.2)
+        writer.commit()
+        writer.close()
+        thread.join()
+        self.assertEqual(responses[0].status_code, 200)
+        conn = sqlite3.connect('airplane.db')
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM Flight WHERE flightNum = 1').fetchone(), (0,))
+        conn.close()
+
+    def add_flights(self, flight_nums):
+        conn = sqlite3.connect('airplane.db')
+        conn.executemany('''
+            INSERT INTO Flight (flightNum, numSer, origin, destination, arrTime, departureTime)
+            VALUES (?, 123, 'NYC', 'LAX', '12:00:00', '15:00:00')
+        ''', [(num,) for num in flight_nums])
+        conn.commit()
+        conn.close()
+
+    def test_get_flights_departure_window(self):
+        self.add_network()
+        response = self.app.get('/api/flights?departAfter=2024-06-01 08:00&departBefore=2024-06-01 10:00')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([flight['flightNumber'] for flight in data['flights']], [10, 11])
+        response = self.app.get('/api/flights?origin=London&departAfter=2024-06-01 09:45')
+        self.assertEqual([flight['flightNumber'] for flight in json.loads(response.data)['flights']], [12])
+        response = self.app.get('/api/flights?departBefore=tomorrow')
+        self.assertEqual(response.status_code, 400)
+
+    def test_departures_board(self):
+        self.add_network()
+        response = self.app.get('/api/departures/Cardiff?after=2024-06-01 06:00')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([flight['flightNumber'] for flight in data['departures']], [13, 10])
+
+        response = self.app.post('/api/flight', data=json.dumps({
+            'flightNum': 15, 'numSer': 123, 'origin': 'Cardiff', 'destination': 'Glasgow',
+            'departureTime': '2024-06-01 07:30:00', 'arrTime': '2024-06-01 08:30:00', 'pilotID': 'pilot1'
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = self.app.post('/api/booking', data=json.dumps({'passengerID': 'testuser', 'flightNum': 15}), content_type='application/json', headers=self.auth())
+        self.assertEqual(response.status_code, 200)
+        self.app.delete('/api/flight/10')
+
+        changes, _ = events.broker.since(data['eventId'], 'Cardiff')
+        self.assertEqual([event['type'] for _, _, event in changes], ['flightAdded', 'seatsChanged', 'flightDeleted'])
+        self.assertEqual(changes[0][2]['flight']['flightNumber'], 15)
+        response = self.app.get('/api/departures/Cardiff?after=2024-06-01 06:00&limit=5')
+        self.assertEqual([flight['flightNumber'] for flight in json.loads(response.data)['departures']], [13, 15])
+
+    def test_eligible_pilots(self):
+        url = '/api/airplanes/123/pilots?from=2024-06-01 08:00&to=2024-06-01 09:00'
+        data = json.loads(self.app.get(url).data)
+        self.assertEqual(data['pilots'], [{'staffID': 'pilot1', 'typeRating': 'B'}])
+
+        # Picked up without a rebuild, the closest rating first
+        response = self.app.post('/api/pilot', data=json.dumps({'staffID': 'pilot2', 'typeRating': 'A'}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        rebuilds = qualification_index.rebuilds
+        data = json.loads(self.app.get(url).data)
+        self.assertEqual([pilot['staffID'] for pilot in data['pilots']], ['pilot1', 'pilot2'])
+        self.assertEqual(qualification_index.rebuilds, rebuilds)
+
+        # A flight within the minimum rest makes pilot1 unavailable
+        response = self.app.post('/api/flight', data=json.dumps({
+            'flightNum': 20, 'numSer': 123, 'origin': 'Cardiff', 'destination': 'London',
+            'departureTime': '2024-06-01 09:15:00', 'arrTime': '2024-06-01 10:00:00', 'pilotID': 'pilot1'
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(self.app.get(url + '&limit=1').data)
+        self.assertEqual(data['pilots'], [{'staffID': 'pilot2', 'typeRating': 'A'}])
+        self.assertEqual((data['more'], data['qualified']), (False, 2))
+        self.assertEqual(self.app.get('/api/airplanes/999/pilots?from=2024-06-01 08:00&to=2024-06-01 09:00').status_code, 404)
+
+    def test_utilization(self):
+        for flight_num, origin, destination, departure, arrival in (
+            (40, 'London', 'Cardiff', '2024-06-01 08:00:00', '2024-06-01 10:00:00'),
+            (41, 'Cardiff', 'London', '2024-06-01 12:00:00', '2024-06-01 13:30:00'),
+            (42, 'London', 'Cardiff', '2024-06-02 09:00:00', '2024-06-02 10:00:00')
+        ):
+            response = self.app.post('/api/flight', data=json.dumps({
+                'flightNum': flight_num, 'numSer': 123, 'origin': origin, 'destination': destination,
+                'departureTime': departure, 'arrTime': arrival, 'pilotID': 'pilot1'
+            }), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        data = json.loads(self.app.get('/api/utilization?from=2024-06-01&to=2024-06-03').data)
+        expected = {'flights': [3], 'flightsPerDay': [1.5], 'blockHours': [4.5], 'blockHoursPerDay': [2.25],
+                    'idleHours': [21.5], 'longestIdleHours': [19.5]}
+        self.assertEqual(data['airframes'], dict(expected, numSer=[123]))
+        self.assertEqual(data['crew'], dict(expected, staffID=['pilot1']))
+        self.assertEqual(data['days'], 2)
+
+        data = json.loads(self.app.get('/api/utilization?from=2024-06-02&to=2024-06-03&by=airframe').data)
+        self.assertEqual((data['airframes']['flights'], data['airframes']['idleHours']), ([1], [0]))
+        self.assertNotIn('crew', data)
+        self.assertEqual(self.app.get('/api/utilization?from=2024-06-03&to=2024-06-01').status_code, 400)
+        self.assertEqual(self.app.get('/api/utilization?from=2024-06-01&to=2024-06-03&by=city').status_code, 400)
+
+    def test_solve_flight_crew(self):
+        conn = sqlite3.connect('airplane.db')
+        conn.execute("INSERT INTO Staff (id, firstName, surname, salary) VALUES ('pilot3', 'Jane', 'Roe', 90000.0)")
+        conn.execute("INSERT INTO Pilot (id, typeRating) VALUES ('pilot3', 'A')")
+        conn.executemany('INSERT INTO Flight (flightNum, numSer, origin, destination, departureTime, arrTime) VALUES (?, 123, ?, ?, ?, ?)', [
+            (50, 'London', 'Cardiff', '2024-06-01 08:00:00', '2024-06-01 10:00:00'),
+            (51, 'Cardiff', 'London', '2024-06-01 10:15:00', '2024-06-01 11:00:00'),
+            (52, 'London', 'Cardiff', '2024-06-01 12:00:00', '2024-06-01 13:00:00')
+        ])
+        conn.commit()
+        conn.close()
+
+        # pilot1 (B) is still resting from flight 50 at 10:15, so the A-rated pilot3 takes flight 51;
+        # pilot2 is the only cabin crew
+        body = {'flightNums': [52, 51, 50, 999], 'pilots': 1, 'cabinCrew': 1}
+        data = json.loads(self.app.post('/api/flightcrew/solve', data=json.dumps(dict(body, dryRun=True)), content_type='application/json').data)
+        self.assertFalse(data['committed'])
+        response = self.app.post('/api/flightcrew/solve', data=json.dumps(body), content_type='application/json')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row['flightNum'], row['staffID'], row['role']) for row in data['assignments']], [
+            (50, 'pilot1', 'pilot'), (50, 'pilot2', 'cabinCrew'), (51, 'pilot3', 'pilot'),
+            (52, 'pilot1', 'pilot'), (52, 'pilot2', 'cabinCrew')
+        ])
+        self.assertEqual(data['unfilled'], [{'flightNum': 51, 'pilots': 0, 'cabinCrew': 1}])
+        self.assertEqual((data['missing'], data['status'], data['committed']), ([999], 'partial', True))
+        self.assertEqual(json.loads(self.app.get('/api/crew/conflicts').data)['conflicts'], [])
+
+        # Those now assigned count towards what each flight needs
+        data = json.loads(self.app.post('/api/flightcrew/solve', data=json.dumps(body), content_type='application/json').data)
+        self.assertEqual(data['assignments'], [])
+        response = self.app.post('/api/flightcrew/solve', data=json.dumps({'flightNums': [50], 'pilots': 99}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_writers_rebuild_indexes_before_locking(self):
+        load = crew_index.load
+        in_transaction = []
+
+        def recording_load(conn):
+            in_transaction.append(conn.in_transaction)
+            load(conn)
+
+        for path, body in [
+            ('/api/flightcrew/solve', {'flightNums': [1], 'dryRun': True}),
+            ('/api/flightcrew/bulk', [{'staffID': 'pilot2', 'flightNum': 1}]),
+            ('/api/flightcrew', {'staffID': 'pilot2', 'flightNum': 1}),
+        ]:
+            self.app.get('/api/crew/conflicts')
+            # A write from elsewhere leaves the crew index stale
+            conn = sqlite3.connect('airplane.db')
+            conn.execute("INSERT INTO Staff (id, firstName, surname, salary) VALUES ('spare', 'Spare', 'Crew', 1)")
+            conn.execute("INSERT INTO flightCrew (staffID, flightNum) VALUES ('spare', 1)")
+            conn.execute("DELETE FROM flightCrew WHERE staffID = 'spare'")
+            conn.execute("DELETE FROM Staff WHERE id = 'spare'")
+            conn.commit()
+            conn.close()
+            with mock.patch.object(crew_index, 'load', side_effect=recording_load):
+                response = self.app.post(path, data=json.dumps(body), content_type='application/json')
+            self.assertLess(response.status_code, 500)
+        self.assertEqual(in_transaction, [False, False, False])
+
+    def test_flight_path_distances(self):
+        for city_id, name, latitude, longitude in ((2, 'London', 51.5074, -0.1278), (3, 'Bristol', 51.4545, -2.5879), (4, 'Cardiff', 51.4816, -3.1791)):
+            response = self.app.post('/api/intercity', data=json.dumps({
+                'cityID': city_id, 'cityName': name, 'cityCountry': 'UK', 'latitude': latitude, 'longitude': longitude
+            }), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+        for flight_num in (30, 31):
+            response = self.app.post('/api/flight', data=json.dumps({
+                'flightNum': flight_num, 'numSer': 123, 'origin': 'London', 'destination': 'Cardiff',
+                'departureTime': f'2024-06-0{flight_num - 28} 09:00:00', 'arrTime': f'2024-06-0{flight_num - 28} 10:00:00', 'pilotID': 'pilot1', 'allowConflict': True
+            }), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        # Appended to the end, or inserted at a position; a city only once per path
+        for body, status in (({'cityID': 3}, 200), ({'cityID': 1, 'position': 0}, 200), ({'cityID': 3}, 400)):
+            response = self.app.post('/api/flightpath', data=json.dumps(dict(body, flightNum=30)), content_type='application/json')
+            self.assertEqual(response.status_code, status)
+
+        data = json.loads(self.app.get('/api/flightpath/30').data)
+        self.assertEqual([city['cityName'] for city in data['route']], ['London', 'Chicago', 'Bristol', 'Cardiff'])
+        self.assertEqual(data['legsKm'], [None, None, 41.1])
+        self.assertIsNone(data['totalKm'])
+        self.assertEqual(self.app.get('/api/flightpath/999').status_code, 404)
+
+        response = self.app.post('/api/flights/distances', data=json.dumps({'flightNums': [31, 1, 999]}), content_type='application/json')
+        data = json.loads(response.data)
+        self.assertEqual(data['distances'], [
+            {'flightNum': 31, 'legsKm': [211.2], 'totalKm': 211.2},
+            {'flightNum': 1, 'legsKm': [None], 'totalKm': None}
+        ])
+        self.assertEqual(data['missing'], [999])
+
+    def test_get_flights_paginated(self):
+        self.add_flights(range(2, 6))
+        response = self.app.get('/api/flights?limit=2')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f['flightNumber'] for f in data['flights']], [1, 2])
+        self.assertEqual(data['next'], 2)
+
+        response = self.app.get(f"/api/flights?limit=2&after={data['next']}&origin=NYC")
+        data = json.loads(response.data)
+        self.assertEqual([f['flightNumber'] for f in data['flights']], [3, 4])
+
+        response = self.app.get('/api/flights?limit=2&after=4')
+        data = json.loads(response.data)
+        self.assertEqual([f['flightNumber'] for f in data['flights']], [5])
+        self.assertIsNone(data['next'])
+
+    def test_get_flights_paginated_by_departure(self):
+        conn = sqlite3.connect('airplane.db')
+        conn.executemany('''
+            INSERT INTO Flight (flightNum, numSer, origin, destination, arrTime, departureTime)
+            VALUES (?, 123, 'NYC', 'LAX', '2024-06-01 23:00:00', ?)
+        ''', [(2, '2024-06-01 10:00:00'), (3, '2024-06-01 08:00:00'), (4, '2024-06-01 10:00:00'), (5, '2024-06-01 09:00:00')])
+        conn.commit()
+        conn.close()
+
+        # Flight 1 has no date, so it has no place in departure order
+        data = json.loads(self.app.get('/api/flights?order=departure&limit=2').data)
+        self.assertEqual([f['flightNumber'] for f in data['flights']], [3, 5])
+        self.assertEqual(data['next'], f"{routing.parse_time('2024-06-01 09:00:00')}:5")
+        data = json.loads(self.app.get(f"/api/flights?order=departure&limit=2&after={data['next']}&origin=NYC").data)
+        self.assertEqual([f['flightNumber'] for f in data['flights']], [2, 4])
+        self.assertIsNone(data['next'])
+        data = json.loads(self.app.get(f"/api/flights?order=departure&stream=1&limit=1&after={routing.parse_time('2024-06-01 10:00:00')}:2").data)
+        self.assertEqual([f['flightNumber'] for f in data['flights']], [4])
+        self.assertEqual(self.app.get('/api/flights?order=origin').status_code, 400)
+        self.assertEqual(self.app.get('/api/flights?order=departure&after=5').status_code, 400)
+
+    def test_stream_zero_is_cached(self):
+        # Only stream=1/true streams; anything else is an ordinary, cacheable response
+        hits = response_cache.stats()['hits']
+        self.app.get('/api/flights?stream=0')
+        self.app.get('/api/flights?stream=0')
+        self.assertEqual(response_cache.stats()['hits'], hits + 1)
+
+    def test_get_flights_invalid_limit(self):
+        response = self.app.get('/api/flights?limit=0')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['status'], 'error')
+
+    def test_search_flights_streamed(self):
+        self.add_flights([10, 11, 21])
+        response = self.app.get('/api/flights/search/1?stream=1')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['status'], 'success')
+        self.assertEqual([f['flightNumber'] for f in data['flights']], [1, 10, 11, 21])
+
+        response = self.app.get('/api/flights/search/1?stream=1&limit=3')
+        data = json.loads(response.data)
+        self.assertEqual([f['flightNumber'] for f in data['flights']], [1, 10, 11])
+        self.assertEqual(data['next'], 11)
+
+    def test_search_flights_substring(self):
+        self.add_flights([123, 312, 45])
+        response = self.app.get('/api/flights/search/12')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f['flightNumber'] for f in data['flights']], [123, 312])
+
+        # Deleted flights drop out of the search index
+        self.app.delete('/api/flight/312')
+        response = self.app.get('/api/flights/search/12')
+        data = json.loads(response.data)
+        self.assertEqual([f['flightNumber'] for f in data['flights']], [123])
+
+    def test_add_flights_bulk(self):
+        rows = [
+            {'flightNum': 2, 'numSer': 123, 'origin': 'LAX', 'destination': 'SFO', 'arrTime': '16:00:00', 'departureTime': '18:00:00', 'pilotID': 'pilot1'},
+            {'flightNum': 3, 'numSer': 999, 'origin': 'LAX', 'destination': 'SFO', 'arrTime': '16:00:00', 'departureTime': '18:00:00', 'pilotID': 'pilot1'},
+            {'flightNum': 1, 'numSer': 123, 'origin': 'LAX', 'destination': 'SFO', 'arrTime': '16:00:00', 'departureTime': '18:00:00', 'pilotID': 'pilot1'}
+        ]
+        response = self.app.post('/api/flight/bulk', data='\n'.join(json.dumps(row) for row in rows), content_type='application/x-ndjson')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['status'], 'partial')
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['errors'], [
+            {'index': 1, 'message': 'Airplane serial number 999 does not exist'},
+            {'index': 2, 'message': 'Flight number 1 already exists'}
+        ])
+
+        response = self.app.get('/api/flightcrew/pilot1')
+        data = json.loads(response.data)
+        self.assertEqual(len(data['flights']), 2)
+
+    def test_add_flight_crew_bulk(self):
+        response = self.app.post('/api/flightcrew/bulk', data=json.dumps([
+            {'staffID': 'pilot2', 'flightNum': 1},
+            {'staffID': 'pilot2', 'flightNum': 1},
+            {'staffID': 'nobody', 'flightNum': 1}
+        ]), content_type='application/json')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual([error['index'] for error in data['errors']], [1, 2])
+
+    def test_bulk_rejects_nested_values(self):
+        for path, row in [
+            ('/api/flightcrew/bulk', {'staffID': {}, 'flightNum': 1}),
+            ('/api/flight/bulk', {'flightNum': 2, 'numSer': 123, 'pilotID': ['pilot1']}),
+            ('/api/flightpath/bulk', {'flightNum': 1, 'cityID': [1]}),
+        ]:
+            response = self.app.post(path, data=json.dumps([{'staffID': 'pilot2', 'flightNum': 1}, row]), content_type='application/json')
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(data['status'], 'error')
+            self.assertTrue(data['message'].startswith('Row 1: '))
+        response = self.app.get('/api/flightcrew/pilot2')
+        self.assertEqual(json.loads(response.data).get('flights', []), [])
+
+    def test_add_flight_path_bulk_rejects_everything(self):
+        response = self.app.post('/api/flightpath/bulk', data=json.dumps([
+            {'flightNum': 1, 'cityID': 999},
+            {'flightNum': 999, 'cityID': 1}
+        ]), content_type='application/json')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['status'], 'error')
+        self.assertEqual(data['errors'][0]['message'], 'City ID 999 does not exist')
+        self.assertEqual(data['errors'][1]['message'], 'Flight number 999 does not exist')
+
+    def test_get_flights_cached_until_write(self):
+        response_cache.clear()
+        before = response_cache.stats()
+        first = self.app.get('/api/flights')
+        second = self.app.get('/api/flights')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(response_cache.stats()['hits'], before['hits'] + 1)
+
+        # A new flight bumps the Flight generation, so the cached list is not served again
+        self.add_flights([2])
+        response = self.app.get('/api/flights')
+        data = json.loads(response.data)
+        self.assertEqual(len(data['flights']), 2)
+        self.assertEqual(response_cache.stats()['invalidations'], before['invalidations'] + 1)
+
+    def test_get_bookings_cache_invalidated_by_booking(self):
+        self.add_flights([2])
+        self.app.get('/api/bookings/testuser', headers=self.auth())
+        self.app.post('/api/booking', data=json.dumps({
+            'passengerID': 'testuser',
+            'flightNum': 2
+        }), content_type='application/json', headers=self.auth())
+        response = self.app.get('/api/bookings/testuser', headers=self.auth())
+        data = json.loads(response.data)
+        self.assertEqual(len(data['bookings']), 2)
+
+    def test_get_bookings_conditional(self):
+        headers = self.auth()
+        response = self.app.get('/api/bookings/testuser', headers=headers)
+        etag = response.headers['ETag']
+        response = self.app.get('/api/bookings/testuser', headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        # Deleting the booked flight changes the passenger's stamp
+        self.app.delete('/api/flight/1')
+        response = self.app.get('/api/bookings/testuser', headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 404)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_get_flight_by_emp_num_conditional(self):
+        self.add_flights([2])
+        response = self.app.get('/api/flightcrew/pilot1')
+        etag = response.headers['ETag']
+        response = self.app.get('/api/flightcrew/pilot1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        self.app.post('/api/flightcrew', data=json.dumps({
+            'staffID': 'pilot1',
+            'flightNum': 2
+        }), content_type='application/json')
+        response = self.app.get('/api/flightcrew/pilot1', headers={'If-None-Match': etag})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['flights']), 2)
+
+    def test_db_stats(self):
+        self.app.get('/api/flights')
+        self.app.get('/api/flights')
+        response = self.app.get('/api/db/stats')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['status'], 'success')
+        self.assertGreaterEqual(data['pool']['hits'], 1)
+        self.assertEqual(data['pool']['waits'], 0)
+
+    def test_hashing_stats(self):
+        self.app.post('/api/login', data=json.dumps({
+            'username': 'testuser',
+            'password': 'password'
+        }), content_type='application/json')
+        response = self.app.get('/api/hashing/stats')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['status'], 'success')
+        self.assertEqual(data['hashing']['rejected'], 0)
+
+    def test_metrics(self):
+        # A streamed response is observed when the server closes it after sending the body
+        response = self.app.get('/api/flights?stream=1')
+        response.get_data()
+        response.close()
+        self.app.post('/api/login', data=json.dumps({
+            'username': 'testuser',
+            'password': 'password'
+        }), content_type='application/json')
+        response = self.app.get('/api/metrics')
+        text = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn('flight_api_requests_total{method="GET",route="/api/flights",status="200"}', text)
+        self.assertIn('flight_api_request_duration_seconds_bucket{method="POST",route="/api/login",le="+Inf"}', text)
+        self.assertIn('flight_api_request_bcrypt_duration_seconds_count{method="POST",route="/api/login"}', text)
+        self.assertNotIn('flight_api_request_bcrypt_duration_seconds_count{method="GET"', text)
+        # The streamed listing ran its query, and the statement count says so
+        self.assertNotIn('flight_api_request_sql_statements_bucket{method="GET",route="/api/flights",le="0"} 1', text)
+
+    def test_metrics_time_event_streams_until_closed(self):
+        response = self.app.get('/api/departures/Cardiff/events?since=-1', buffered=False)
+        self.assertIn(b'event: reset', next(response.iter_encoded()))
+        time.sleep(0.05)
+        self.assertNotIn('route="/api/departures/<string:city>/events"', self.app.get('/api/metrics').get_data(as_text=True))
+        response.close()
+
+        text = self.app.get('/api/metrics').get_data(as_text=True)
+        line = next(line for line in text.splitlines() if line.startswith('flight_api_request_duration_seconds_sum{method="GET",route="/api/departures/<string:city>/events"}'))
+        self.assertGreaterEqual(float(line.split()[-1]), 0.05)
+
+class MetricsRegistryTestCase(unittest.TestCase):
+    def test_threads_are_summed(self):
+        registry = metrics.Registry()
+        labels = (('method', 'GET'), ('route', '/api/flights'))
+
+        def record():
+            for value in (0.002, 0.02, 20):
+                registry.observe('flight_api_request_duration_seconds', labels, metrics.LATENCY_BUCKETS, value)
+            registry.count('flight_api_requests_total', labels + (('status', 200),), 3)
+
+        # Finished threads are folded into the retired totals, not lost
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        record()
+
+        text = registry.render()
+        self.assertIn('flight_api_requests_total{method="GET",route="/api/flights",status="200"} 15', text)
+        self.assertIn('flight_api_request_duration_seconds_bucket{method="GET",route="/api/flights",le="0.0025"} 5', text)
+        self.assertIn('flight_api_request_duration_seconds_bucket{method="GET",route="/api/flights",le="10.0"} 10', text)
+        self.assertIn('flight_api_request_duration_seconds_count{method="GET",route="/api/flights"} 15', text)
+        self.assertEqual(len(registry._shards), 1)
+
+class RouteIndexTestCase(unittest.TestCase):
+    def test_departures_match_rebuild(self):
+        rng = random.Random(1)
+        legs = [(rng.randrange(1000), 0, flight_num) for flight_num in range(200)]
+        legs = [(departure, departure + rng.randrange(1, 500), flight_num) for departure, _, flight_num in legs]
+        departures = routing.Departures()
+        for leg in legs:
+            departures.add(*leg)
+        for departure, _, flight_num in legs[::3]:
+            self.assertTrue(departures.remove(departure, flight_num))
+        self.assertFalse(departures.remove(0, 999))
+
+        remaining = [leg for i, leg in enumerate(legs) if i % 3]
+        self.assertEqual(sorted(zip(departures.times, departures.arrivals, departures.flights)), sorted(remaining))
+        self.assertEqual(list(departures.times), sorted(departures.times))
+        self.assertEqual(list(departures.earliest), [min(departures.arrivals[i:]) for i in range(len(departures.arrivals))])
+        best = departures.best(500, 3)
+        brute = sorted((arrival, flight_num) for departure, arrival, flight_num in legs[1::3] + legs[2::3] if departure >= 500)[:3]
+        self.assertEqual(sorted((arrival, flight_num) for _, arrival, flight_num in best), brute)
+
+class CrewIndexTestCase(unittest.TestCase):
+    def test_roster_conflicts_match_brute_force(self):
+        rng = random.Random(2)
+        duties = [(start, start + rng.randrange(30, 300), flight_num) for flight_num, start in enumerate(rng.sample(range(10000), 100))]
+        roster = crew.Roster()
+        for duty in duties:
+            roster.add(*duty)
+        for departure, _, flight_num in duties[::4]:
+            self.assertIsNotNone(roster.remove(departure, flight_num))
+        remaining = [duty for i, duty in enumerate(duties) if i % 4]
+
+        self.assertEqual(list(roster.latest), [max(roster.arrivals[:i + 1]) for i in range(len(roster))])
+        for _ in range(50):
+            departure = rng.randrange(10000)
+            arrival = departure + rng.randrange(30, 300)
+            self.assertEqual(sorted(roster.conflicts(departure, arrival, 30)), sorted(crew.overlapping(remaining, departure, arrival, 30)))
+
+    def test_long_duty_does_not_slow_later_checks(self):
+        # One long duty first keeps latest high for everything after it
+        duties = [(0, 50000, 0)] + [(60000 + n * 1000, 60000 + n * 1000 + 100, n + 1) for n in range(5000)]
+        roster = crew.Roster(duties)
+
+        class CountingReads:
+            def __init__(self, values):
+                self.values = values
+                self.reads = 0
+
+            def __getitem__(self, i):
+                self.reads += 1
+                return self.values[i]
+
+        roster.latest = CountingReads(roster.latest)
+        self.assertEqual(roster.conflicts(4000500, 4000550, 30), [])
+        self.assertEqual(roster.conflicts(4000050, 4000200, 30), [3941])
+        self.assertLess(roster.latest.reads, 10)
+        self.assertEqual(roster.conflicts(40000, 40100, 30), [0])
+        roster.latest = roster.latest.values
+
+        # Removing the long duty brings the bound back down
+        self.assertEqual(roster.longest, 50000)
+        roster.remove(0, 0)
+        self.assertEqual(roster.longest, 100)
+        self.assertEqual(sorted(roster.conflicts(100000, 130000, 30)), crew.overlapping(duties[1:], 100000, 130000, 30))
+
+class ResponseCacheTestCase(unittest.TestCase):
+
+    def test_lru_eviction_by_size(self):
+        response_cache = cache.ResponseCache(max_bytes=3 * (100 + cache.ENTRY_OVERHEAD))
+        for key in 'abc':
+            response_cache.put(key, (1,), b'x' * 100, 200)
+        response_cache.get('a', (1,))
+        response_cache.put('d', (1,), b'x' * 100, 200)
+
+        # 'b' was the least recently used entry
+        self.assertIsNone(response_cache.get('b', (1,)))
+        self.assertIsNotNone(response_cache.get('a', (1,)))
+        self.assertEqual(response_cache.stats()['evictions'], 1)
+
+    def test_version_mismatch_and_ttl(self):
+        response_cache = cache.ResponseCache(ttl=0)
+        response_cache.put('a', (1,), b'{}', 200)
+        self.assertIsNone(response_cache.get('a', (1,)))
+        self.assertEqual(response_cache.stats()['expirations'], 1)
+
+        response_cache.ttl = 60
+        response_cache.put('a', (1,), b'{}', 200)
+        self.assertIsNone(response_cache.get('a', (2,)))
+        self.assertEqual(response_cache.stats()['invalidations'], 1)
+
+class HashingServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.service = hashing.HashingService(workers=1, max_queue=0, rounds=4)
+
+    def tearDown(self):
+        self.service.shutdown()
+
+    def test_hash_and_check(self):
+        hashed = self.service.hash_password('secret').result()
+        self.assertTrue(hashed.startswith(b'$2b$04$'))
+        self.assertTrue(self.service.check_password('secret', hashed).result())
+        self.assertFalse(self.service.check_password('wrong', hashed).result())
+
+    def test_full_queue_rejects(self):
+        busy = self.service._submit(time.sleep, 0.2)
+        with self.assertRaises(hashing.HashingQueueFull):
+            self.service.hash_password('secret')
+        busy.result()
+        self.assertEqual(self.service.stats()['rejected'], 1)
+
+def asgi_request(asgi_app, method, path, query_string=b'', body=b''):
+    # Drives an ASGI app for one request and returns (status, headers, body)
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        await asgi_app({
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query_string,
+            'headers': [(b'content-type', b'application/json')]
+        }, receive, send)
+
+    asyncio.run(run())
+    return sent[0]['status'], dict(sent[0]['headers']), b''.join(message.get('body', b'') for message in sent[1:])
+
+class AsgiTestCase(unittest.TestCase):
+
+    def test_flask_routes_served(self):
+        status, headers, body = asgi_request(asgi.app, 'POST', '/api/login', body=json.dumps({'username': '', 'password': ''}).encode())
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body)['message'], 'Username and password are required')
+
+        status, headers, body = asgi_request(asgi.app, 'GET', '/api/asgi/stats')
+        self.assertEqual(status, 200)
+        self.assertGreaterEqual(json.loads(body)['limits']['auth']['completed'], 1)
+
+    def test_streamed_response(self):
+        def wsgi_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return iter([b'a', b'b', b'c'])
+
+        status, headers, body = asgi_request(asgi.AsyncFlightAPI(wsgi_app), 'GET', '/')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'text/plain')
+        self.assertEqual(body, b'abc')
+
+    def test_overloaded_class_sheds_requests(self):
+        release = threading.Event()
+
+        def wsgi_app(environ, start_response):
+            release.wait(5)
+            start_response('200 OK', [])
+            return [b'done']
+
+        asgi_app = asgi.AsyncFlightAPI(wsgi_app, limits={'read': (1, 0)})
+
+        async def run():
+            async def receive():
+                await asyncio.sleep(3600)
+
+            first_sent = []
+            async def send_first(message):
+                first_sent.append(message)
+
+            scope = {'type': 'http', 'method': 'GET', 'path': '/api/flights', 'headers': []}
+            asgi_app.read_body = lambda receive: asyncio.sleep(0, b'')
+            first = asyncio.ensure_future(asgi_app(scope, receive, send_first))
+            await asyncio.sleep(0.05)
+
+            second_sent = []
+            async def send_second(message):
+                second_sent.append(message)
+
+            await asgi_app(scope, receive, send_second)
+            release.set()
+            await first
+            return first_sent[0]['status'], second_sent[0]['status']
+
+        self.assertEqual(asyncio.run(run()), (200, 503))
+
+    def test_pool_covers_concurrent_reads(self):
+        # Twelve reads holding a connection at once, from a pool created for two
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pool = db.ConnectionPool(os.path.join(tmpdir, 'pool.db'), max_size=2, timeout=0.5)
+            together = threading.Barrier(12)
+
+            def wsgi_app(environ, start_response):
+                conn = pool.acquire()
+                try:
+                    together.wait(5)
+                    conn.execute('SELECT 1')
+                finally:
+                    pool.release(conn)
+                start_response('200 OK', [])
+                return [b'ok']
+
+            asgi_app = asgi.AsyncFlightAPI(wsgi_app, limits={'read': (12, 64), 'write': (1, 1), 'auth': (1, 1)}, pool=pool)
+            self.assertEqual(pool.max_size, 14)
+
+            asgi_app.read_body = lambda receive: asyncio.sleep(0, b'')
+
+            async def request():
+                sent = []
+
+                async def send(message):
+                    sent.append(message)
+
+                await asgi_app({'type': 'http', 'method': 'GET', 'path': '/api/flights', 'headers': []}, lambda: asyncio.sleep(3600), send)
+                return sent[0]['status']
+
+            async def run():
+                return await asyncio.gather(*[request() for _ in range(12)])
+
+            self.assertEqual(asyncio.run(run()), [200] * 12)
+            self.assertEqual(pool.stats()['size'], 12)
+            pool.close()
+        self.assertGreaterEqual(db.pool.max_size, sum(concurrency for concurrency, _ in asgi.DEFAULT_LIMITS.values()))
+
+    def test_departure_events_stream(self):
+        async def run():
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+            disconnected = asyncio.Event()
+            sent = []
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if len(sent) == 2:
+                    disconnected.set()
+
+            scope = {'type': 'http', 'method': 'GET', 'path': '/api/departures/Stream City/events', 'query_string': b'', 'headers': []}
+            subscriber = asyncio.ensure_future(asgi.app(scope, receive, send))
+            await asyncio.sleep(0.05)
+            # Published from another thread, as the Flask routes do
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, events.broker.publish, 'Elsewhere', {'type': 'flightDeleted', 'flightNumber': 1})
+            seq = await loop.run_in_executor(None, events.broker.publish, 'Stream City', {'type': 'flightDeleted', 'flightNumber': 2})
+            await asyncio.wait_for(subscriber, 5)
+            return sent, seq
+
+        sent, seq = asyncio.run(run())
+        self.assertEqual(dict(sent[0]['headers'])[b'content-type'], b'text/event-stream')
+        self.assertEqual(sent[1]['body'].decode(), f'id: {seq}\nevent: flightDeleted\ndata: {{"type": "flightDeleted", "flightNumber": 2}}\n\n')
+
+class QualificationIndexTestCase(unittest.TestCase):
+
+    def test_eligible(self):
+        index = qualifications.QualificationIndex()
+        index.add([('p3', 'C'), ('p1', 'a'), ('p2', 'B'), ('p4', 'F'), ('p0', 'B ')])
+        self.assertEqual(list(index.eligible('C')), [('p3', 'C'), ('p0', 'B'), ('p2', 'B'), ('p1', 'A')])
+        self.assertEqual(index.count('B'), 3)
+        self.assertEqual(list(index.eligible(None)), [])
+
+        # Re-rating moves the pilot
+        index.add([('p4', 'A')])
+        self.assertEqual(list(index.eligible('A')), [('p1', 'A'), ('p4', 'A')])
+        self.assertTrue(qualifications.qualified('b', 'C'))
+        self.assertFalse(qualifications.qualified('D', 'C'))
+
+class DistanceIndexTestCase(unittest.TestCase):
+
+    def test_distances(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE interCity (cityID INTEGER PRIMARY KEY, cityName TEXT, latitude REAL, longitude REAL)')
+        conn.executemany('INSERT INTO interCity VALUES (?, ?, ?, ?)', [
+            (1, 'London', 51.5074, -0.1278), (2, 'Cardiff', 51.4816, -3.1791), (5, 'Nowhere', None, None)
+        ])
+        index = distances.DistanceIndex(max_paths=2)
+        index.load(conn)
+        london_cardiff, back, unknown = index.distances([(1, 2), (2, 1, 2), (1, 7, 2)])
+        self.assertAlmostEqual(london_cardiff[1], 211.24, places=1)
+        self.assertAlmostEqual(back[1], 2 * london_cardiff[1])
+        self.assertEqual((unknown[0], unknown[1]), ([None, None], None))
+        self.assertEqual(index.distances([(1, None), (5, 1)]), [([None], None), ([None], None)])
+
+        # Least recently used routes are dropped
+        self.assertEqual((index.hits, index.misses, len(index._paths)), (0, 5, 2))
+        self.assertEqual(index.distances([(1, 2)]), [london_cardiff])
+        self.assertEqual(index.misses, 6)
+
+class RosteringTestCase(unittest.TestCase):
+
+    def test_solve(self):
+        # 'a' has rested after flight 1 by flight 2, but an existing duty landing at 250 clashes with it,
+        # so flight 2 goes to 'b' and 'a' is free again for flight 3
+        def busy_until(staff_id, departure, arrival):
+            return 250 if staff_id == 'a' and departure < 280 and arrival > 150 else None
+
+        flights = [(300, 400, 3, 'C', 1, 0), (0, 100, 1, 'C', 1, 0), (140, 200, 2, 'C', 1, 0), (150, 200, 4, 'F', 1, 0)]
+        pilots = {'A': rostering.Pool(['x']), 'C': rostering.Pool(['b', 'a'])}
+        assignments, unfilled = rostering.solve(flights, pilots, rostering.Pool([]), busy_until, 30)
+        self.assertEqual(assignments, [(1, 'a', 'pilot'), (2, 'b', 'pilot'), (4, 'x', 'pilot'), (3, 'a', 'pilot')])
+        self.assertEqual(unfilled, {})
+
+        # Nobody rated for a D airframe is free
+        assignments, unfilled = rostering.solve([(0, 100, 5, 'D', 2, 1)], {'E': rostering.Pool(['e'])}, rostering.Pool([]), busy_until, 30)
+        self.assertEqual((assignments, unfilled), ([], {5: (2, 1)}))
+
+class UtilizationTestCase(unittest.TestCase):
+
+    def test_report(self):
+        rosters = {'b': crew.Roster([(1000, 1100, 4)]), 'a': crew.Roster([(0, 100, 1), (50, 300, 2), (400, 500, 3)])}
+        columns = utilization.flatten(rosters)
+        keys, flights, block, idle, longest = utilization.report(columns, 0, 1000)
+        # Flight 2 overlaps flight 1, so the only idle time is from 300 to 400
+        self.assertEqual((keys, flights.tolist(), block.tolist(), idle.tolist(), longest.tolist()), (['a'], [3], [450], [100], [100]))
+
+        keys, flights, block, idle, longest = utilization.report(columns, 50, 2000)
+        self.assertEqual((keys, flights.tolist(), idle.tolist()), (['a', 'b'], [2, 1], [100, 0]))
+        self.assertEqual(utilization.report(columns, 2000, 3000)[0], [])
+
+class BrokerTestCase(unittest.TestCase):
+
+    def test_since_and_reset(self):
+        broker = events.Broker(capacity=3)
+        start = broker.latest
+        for n in range(3):
+            broker.publish('A' if n % 2 == 0 else 'B', {'type': 'test', 'n': n})
+        found, latest = broker.since(start, 'A')
+        self.assertEqual([event['n'] for _, _, event in found], [0, 2])
+        self.assertEqual(broker.since(latest), ([], latest))
+
+        # One more pushes the first event out of the log: a subscriber from the start must reset
+        broker.publish('A', {'type': 'test', 'n': 3})
+        self.assertEqual(broker.since(start), (None, latest + 1))
+        self.assertIsNone(broker.since(latest + 5)[0])
+
+    def test_wait(self):
+        broker = events.Broker()
+        self.assertFalse(broker.wait(broker.latest, 0.01))
+        threading.Timer(0.05, broker.publish, ('A', {'type': 'test'})).start()
+        self.assertTrue(broker.wait(broker.latest, 5))
+
+class ConnectionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.pool = db.ConnectionPool(os.path.join(self.tmpdir.name, 'pool.db'), max_size=1, timeout=0.05)
+
+    def tearDown(self):
+        self.pool.close()
+        self.tmpdir.cleanup()
+
+    def test_pragmas_applied(self):
+        conn = self.pool.acquire()
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+        self.pool.release(conn)
+
+    def test_reuse_and_rollback(self):
+        conn = self.pool.acquire()
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.execute('INSERT INTO t VALUES (1)')
+        self.pool.release(conn)
+
+        # The uncommitted insert is rolled back before the connection is reused
+        again = self.pool.acquire()
+        self.assertIs(again, conn)
+        self.assertFalse(again.in_transaction)
+        stats = self.pool.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.pool.release(again)
+
+    def test_exhausted_pool_times_out(self):
+        conn = self.pool.acquire()
+        with self.assertRaises(sqlite3.OperationalError):
+            self.pool.acquire()
+        self.pool.release(conn)
+
+class MigrationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.conn = sqlite3.connect(os.path.join(self.tmpdir.name, 'migrate.db'))
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmpdir.cleanup()
+
+    def test_migrate_to_latest(self):
+        self.assertEqual(migrations.migrate(self.conn), migrations.LATEST_VERSION)
+        # Running again is a no-op, without even a backfill pass
+        with mock.patch.object(migrations, 'backfill_epoch_times') as backfill:
+            self.assertEqual(migrations.migrate(self.conn), migrations.LATEST_VERSION)
+        backfill.assert_not_called()
+
+    def test_session_secret_shared(self):
+        migrations.migrate(self.conn)
+        secret = sessions.stored_secret(self.conn)
+        self.assertEqual(len(secret), 64)
+        # Another worker, or the next start, signs with the same key
+        other = sqlite3.connect(os.path.join(self.tmpdir.name, 'migrate.db'))
+        self.addCleanup(other.close)
+        self.assertEqual(sessions.stored_secret(other), secret)
+
+    def test_concurrent_workers(self):
+        # Workers starting together must each apply a step at most once between them
+        path = os.path.join(self.tmpdir.name, 'migrate.db')
+        start = threading.Barrier(4)
+        results = []
+
+        def worker():
+            conn = sqlite3.connect(path, timeout=30)
+            try:
+                start.wait()
+                results.append(migrations.migrate(conn))
+            except sqlite3.Error as e:
+                results.append(e)
+            finally:
+                conn.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [migrations.LATEST_VERSION] * 4)
+
+    def test_upgrade_adds_indexes(self):
+        migrations.migrate(self.conn, target=1)
+        self.assertEqual(migrations.schema_version(self.conn), 1)
+        migrations.migrate(self.conn)
+        plan = self.conn.execute('EXPLAIN QUERY PLAN SELECT * FROM Flight WHERE origin = ? AND destination = ?', ('A', 'B')).fetchall()
+        self.assertIn('idx_flight_route', plan[0][3])
+        plan = self.conn.execute('EXPLAIN QUERY PLAN DELETE FROM Booking WHERE flightNum = ?', (1,)).fetchall()
+        self.assertIn('idx_booking_flight', plan[0][3])
+
+    def test_backfill_epoch_times(self):
+        migrations.migrate(self.conn, target=migrations.MIGRATIONS.index(migrations.add_epoch_times))
+        self.conn.executemany('INSERT INTO Flight (flightNum, origin, destination, arrTime, departureTime) VALUES (?, ?, ?, ?, ?)', [
+            (1, 'A', 'B', '2024-06-01 09:00:00', '2024-06-01 08:00:00'),
+            (2, 'A', 'B', '12:00:00', '15:00:00'),
+            (3, 'A', 'B', '2024-06-01T10:00:00+01:00', '2024-06-01T08:30:00+01:00')
+        ])
+        self.conn.commit()
+        migrations.migrate(self.conn)
+        self.assertEqual(self.conn.execute('SELECT flightNum, departureEpoch, arrivalEpoch FROM Flight ORDER BY flightNum').fetchall(), [
+            (1, routing.parse_time('2024-06-01 08:00:00'), routing.parse_time('2024-06-01 09:00:00')),
+            (2, None, None),
+            (3, routing.parse_time('2024-06-01T08:30:00+01:00'), routing.parse_time('2024-06-01T10:00:00+01:00'))
+        ])
+
+        # New and changed rows are converted on write
+        self.conn.execute("UPDATE Flight SET departureTime = '2024-06-02 08:00:00' WHERE flightNum = 2")
+        self.assertEqual(self.conn.execute('SELECT departureEpoch FROM Flight WHERE flightNum = 2').fetchone()[0], routing.parse_time('2024-06-02 08:00:00'))
+
+        # Rows an interrupted backfill left behind are picked up on the next start
+        self.conn.execute('UPDATE Flight SET departureEpoch = NULL, arrivalEpoch = NULL WHERE flightNum = 1')
+        self.conn.commit()
+        migrations.migrate(self.conn)
+        self.assertEqual(self.conn.execute('SELECT departureEpoch FROM Flight WHERE flightNum = 1').fetchone()[0], routing.parse_time('2024-06-01 08:00:00'))
+
+        # A date that does not parse stays NULL without sending every later start into a backfill
+        self.conn.execute("INSERT INTO Flight (flightNum, origin, destination, arrTime, departureTime) VALUES (4, 'A', 'B', '2024-13-45 09:00:00', '2024-13-45 08:00:00')")
+        self.conn.commit()
+        self.assertFalse(migrations.epochs_missing(self.conn))
+        with mock.patch.object(migrations, 'backfill_epoch_times') as backfill:
+            migrations.migrate(self.conn)
+        backfill.assert_not_called()
+        self.assertEqual(self.conn.execute('SELECT departureEpoch FROM Flight WHERE flightNum = 4').fetchone()[0], None)
+
+
+class BenchLoadTestCase(unittest.TestCase):
+
+    def test_every_route_has_a_scenario(self):
+        workload = bench_load.Workload(None, 1, 0)
+        workload.next_flight = iter(range(1, 1000))
+        workload.num_ser = 1
+        workload.flight_nums, workload.staff, workload.passengers = [1], [1], ['bench']
+        self.assertEqual(bench_load.unbenchmarked(app, workload), [])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,71 @@
+import numpy as np
+
+# Utilization reports (block hours, flights per day, idle time) per airframe and
+# per crew member. The fleet and crew indexes already hold every schedule as
+# rosters kept current by writers; their times are copied once into flat NumPy
+# columns, grouped by airframe or staff member and in departure order within
+# each group, and a report over any date range is then a handful of vectorized
+# passes over those columns. The copy is redone only when the index changes.
+
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 86400
+
+
+def flatten(rosters):
+    """(keys, codes, departures, latest, arrivals) for a {key: Roster} mapping.
+
+    keys are sorted and codes[i] is the position in keys of the roster that
+    row i came from; latest is each roster's running latest arrival.
+    """
+    keys = sorted(rosters)
+    ordered = [rosters[key] for key in keys]
+    lengths = np.fromiter(map(len, ordered), dtype=np.int64, count=len(ordered))
+
+    def column(name):
+        # The rosters' arrays are int64 already: one join of their buffers, no per-roster NumPy objects
+        return np.frombuffer(b''.join([getattr(roster, name) for roster in ordered]), dtype=np.int64)
+
+    codes = np.repeat(np.arange(len(keys)), lengths)
+    return keys, codes, column('times'), column('latest'), column('arrivals')
+
+
+class RosterColumns:
+    """flatten() of an index's rosters, kept until the index moves on. Call inside index.reading()."""
+
+    def __init__(self, index):
+        self.index = index
+        self._versions = None
+        self._columns = None
+
+    def __call__(self):
+        if self._columns is None or self._versions != self.index.versions:
+            self._columns = flatten(self.index.rosters())
+            self._versions = self.index.versions
+        return self._columns
+
+
+def report(columns, start, end):
+    """Keys with flights departing in [start, end), and for each of them arrays of
+    the flights, block seconds, idle seconds and longest idle stretch.
+
+    Idle time runs from the latest landing so far to the next departure of
+    the same key within the range; overlapping flights leave no idle time.
+    """
+    keys, codes, departures, latest, arrivals = columns
+    in_range = np.flatnonzero((departures >= start) & (departures < end))
+    codes, departures, arrivals = codes[in_range], departures[in_range], arrivals[in_range]
+    # In-range flights of a key are contiguous, so where the row before is the same key the
+    # roster's running latest arrival there is the latest landing so far
+    previous = latest[in_range[1:] - 1]
+    same = codes[1:] == codes[:-1]
+    gaps = np.maximum(departures[1:] - previous, 0)[same]
+    gap_codes = codes[1:][same]
+
+    flights = np.bincount(codes, minlength=len(keys))
+    block = np.bincount(codes, weights=arrivals - departures, minlength=len(keys))
+    idle = np.bincount(gap_codes, weights=gaps, minlength=len(keys))
+    longest = np.zeros(len(keys), dtype=np.int64)
+    np.maximum.at(longest, gap_codes, gaps)
+
+    active = np.flatnonzero(flights)
+    return [keys[code] for code in active.tolist()], flights[active], block[active], idle[active], longest[active]
@@ -41,6 +41,7 @@ function LoginForm({ onSignUp }) {
       if (response.ok) {
         setNotification({ open: true, message: result.message, severity: 'success' });
         Cookies.set('passengerID', result.username, { expires: 7 });
+        Cookies.set('sessionToken', result.token, { expires: result.expiresIn / 86400 });
 
         router.push('/dashboard');
       } else {
@@ -17,7 +17,7 @@ import {
   TablePagination,
   Typography,
 } from '@mui/material';
-import { useSearchParams } from 'next/navigation';
+import { useRouter, useSearchParams } from 'next/navigation';
 import { styled } from '@mui/material/styles';
 import Layout from '../../components/Layout';
 import Cookies from 'js-cookie'; // Import js-cookie
@@ -39,6 +39,7 @@ const BookFlight = () => {
   const [rowsPerPage, setRowsPerPage] = useState(10);
   const [flightData, setFlightData] = useState([]);
 
+  const router = useRouter();
   const searchParams = useSearchParams();
   const origin = searchParams.get('departure');
   const destination = searchParams.get('destination');
@@ -91,14 +92,23 @@ const BookFlight = () => {
       };
 
       try {
+        const sessionToken = Cookies.get('sessionToken');
         const response = await fetch('http://127.0.0.1:5000/api/booking', {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
+            ...(sessionToken ? { Authorization: `Bearer ${sessionToken}` } : {}),
           },
           body: JSON.stringify(bookingData),
         });
 
+        if (response.status === 401) {
+          // The session expired or was logged out: sign in again
+          Cookies.remove('sessionToken');
+          Cookies.remove('passengerID');
+          router.push('/');
+          return;
+        }
         if (response.ok) {
           setSnackbarOpen(true);
         } else {
@@ -12,6 +12,7 @@ import {
   Box,
 } from '@mui/material';
 import { styled } from '@mui/material/styles';
+import { useRouter } from 'next/navigation';
 import Layout from '../../components/Layout';
 import Cookies from 'js-cookie'; // Import js-cookie
 
@@ -22,6 +23,7 @@ const TableHeader = styled(TableCell)(({ theme }) => ({
 
 const Dashboard = () => {
   const [flightData, setFlightData] = useState([]);
+  const router = useRouter();
 
   useEffect(() => {
     const fetchData = async () => {
@@ -32,7 +34,17 @@ const Dashboard = () => {
       }
 
       try {
-        const response = await fetch(`http://localhost:5000/api/bookings/${passengerID}`);
+        const sessionToken = Cookies.get('sessionToken');
+        const response = await fetch(`http://localhost:5000/api/bookings/${passengerID}`, {
+          headers: sessionToken ? { Authorization: `Bearer ${sessionToken}` } : {},
+        });
+        if (response.status === 401) {
+          // The session expired or was logged out: sign in again
+          Cookies.remove('sessionToken');
+          Cookies.remove('passengerID');
+          router.push('/');
+          return;
+        }
         if (response.ok) {
           const data = await response.json();
           console.log(data);
@@ -47,7 +59,7 @@ const Dashboard = () => {
     };
 
     fetchData();
-  }, []);
+  }, [router]);
 
   return (
     <Layout>